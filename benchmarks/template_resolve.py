@@ -0,0 +1,54 @@
+#!/usr/bin/env python2.7
+
+"""Measure the per-segment cost of resolving SegmentTemplate URLs."""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import scootplayer.segments as segments
+
+MEDIA = '$RepresentationID$/$Bandwidth$/segment_$Number%05d$_$Time$.m4s'
+ITERATIONS = 100000
+
+
+class Element(object):
+
+    """Minimal stand-in for a SegmentTemplate XML element."""
+
+    attrib = {'media': MEDIA, 'timescale': '90000', 'duration': '180000',
+              'startNumber': '1', 'initialization': '$RepresentationID$.mp4'}
+
+    def get(self, key, default=None):
+        """Return an attribute, as `lxml` elements do."""
+        return self.attrib.get(key, default)
+
+
+def replace_resolve(media, **kwargs):
+    """Resolve a template with a `str.replace` per identifier."""
+    for key, value in kwargs.items():
+        media = media.replace('$' + key + '$', str(value))
+    return media
+
+
+def report(name, seconds):
+    """Print the cost of a single resolution in microseconds."""
+    print '%-28s %6.3f us/segment' % (name, seconds / ITERATIONS * 1e6)
+
+
+if __name__ == '__main__':
+    TEMPLATE = segments.Template(Element())
+    SOURCE = segments.TemplateSegments(TEMPLATE, 'http://localhost/', 'video',
+                                       500000, ITERATIONS)
+    report('str.replace per identifier', timeit.timeit(
+        lambda: replace_resolve(MEDIA, RepresentationID='video',
+                                Bandwidth=500000, Number=42, Time=7380000),
+        number=ITERATIONS))
+    report('Template.resolve', timeit.timeit(
+        lambda: TEMPLATE.resolve(RepresentationID='video', Bandwidth=500000,
+                                 Number=42, Time=7380000),
+        number=ITERATIONS))
+    report('TemplateSegments[index]', timeit.timeit(
+        lambda: SOURCE[42], number=ITERATIONS))
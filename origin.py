@@ -0,0 +1,48 @@
+#!/usr/bin/env python2.7
+
+"""Parses command line options and serves a local DASH origin."""
+
+import scootplayer.origin as origin
+import optparse
+
+if __name__ == '__main__':
+    PARSER = optparse.OptionParser()
+    PARSER.set_defaults(directory='examples/mpd', host='127.0.0.1',
+                        port=8000, profile='unlimited', throughput=None,
+                        latency=None, verbose=False)
+    PARSER.add_option("-d", "--directory", dest="directory",
+                      help="""directory of MPDs to serve
+                      [default: %default]""")
+    PARSER.add_option("--host", dest="host",
+                      help="address to listen on [default: %default]")
+    PARSER.add_option("-p", "--port", dest="port",
+                      help="port to listen on [default: %default]")
+    PARSER.add_option("--profile", dest="profile", type="choice",
+                      choices=sorted(origin.PROFILES.keys()),
+                      help="""shape each connection to the throughput and
+                      latency of a network profile: %s [default: %%default]"""
+                      % ', '.join(sorted(origin.PROFILES.keys())))
+    PARSER.add_option("--throughput", dest="throughput",
+                      help="""set the throughput of each connection in
+                      kilobits per second, overriding the profile, or
+                      unlimited if zero""")
+    PARSER.add_option("--latency", dest="latency",
+                      help="""set the latency of each response in
+                      milliseconds, overriding the profile""")
+    PARSER.add_option("-v", "--verbose", dest="verbose", action="store_true",
+                      help="log each request [default: %default]")
+    (OPTIONS, _) = PARSER.parse_args()
+    THROUGHPUT, LATENCY = origin.PROFILES[OPTIONS.profile]
+    if OPTIONS.throughput is not None:
+        THROUGHPUT = float(OPTIONS.throughput)
+    if OPTIONS.latency is not None:
+        LATENCY = float(OPTIONS.latency)
+    SERVER = origin.Origin((OPTIONS.host, int(OPTIONS.port)),
+                           OPTIONS.directory, THROUGHPUT, LATENCY,
+                           OPTIONS.verbose)
+    for manifest in SERVER.content.manifests:
+        print manifest
+    try:
+        SERVER.serve_forever()
+    except KeyboardInterrupt:
+        SERVER.server_close()
@@ -2,6 +2,8 @@
 
 """Parses command line options and passes them to a new player."""
 
+import scootplayer.abr as abr
+import scootplayer.fleet as fleet
 import scootplayer.player as player
 import optparse
 
@@ -14,7 +16,16 @@ if __name__ == '__main__':
                         remote_control_port='5556', playback_time=0,
                         window_multiplier=5, vlc=False, url=False,
                         conn_pool=100, proc_pool=4, write=True, max_retries=3,
-                        threading=False, timeout=1, watchdog=True)
+                        threading=False, timeout=1, watchdog=True,
+                        abr='nearest', manifest_cache=None,
+                        manifest_cache_size=64, download_pipeline=1,
+                        sync_interval=0, coalesce_duration=0,
+                        coalesce_size=4096, engine='threads',
+                        initialisation='all', sink='file', sink_size=64,
+                        hedge_percentile=0, hedge_lower=False, abandon=False,
+                        bandwidth_estimator='last', bandwidth_percentile=50,
+                        traffic=None,
+                        replay=None, simulate=False, fleet=0)
     PARSER.add_option("-m", "--manifest", dest="manifest",
                       help="location of manifest to load")
     PARSER.add_option("-o", "--output", dest="output",
@@ -63,8 +74,8 @@ if __name__ == '__main__':
                       help="""set the amount of simultaneous connections that
                       can be made [default: %default]""")
     PARSER.add_option("--process-pool", dest="proc_pool",
-                      help="""set the amount of processes that can be used to
-                      fetch the initialisation [default: %default]""")
+                      help="""set the amount of threads that can be used to
+                      fetch the initialisations [default: %default]""")
     PARSER.add_option("--no-write", dest="write", action="store_false",
                       help="""prevent the player writing downloaded files to
                       disk [default: %default]""")
@@ -72,8 +83,8 @@ if __name__ == '__main__':
                       help="""set the amount of retries attempted when fetching
                       remote content [default: %default]""")
     PARSER.add_option("--threading", dest="threading", action="store_true",
-                      help="""use multithreading rather than multiprocessing
-                      when downloading the initialisations""")
+                      help="""deprecated: initialisations are always fetched
+                      by a pool of threads""")
     PARSER.add_option("--timeout", dest="timeout",
                       help="""stop waiting for a response after a given number
                       of seconds [default: %default]""")
@@ -82,10 +93,100 @@ if __name__ == '__main__':
     PARSER.add_option("-l", "--live-stats", dest="live", action="store_true",
                       help="""update playback statistics in realtime, rather
                       than at the end of playback (useful for visualisation)""")
+    PARSER.add_option("--abr", dest="abr", type="choice",
+                      choices=sorted(abr.ALGORITHMS.keys()),
+                      help="""adaptive bitrate algorithm used to select
+                      representations: %s [default: %%default]"""
+                      % ', '.join(sorted(abr.ALGORITHMS.keys())))
+    PARSER.add_option("--manifest-cache", dest="manifest_cache",
+                      help="""directory in which to cache parsed MPDs between
+                      runs""")
+    PARSER.add_option("--manifest-cache-size", dest="manifest_cache_size",
+                      help="""set maximum size of the manifest cache in
+                      megabytes [default: %default]""")
+    PARSER.add_option("--download-pipeline", dest="download_pipeline",
+                      help="""set the amount of segments that can be
+                      downloaded concurrently [default: %default]""")
+    PARSER.add_option("--sync-interval", dest="sync_interval",
+                      help="""sync downloads to disk after this many megabytes
+                      are written to a file, or never if zero
+                      [default: %default]""")
+    PARSER.add_option("--coalesce-duration", dest="coalesce_duration",
+                      help="""fetch contiguous byte ranges of up to this many
+                      seconds with a single request, or never if zero
+                      [default: %default]""")
+    PARSER.add_option("--coalesce-size", dest="coalesce_size",
+                      help="""set maximum size of a coalesced request in
+                      kilobytes [default: %default]""")
+    PARSER.add_option("--engine", dest="engine", type="choice",
+                      choices=['threads', 'asyncore'],
+                      help="""download with a thread per request (threads), or
+                      on a single event loop (asyncore) [default: %default]""")
+    PARSER.add_option("--initialisation", dest="initialisation",
+                      type="choice", choices=['all', 'lazy', 'prefetch'],
+                      help="""fetch every initialisation before playback (all),
+                      or only the first, fetching the rest when first needed
+                      (lazy) or in the background (prefetch)
+                      [default: %default]""")
+    PARSER.add_option("--sink", dest="sink", type="choice",
+                      choices=['file', 'memory'],
+                      help="""write downloads to file, or keep the most recent
+                      in a ring buffer in memory, logging their checksums
+                      [default: %default]""")
+    PARSER.add_option("--sink-size", dest="sink_size",
+                      help="""set size of the memory sink in megabytes
+                      [default: %default]""")
+    PARSER.add_option("--hedge-percentile", dest="hedge_percentile",
+                      help="""issue a hedged request for a segment taking longer
+                      than this percentile of recent downloads, or never if
+                      zero (threads engine only) [default: %default]""")
+    PARSER.add_option("--hedge-lower", dest="hedge_lower",
+                      action="store_true",
+                      help="""request hedged segments at the lowest bitrate
+                      [default: %default]""")
+    PARSER.add_option("--abandon", dest="abandon", action="store_true",
+                      help="""abandon downloads which would stall playback in
+                      favour of the lowest bitrate (threads engine only)
+                      [default: %default]""")
+    PARSER.add_option("--bandwidth-estimator", dest="bandwidth_estimator",
+                      type="choice", choices=['last', 'ewma', 'harmonic',
+                                              'percentile'],
+                      help="""estimate the bandwidth from the last download
+                      (last), a dual exponentially weighted moving average
+                      (ewma), or the harmonic mean (harmonic) or a percentile
+                      (percentile) of recent downloads [default: %default]""")
+    PARSER.add_option("--bandwidth-percentile", dest="bandwidth_percentile",
+                      help="""set the percentile of recent downloads used by
+                      the percentile estimator [default: %default]""")
+    PARSER.add_option("--traffic", dest="traffic",
+                      help="""emulate the traffic conditions of a trace file of
+                      time (s), throughput (kbit/s) and latency (ms) rows""")
+    PARSER.add_option("--replay", dest="replay",
+                      help="""replay the segment requests of a schedule file
+                      (such as the requests.csv or event.csv of a previous
+                      run) in place of the ABR algorithm""")
+    PARSER.add_option("--simulate", dest="simulate", action="store_true",
+                      help="""play on a virtual clock, faster than real time,
+                      downloading synthetic content over the link of the
+                      traffic file (or instantly without one)
+                      [default: %default]""")
+    PARSER.add_option("--fleet", dest="fleet",
+                      help="""run a fleet of this many players in one process,
+                      sharing connections and parsed MPDs, each writing to
+                      a directory of its own [default: %default]""")
     (OPTIONS, _) = PARSER.parse_args()
+    if (OPTIONS.engine == 'asyncore' or OPTIONS.simulate) and \
+            (float(OPTIONS.hedge_percentile) or OPTIONS.abandon):
+        PARSER.error('--hedge-percentile and --abandon are not available '
+                     'with --engine asyncore or --simulate')
+    if OPTIONS.simulate and OPTIONS.replay:
+        PARSER.error('--replay is not available with --simulate')
     if (OPTIONS.manifest is not None or OPTIONS.playlist is not None) and not \
         (OPTIONS.manifest and OPTIONS.playlist) \
             or OPTIONS.remote_control_host:
-                player.Player(OPTIONS)
+                if int(OPTIONS.fleet):
+                    fleet.Fleet(OPTIONS, int(OPTIONS.fleet)).run()
+                else:
+                    player.Player(OPTIONS)
     else:
         PARSER.print_help()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python2.7
+
+"""Adaptive bitrate algorithms used to choose between representations."""
+
+import abc
+import bisect
+import math
+
+
+class Ladder(object):
+
+    """
+    The bitrates of a set of representations, sorted in ascending order.
+
+    Built once when an MPD is parsed, so that each decision is a binary
+    search rather than a scan over every representation.
+
+    """
+
+    def __init__(self, bandwidths):
+        """Initialise the ladder from a list of bandwidths."""
+        self.bandwidths = sorted(bandwidths)
+
+    def __len__(self):
+        """Return the number of rungs on the ladder."""
+        return len(self.bandwidths)
+
+    def __getitem__(self, index):
+        """Return the bandwidth of the given rung."""
+        return self.bandwidths[index]
+
+    def nearest(self, bandwidth):
+        """Return the index of the bandwidth closest to the one given."""
+        index = bisect.bisect_left(self.bandwidths, bandwidth)
+        if index == len(self.bandwidths):
+            return index - 1
+        if index > 0 and bandwidth - self.bandwidths[index - 1] <= \
+                self.bandwidths[index] - bandwidth:
+            return index - 1
+        return index
+
+    def highest_below(self, bandwidth):
+        """
+        Return the index of the highest bandwidth which does not exceed the
+        one given, or the lowest rung if they all do.
+
+        """
+        return max(bisect.bisect_right(self.bandwidths, bandwidth) - 1, 0)
+
+
+class Algorithm(object):
+
+    """
+    Base class of the adaptive bitrate algorithms.
+
+    An algorithm is created for each ladder and is asked to select a rung
+    given the current bandwidth estimation (in bits per second) and the
+    level of the playback buffer (in seconds).
+
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, ladder, options):
+        """Initialise the algorithm for the given ladder."""
+        self.ladder = ladder
+        self.options = options
+
+    @abc.abstractmethod
+    def select(self, bandwidth, buffer_level):
+        """Return the index of the selected rung on the ladder."""
+
+
+class Nearest(Algorithm):
+
+    """Select the bitrate closest to the bandwidth estimation."""
+
+    def select(self, bandwidth, buffer_level):
+        """Return the rung nearest to the bandwidth estimation."""
+        return self.ladder.nearest(bandwidth)
+
+
+class Throughput(Algorithm):
+
+    """
+    Select the highest bitrate sustainable by the bandwidth estimation,
+    allowing a safety margin.
+
+    """
+
+    safety = 0.9
+
+    def select(self, bandwidth, buffer_level):
+        """Return the highest rung below a fraction of the bandwidth."""
+        return self.ladder.highest_below(bandwidth * self.safety)
+
+
+class BufferBased(Algorithm):
+
+    """
+    Buffer-based algorithm (BBA-0, Huang et al.).
+
+    Below the reservoir the lowest bitrate is selected, and above the
+    cushion the highest. In between, bitrate is mapped linearly from the
+    buffer level.
+
+    """
+
+    reservoir_fraction = 0.2
+    cushion_fraction = 0.6
+
+    def __init__(self, ladder, options):
+        """Derive the reservoir and cushion from the maximum buffer size."""
+        super(BufferBased, self).__init__(ladder, options)
+        buffer_max = float(options.max_playback_queue)
+        self.reservoir = buffer_max * self.reservoir_fraction
+        self.cushion = buffer_max * self.cushion_fraction
+
+    def select(self, bandwidth, buffer_level):
+        """Return the rung mapped from the buffer level."""
+        if buffer_level <= self.reservoir:
+            return 0
+        if buffer_level >= self.reservoir + self.cushion:
+            return len(self.ladder) - 1
+        rate = self.ladder[0] + (self.ladder[-1] - self.ladder[0]) * \
+            (buffer_level - self.reservoir) / self.cushion
+        return self.ladder.highest_below(rate)
+
+
+class Bola(Algorithm):
+
+    """
+    Buffer Occupancy based Lyapunov Algorithm (BOLA-basic, Spiteri et al.).
+
+    Utilities and control parameters depend only on the ladder and buffer
+    size, so they are calculated once, along with the buffer level above
+    which each rung is preferred to the one below it. With logarithmic
+    utilities these thresholds increase up the ladder, so each decision is
+    a binary search rather than a score of every rung.
+
+    """
+
+    minimum_buffer = 10.0
+
+    def __init__(self, ladder, options):
+        """Precompute the utility of each rung and the control parameters."""
+        super(Bola, self).__init__(ladder, options)
+        self.utilities = [math.log(float(bitrate) / ladder[0]) + 1
+                          for bitrate in ladder.bandwidths]
+        buffer_max = float(options.max_playback_queue)
+        minimum_buffer = min(self.minimum_buffer, buffer_max / 2)
+        if len(ladder) > 1:
+            self.gp = (self.utilities[-1] - 1) / \
+                (buffer_max / minimum_buffer - 1)
+            self.vp = minimum_buffer / self.gp
+        else:
+            self.gp = self.vp = 0
+        self.rungs = [index for index, bitrate in enumerate(ladder.bandwidths)
+                      if not index or bitrate != ladder[index - 1]]
+        self.thresholds = [self._threshold(lower, upper) for lower, upper in
+                           zip(self.rungs, self.rungs[1:])]
+
+    def select(self, bandwidth, buffer_level):
+        """Return the rung maximising the BOLA objective."""
+        if not self.gp:
+            return 0
+        return self.rungs[bisect.bisect_left(self.thresholds, buffer_level)]
+
+    def _threshold(self, lower, upper):
+        """
+        Return the buffer level above which the upper of two rungs scores
+        higher than the lower.
+
+        """
+        lower_bitrate = float(self.ladder[lower])
+        upper_bitrate = float(self.ladder[upper])
+        return self.vp * (
+            (upper_bitrate * self.utilities[lower] -
+             lower_bitrate * self.utilities[upper]) /
+            (upper_bitrate - lower_bitrate) + self.gp)
+
+
+class Hybrid(Algorithm):
+
+    """
+    Combine the throughput and buffer-based algorithms.
+
+    Throughput alone is used to fill the reservoir at startup. After that,
+    the more conservative of the two decisions is taken.
+
+    """
+
+    def __init__(self, ladder, options):
+        """Create the throughput and buffer-based algorithms to combine."""
+        super(Hybrid, self).__init__(ladder, options)
+        self.throughput = Throughput(ladder, options)
+        self.buffer_based = BufferBased(ladder, options)
+
+    def select(self, bandwidth, buffer_level):
+        """Return the lower of the throughput and buffer-based rungs."""
+        throughput = self.throughput.select(bandwidth, buffer_level)
+        if buffer_level <= self.buffer_based.reservoir:
+            return throughput
+        return min(throughput,
+                   self.buffer_based.select(bandwidth, buffer_level))
+
+
+ALGORITHMS = {'nearest': Nearest,
+              'throughput': Throughput,
+              'bba': BufferBased,
+              'bola': Bola,
+              'hybrid': Hybrid}
@@ -3,36 +3,266 @@
 """Facilitates the measurement of current network bandwidth."""
 
 import collections
+import heapq
+import threading
 
 
-class Bandwidth(object):
-    """Object containing the current bandwidth estimation."""
+class Last(object):
+
+    """Estimates the bandwidth as that of the most recent download."""
 
     def __init__(self):
+        """Initialise with no download recorded."""
+        self._estimate = 0
+
+    def update(self, bandwidth, duration=1):
+        """Record the bandwidth of a download."""
+        self._estimate = bandwidth
+
+    def estimate(self):
+        """Return the current estimate."""
+        return self._estimate
+
+
+class Ewma(object):
+
+    """
+    Exponentially weighted moving average of the bandwidth, weighted by the
+    duration of each download.
+
+    Two averages are kept: one which adapts quickly and one which adapts
+    slowly. The lower of the two is used, so that the estimate falls as soon
+    as the bandwidth drops but only recovers once an increase is sustained.
+    The half-lives are given in seconds of downloading.
+
+    """
+
+    def __init__(self, fast=3.0, slow=8.0):
+        """Initialise the averages with the given half-lives in seconds."""
+        self._averages = [[half_life, 0.0, 0.0] for half_life in
+                          [fast, slow]]
+
+    def update(self, bandwidth, duration=1):
+        """Record the bandwidth of a download, in constant time."""
+        for average in self._averages:
+            weight = 0.5 ** (duration / average[0])
+            average[1] = bandwidth * (1 - weight) + average[1] * weight
+            average[2] = (1 - weight) + average[2] * weight
+
+    def estimate(self):
+        """
+        Return the current estimate. Each average is corrected for the bias
+        towards zero of its initial value.
+
+        """
+        if not self._averages[0][2]:
+            return 0
+        return min(total / weight for _, total, weight in self._averages)
+
+
+class HarmonicMean(object):
+
+    """
+    Harmonic mean of the bandwidth of the most recent downloads.
+
+    The sum of the reciprocals is kept as samples enter and leave the
+    window, so each update takes constant time. Being dominated by the
+    smallest values, the harmonic mean is robust against outlying fast
+    downloads.
+
+    """
+
+    def __init__(self, window=20):
+        """Initialise an empty window of the given number of downloads."""
+        self._window = collections.deque(maxlen=window)
+        self._reciprocals = 0.0
+
+    def update(self, bandwidth, duration=1):
+        """Record the bandwidth of a download, in constant time."""
+        if bandwidth <= 0:
+            return
+        if len(self._window) == self._window.maxlen:
+            self._reciprocals -= 1.0 / self._window[0]
+        self._window.append(bandwidth)
+        self._reciprocals += 1.0 / bandwidth
+
+    def estimate(self):
+        """Return the current estimate."""
+        if not self._window:
+            return 0
+        return len(self._window) / self._reciprocals
+
+
+class Percentile(object):
+
+    """
+    Percentile of the bandwidth of the most recent downloads.
+
+    The window is split between two heaps: a max-heap of the samples up to
+    the percentile and a min-heap of those above it, so the percentile is
+    the top of the first. Samples leaving the window are only marked as
+    removed, and are discarded once they reach the top of their heap, so
+    each update takes logarithmic time. The heaps are rebuilt whenever they
+    hold more removed samples than live ones, which keeps memory bounded.
+
+    """
+
+    def __init__(self, window=20, percentile=50):
+        """Initialise an empty window, estimating the given percentile."""
+        self._window = collections.deque(maxlen=window)
+        self._percentile = percentile
+        self._lower = _Heap(-1)
+        self._upper = _Heap(1)
+
+    def update(self, bandwidth, duration=1):
+        """Record the bandwidth of a download, in logarithmic time."""
+        if len(self._window) == self._window.maxlen:
+            oldest = self._window[0]
+            if self._lower and oldest <= self._lower.top():
+                self._lower.remove(oldest)
+            else:
+                self._upper.remove(oldest)
+        self._window.append(bandwidth)
+        if self._lower and bandwidth <= self._lower.top():
+            self._lower.push(bandwidth)
+        else:
+            self._upper.push(bandwidth)
+        rank = min(int(len(self._window) * self._percentile / 100.0),
+                   len(self._window) - 1)
+        while len(self._lower) > rank + 1:
+            self._upper.push(self._lower.pop())
+        while len(self._lower) < rank + 1:
+            self._lower.push(self._upper.pop())
+
+    def estimate(self):
+        """Return the current estimate."""
+        if not self._lower:
+            return 0
+        return self._lower.top()
+
+
+class _Heap(object):
+
+    """
+    Heap of samples with lazy removal, ordered smallest first (with a sign
+    of 1) or largest first (with a sign of -1).
+
+    """
+
+    def __init__(self, sign):
+        """Initialise an empty heap ordered by the given sign."""
+        self._sign = sign
+        self._heap = []
+        self._removed = collections.Counter()
+        self._size = 0
+
+    def __len__(self):
+        """Return the number of samples which have not been removed."""
+        return self._size
+
+    def push(self, value):
+        """Add a sample."""
+        heapq.heappush(self._heap, self._sign * value)
+        self._size += 1
+
+    def top(self):
+        """Return the first sample."""
+        self._prune()
+        return self._sign * self._heap[0]
+
+    def pop(self):
+        """Remove and return the first sample."""
+        self._prune()
+        self._size -= 1
+        return self._sign * heapq.heappop(self._heap)
+
+    def remove(self, value):
+        """Mark a sample as removed."""
+        self._removed[self._sign * value] += 1
+        self._size -= 1
+        if len(self._heap) > 2 * self._size + 1:
+            self._compact()
+
+    def _prune(self):
+        """Discard removed samples from the top of the heap."""
+        while self._heap and self._removed[self._heap[0]]:
+            self._removed[heapq.heappop(self._heap)] -= 1
+
+    def _compact(self):
+        """Rebuild the heap without the samples marked as removed."""
+        heap = []
+        for value in self._heap:
+            if self._removed[value]:
+                self._removed[value] -= 1
+            else:
+                heap.append(value)
+        heapq.heapify(heap)
+        self._heap = heap
+        self._removed.clear()
+
+
+ESTIMATORS = collections.OrderedDict([('last', Last), ('ewma', Ewma),
+                                      ('harmonic', HarmonicMean),
+                                      ('percentile', Percentile)])
+
+
+class Bandwidth(object):
+
+    """
+    Object containing the current bandwidth estimation.
+
+    Every estimator is updated with each download (or each interval of a
+    download in progress), so that they can be compared, but only the one
+    selected is used as the current estimation. Downloads (and the
+    intervals of transfers in progress) change the estimation from several
+    threads at once, so the estimators are only used under a lock.
+
+    """
+
+    def __init__(self, estimator='last', percentile=50):
+        """Initialise every estimator, selecting the one named."""
+        self._estimator = estimator
+        self._estimators = collections.OrderedDict(
+            (name, class_()) for name, class_ in ESTIMATORS.items())
+        self._estimators['percentile'] = Percentile(percentile=percentile)
         self._current = 0
         self._previous = 0
         self._trend = collections.deque(maxlen=100)
+        self._lock = threading.Lock()
 
-    def change(self, bandwidth):
+    def change(self, bandwidth, duration=1):
         """
-        Change the current bandwidth estimation.
+        Change the current bandwidth estimation, given the bandwidth of a
+        download and the time (in seconds) it took.
 
         Also records a bandwidth trend (1 for increasing, 0 for the same
         and -1 for decreasing).
 
         """
-        self._previous = self._current
-        self._current = bandwidth
-        if self._current > self._previous:
-            self._trend.append(1)
-        elif self._current == self._previous:
-            self._trend.append(0)
-        elif self._current < self._previous:
-            self._trend.append(-1)
+        with self._lock:
+            for estimator in self._estimators.values():
+                estimator.update(bandwidth, duration)
+            self._previous = self._current
+            self._current = int(
+                self._estimators[self._estimator].estimate())
+            if self._current > self._previous:
+                self._trend.append(1)
+            elif self._current == self._previous:
+                self._trend.append(0)
+            elif self._current < self._previous:
+                self._trend.append(-1)
+
+    def estimates(self):
+        """Return the estimation of each estimator, keyed by name."""
+        with self._lock:
+            return collections.OrderedDict(
+                ('estimate_' + name, int(estimator.estimate()))
+                for name, estimator in self._estimators.items())
 
     def historical_trend(self):
         """Return the historical trend in bandwidth."""
-        return list(self._trend)
+        with self._lock:
+            return list(self._trend)
 
     def __str__(self):
         """Returns the current estimated bandwidth."""
@@ -41,3 +271,59 @@ class Bandwidth(object):
     def __int__(self):
         """Returns the current estimated bandwidth."""
         return int(self._current)
+
+
+class Progress(object):
+
+    """
+    Throughput samples of a single transfer in progress.
+
+    Each sample is the amount of bits of a chunk and the time (in seconds)
+    since the previous chunk, or since the request for the first. Once an
+    interval of time has been sampled, its throughput changes the bandwidth
+    estimation, so that a slow transfer lowers the estimation before it
+    completes. The rest is changed when the transfer is flushed.
+
+    """
+
+    interval = 1.0
+
+    def __init__(self, bandwidth, start):
+        """Start sampling a transfer requested at the given time."""
+        self.bandwidth = bandwidth
+        self.samples = collections.deque(maxlen=1000)
+        self._previous = start
+        self._length = 0
+        self._duration = 0
+
+    def sample(self, length, now):
+        """Record a chunk of bits which arrived at the given time."""
+        duration = now - self._previous
+        self._previous = now
+        self.samples.append((length, duration))
+        self._length += length
+        self._duration += duration
+        if self._duration >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Change the bandwidth estimation by the unflushed samples."""
+        if self._length and self._duration:
+            self.bandwidth.change(int(self._length / self._duration),
+                                  self._duration)
+        self._length = 0
+        self._duration = 0
+
+    def sampled(self, count=None):
+        """
+        Return the throughput of the most recent samples (in bits per
+        second), or zero if there are none.
+
+        """
+        samples = list(self.samples)
+        if count:
+            samples = samples[-count:]
+        duration = sum(duration for _, duration in samples)
+        if not duration:
+            return 0
+        return int(sum(length for length, _ in samples) / duration)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python2.7
+
+"""Caches of parsed MPDs, shared between runs or players."""
+
+import cPickle
+import hashlib
+import os
+import tempfile
+
+
+class ManifestCache(object):
+
+    """
+    Stores the parsed model of each MPD on disk, keyed by a hash of the
+    content of the MPD.
+
+    Entries are pickled and written atomically. The size of the cache is
+    bounded, with the least recently used entries evicted first.
+
+    """
+
+    version = 2
+    suffix = '.mpdc'
+
+    def __init__(self, directory, max_size):
+        """Initialise the cache in a directory, with a maximum size in bytes."""
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, path, origin=''):
+        """
+        Return the key of an MPD from its content.
+
+        The origin is included as it is used to resolve relative URLs.
+
+        """
+        digest = hashlib.sha1()
+        digest.update('%s\n%s\n' % (self.version, origin))
+        with open(path, 'rb') as file_:
+            for block in iter(lambda: file_.read(65536), ''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        """Return the location of the entry with the given key."""
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """
+        Return the model stored under the given key, or `None` if absent.
+
+        Marks the entry as recently used.
+
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file_:
+                model = cPickle.load(file_)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return model
+
+    def put(self, key, model):
+        """Store a model under the given key, then evict if over size."""
+        handle, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as file_:
+            cPickle.dump(model, file_, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until within size."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class MemoryManifestCache(ManifestCache):
+
+    """
+    Keeps the parsed model of each MPD in memory, keyed as on disk, so that
+    the players of a fleet parse each MPD once. Only the representations are
+    copied (as playback changes them), so segments are shared between every
+    player. Models are never evicted.
+
+    """
+
+    def __init__(self):
+        """Initialise an empty cache."""
+        self.models = dict()
+
+    def get(self, key):
+        """Return the model stored under the given key, or `None` if absent."""
+        return self.models.get(key)
+
+    def put(self, key, model):
+        """Store a model under the given key."""
+        self.models[key] = dict(model, representations=[
+            dict(representation) for representation in
+            model['representations']])
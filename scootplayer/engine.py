@@ -0,0 +1,375 @@
+#!/usr/bin/env python2.7
+
+"""Event loop engine, used to download without a thread per request."""
+
+import asyncore
+import collections
+import errno
+import fcntl
+import heapq
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import urlparse
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Engine(object):
+
+    """
+    Runs calls, timers and HTTP requests on a single `asyncore` loop.
+
+    Calls and timers may be scheduled from any thread. Requests must be
+    started from the loop itself (such as from a scheduled call). Idle
+    connections are kept for reuse by later requests to the same host.
+
+    """
+
+    def __init__(self, timeout):
+        """Initialise the engine with a request inactivity timeout."""
+        self.timeout = timeout
+        self._map = dict()
+        self._calls = collections.deque()
+        self._timers = []
+        self._timer_count = 0
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+        self._active = set()
+        self._waker = _Waker(self._map)
+
+    def call_soon(self, function, args=()):
+        """Run a function on the loop as soon as possible."""
+        self._calls.append((function, args))
+        self._waker.wake()
+
+    def call_later(self, delay, function, args=()):
+        """Run a function on the loop after a delay in seconds."""
+        with self._lock:
+            self._timer_count += 1
+            heapq.heappush(self._timers, (time.time() + delay,
+                                          self._timer_count, function, args))
+        self._waker.wake()
+
+    def fetch(self, url, headers, handler):
+        """
+        Start a GET request on the loop.
+
+        The handler is told of the status and headers of the response, with
+        the time at which the connection was established (returning `False`
+        to abandon it). It is then given each chunk of the body as it
+        arrives. Finally it is told whether the request failed.
+
+        """
+        self._dispatch(Request(url, headers, handler))
+
+    def run(self):
+        """Run the loop forever."""
+        while True:
+            self._run_calls()
+            self._check_timeouts()
+            asyncore.loop(timeout=self._wait(), map=self._map, count=1)
+
+    def _run_calls(self):
+        """Run the scheduled calls and the timers which are due."""
+        while self._calls:
+            _call(*self._calls.popleft())
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > now:
+                    break
+                _, _, function, args = heapq.heappop(self._timers)
+            _call(function, args)
+
+    def _wait(self):
+        """Return how long the loop may wait for the sockets."""
+        with self._lock:
+            if self._calls:
+                return 0
+            if self._timers:
+                return max(min(self._timers[0][0] - time.time(), 1.0), 0)
+        return 1.0
+
+    def _check_timeouts(self):
+        """Fail the requests which have been inactive for too long."""
+        now = time.time()
+        for connection in list(self._active):
+            if now - connection.last_activity > self.timeout:
+                connection.fail('timeout after %ss' % self.timeout)
+
+    def _dispatch(self, request, reuse=True):
+        """Send a request on an idle connection, or on a new one."""
+        idle = self._idle[request.address]
+        if reuse and idle:
+            connection = idle.pop()
+        else:
+            try:
+                connection = Connection(self, request.address)
+            except EnvironmentError as exception:
+                _call(request.handler.done, (str(exception),))
+                return
+        self._active.add(connection)
+        connection.send_request(request)
+
+    def _release(self, connection):
+        """Keep a connection for reuse, once its request is complete."""
+        self._active.discard(connection)
+        self._idle[connection.address].append(connection)
+
+    def _discard(self, connection):
+        """Forget a connection once it has closed."""
+        self._active.discard(connection)
+        try:
+            self._idle[connection.address].remove(connection)
+        except ValueError:
+            pass
+
+
+class Request(object):
+
+    """A GET request for a single URL."""
+
+    def __init__(self, url, headers, handler):
+        """Build the request message from a URL and headers."""
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != 'http':
+            raise ValueError('unsupported URL scheme: ' + url)
+        self.address = (parts.hostname, parts.port or 80)
+        self.handler = handler
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers)
+        headers.setdefault('Host', parts.netloc)
+        headers.setdefault('Accept-Encoding', 'identity')
+        self.close = headers.get('Connection', '').lower() == 'close'
+        self.message = 'GET ' + path + ' HTTP/1.1\r\n' + ''.join(
+            name + ': ' + str(value) + '\r\n'
+            for name, value in headers.items()) + '\r\n'
+
+
+class Connection(asyncore.dispatcher):
+
+    """
+    A minimal HTTP/1.1 client connection.
+
+    Handles bodies delimited by length, chunked encoding or the closing of
+    the connection. One request is in progress at a time.
+
+    """
+
+    def __init__(self, engine, address):
+        """
+        Open a (non-blocking) connection to the given address. Raises
+        `socket.error` if the address cannot be resolved or connected to.
+
+        """
+        asyncore.dispatcher.__init__(self, map=engine._map)
+        self.engine = engine
+        self.address = address
+        self.request = None
+        self.reused = False
+        self.connected_at = None
+        self.last_activity = time.time()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect(address)
+        except EnvironmentError:
+            self.close()
+            raise
+
+    def send_request(self, request):
+        """Start sending a request."""
+        self.request = request
+        self.last_activity = time.time()
+        self._out = request.message
+        self._buffer = ''
+        self._state = 'status'
+        self._received = False
+        self._remaining = None
+        self._headers = dict()
+
+    def writable(self):
+        """Return whether there is data to send, or a pending connect."""
+        return not self.connected or bool(self.request and self._out)
+
+    def handle_connect(self):
+        """
+        Record the time the connection was established. The request is sent
+        once the socket is writable.
+
+        """
+        self.connected_at = time.time()
+
+    def handle_write(self):
+        """Send as much of the request as the socket allows."""
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+        self.last_activity = time.time()
+
+    def handle_read(self):
+        """Receive and parse part of the response."""
+        data = self.recv(CHUNK_SIZE)
+        if data and self.request:
+            self.last_activity = time.time()
+            self._received = True
+            self._feed(data)
+
+    def handle_close(self):
+        """Complete or fail the request when the server closes."""
+        self.close()
+        if self.request:
+            if self._state == 'body' and self._remaining is None:
+                self._finish()
+            elif self.reused and not self._received:
+                request, self.request = self.request, None
+                self.engine._dispatch(request, reuse=False)
+            else:
+                self.fail('connection closed')
+
+    def handle_error(self):
+        """Fail the request on an unexpected error."""
+        exception = sys.exc_info()[1]
+        self.close()
+        if self.request:
+            self.fail(str(exception))
+
+    def close(self):
+        """Close the socket and remove it from the engine."""
+        asyncore.dispatcher.close(self)
+        self.engine._discard(self)
+
+    def fail(self, error):
+        """Abandon the request in progress, closing the connection."""
+        request, self.request = self.request, None
+        self.close()
+        if request:
+            _call(request.handler.done, (error,))
+
+    def _feed(self, data):
+        """Parse received data according to the state of the response."""
+        while data and self.request:
+            if self._state in ['body', 'chunk']:
+                data = self._body(data)
+                continue
+            self._buffer += data
+            data = ''
+            while self.request and self._state not in ['body', 'chunk'] \
+                    and '\r\n' in self._buffer:
+                line, self._buffer = self._buffer.split('\r\n', 1)
+                self._line(line)
+            if self._state in ['body', 'chunk']:
+                data, self._buffer = self._buffer, ''
+
+    def _line(self, line):
+        """Parse a line of the status, headers or chunk framing."""
+        if self._state == 'status':
+            parts = line.split(' ', 2)
+            self._version = parts[0]
+            self._status = int(parts[1])
+            self._state = 'headers'
+        elif self._state == 'headers':
+            if line:
+                name, _, value = line.partition(':')
+                self._headers[name.strip().lower()] = value.strip()
+            elif 100 <= self._status < 200:
+                self._state = 'status'
+            else:
+                self._start_body()
+        elif self._state == 'chunk_size':
+            self._remaining = int(line.split(';')[0], 16)
+            self._state = 'chunk' if self._remaining else 'trailer'
+        elif self._state == 'chunk_end':
+            self._state = 'chunk_size'
+        elif self._state == 'trailer' and not line:
+            self._finish()
+
+    def _start_body(self):
+        """Tell the handler of the response, then decide how it ends."""
+        if _call(self.request.handler.response,
+                 (self._status, self._headers, self.connected_at)) is False:
+            self.fail('abandoned')
+        elif self._status in [204, 304]:
+            self._finish()
+        elif 'chunked' in self._headers.get('transfer-encoding', ''):
+            self._state = 'chunk_size'
+        elif 'content-length' in self._headers:
+            self._remaining = int(self._headers['content-length'])
+            self._state = 'body'
+            if not self._remaining:
+                self._finish()
+        else:
+            self._state = 'body'
+
+    def _body(self, data):
+        """Pass body data to the handler, returning any data beyond it."""
+        if self._remaining is None:
+            chunk, data = data, ''
+        else:
+            chunk, data = data[:self._remaining], data[self._remaining:]
+            self._remaining -= len(chunk)
+        _call(self.request.handler.chunk, (chunk,))
+        if self._remaining == 0:
+            if self._state == 'chunk':
+                self._state = 'chunk_end'
+            else:
+                self._finish()
+        return data
+
+    def _finish(self):
+        """Complete the request, keeping the connection if allowed."""
+        request, self.request = self.request, None
+        if self.connected and not request.close and \
+                self._version == 'HTTP/1.1' and \
+                self._headers.get('connection', '').lower() != 'close':
+            self.reused = True
+            self.engine._release(self)
+        else:
+            self.close()
+        _call(request.handler.done, (None,))
+
+
+class _Waker(asyncore.file_dispatcher):
+
+    """Pipe used to wake the loop when calls are scheduled."""
+
+    def __init__(self, map_):
+        """Create the pipe and watch its reading end."""
+        read, self._write = os.pipe()
+        fcntl.fcntl(self._write, fcntl.F_SETFL, os.O_NONBLOCK)
+        asyncore.file_dispatcher.__init__(self, read, map=map_)
+        os.close(read)
+
+    def wake(self):
+        """Wake the loop, if it is waiting."""
+        try:
+            os.write(self._write, 'x')
+        except OSError as exception:
+            if exception.errno != errno.EAGAIN:
+                raise
+
+    def writable(self):
+        """Never wait to write to the pipe."""
+        return False
+
+    def handle_read(self):
+        """Empty the pipe."""
+        self.recv(CHUNK_SIZE)
+
+
+def _call(function, args):
+    """
+    Call a function on the loop.
+
+    Errors are printed rather than raised, so that one failing call does not
+    stop the loop for everything else.
+
+    """
+    try:
+        return function(*args)
+    except Exception:
+        traceback.print_exc()
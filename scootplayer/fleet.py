@@ -0,0 +1,85 @@
+#!/usr/bin/env python2.7
+
+"""Runs a fleet of players in a single process."""
+
+import os
+import signal
+import threading
+import time
+
+import scootplayer.player as player
+
+# Resources of the first player which are shared by the rest of the fleet.
+SHARED = ['fetch_pool', 'remote_manifests', 'session', 'engine',
+          'simulation', 'manifest_cache']
+
+
+class Fleet(object):
+
+    """
+    A number of isolated players, competing with each other as clients.
+
+    Each player has its own state and output directory, but every player
+    shares the fetch pool, the HTTP session (whose connection pool limits
+    the connections of the whole fleet), the engine or simulation, any
+    traffic shaping and the parsed MPDs. Once every player has exited, so
+    does the process.
+
+    """
+
+    shaper = None
+
+    def __init__(self, options, size):
+        """Initialise a fleet of the given number of players."""
+        self.options = options
+        self.size = size
+        self.players = []
+        self._resources = None
+        self._exited = set()
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Start each player in turn, then run until they have all exited."""
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGQUIT, self._signal_handler)
+        width = len(str(self.size))
+        for index in range(self.size):
+            self.players.append(player.Player(
+                self.options, fleet=self,
+                name='client%0*d' % (width, index + 1)))
+        if self._resources['simulation']:
+            self._resources['simulation'].run()
+            self._exit()
+        while True:
+            time.sleep(1)
+
+    def share(self, player_):
+        """
+        Give a player the resources of the fleet, which are those created by
+        the first player.
+
+        """
+        if self._resources is None:
+            player_.create_resources()
+            self._resources = dict((name, getattr(player_, name))
+                                   for name in SHARED)
+        for name, value in self._resources.items():
+            setattr(player_, name, value)
+
+    def exited(self, player_):
+        """Record that a player has exited, exiting once every player has."""
+        with self._lock:
+            self._exited.add(player_.name)
+            if len(self._exited) == self.size:
+                os._exit(0)
+
+    def _exit(self):
+        """Exit every player which is still running, then the process."""
+        for player_ in self.players:
+            if player_.state != 'exit':
+                player_.exit()
+        os._exit(0)
+
+    def _signal_handler(self, signum, frame):
+        """Handle interrupt signals from user."""
+        self._exit()
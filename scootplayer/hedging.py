@@ -0,0 +1,207 @@
+#!/usr/bin/env python2.7
+
+"""Tail latency controls for segment downloads."""
+
+import collections
+import threading
+import time
+
+
+class Control(object):
+
+    """
+    Allows a download in progress to be cancelled.
+
+    A download is cancelled when it loses a race against a hedged request,
+    or abandoned when, at its current rate, it would complete after the
+    playback buffer has drained.
+
+    """
+
+    grace = 0.5
+
+    def __init__(self, player=None, abandon=False):
+        """Initialise the control of a single download."""
+        self.player = player
+        self.abandon = abandon
+        self.start = time.time()
+        self.cancelled = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason):
+        """Cancel the download."""
+        self.reason = reason
+        self.cancelled.set()
+
+    def proceed(self, received, expected):
+        """
+        Return whether the download should carry on, given the amount of
+        bytes received so far and the amount expected in total.
+
+        """
+        if self.cancelled.is_set():
+            return False
+        elapsed = time.time() - self.start
+        if self.abandon and expected > received > 0 and elapsed > self.grace:
+            remaining = (expected - received) * elapsed / received
+            buffer_level = self.player.buffer_level()
+            if 0 < buffer_level < remaining:
+                self.cancel('abandoned')
+                return False
+        return True
+
+
+class Attempt(object):
+
+    """A download of a single segment, running on its own thread."""
+
+    def __init__(self, player, representation, finished, abandon=False):
+        """Prepare to download the item of a representation."""
+        self.player = player
+        self.representation = representation
+        self.finished = finished
+        self.control = Control(player, abandon)
+        self.done = False
+        self.failed = False
+        self.end = None
+
+    def start(self):
+        """Start the download."""
+        self.player.start_thread(self._run)
+        return self
+
+    def _run(self):
+        """Download the item, then signal that an attempt has finished."""
+        try:
+            self.player.fetch_item(self.representation['item'],
+                                   control=self.control)
+        except SystemExit:
+            self.failed = True
+        self.end = time.time()
+        self.done = True
+        self.finished.set()
+
+    def won(self):
+        """Return whether the attempt completed its download."""
+        return self.done and not self.failed and \
+            not self.control.cancelled.is_set()
+
+
+class Hedger(object):
+
+    """
+    Downloads segments with tail latency controls.
+
+    If a download takes longer than the given percentile of recent download
+    times, a hedged request is issued for the same segment (or the same
+    segment at the lowest bitrate) and whichever completes first is used.
+    Downloads which would stall playback may also be abandoned, in favour of
+    the lowest bitrate. Only the threads engine downloads through the
+    hedger.
+
+    """
+
+    history = 50
+    minimum_history = 10
+
+    def __init__(self, player, percentile=0, lower=False, abandon=False):
+        """Initialise the controls with no download history."""
+        self.player = player
+        self.percentile = percentile
+        self.lower = lower
+        self.abandon = abandon
+        self.latencies = collections.deque(maxlen=self.history)
+        self._lock = threading.Lock()
+
+    def threshold(self):
+        """Return the time after which a download is hedged, if known."""
+        if not self.percentile or len(self.latencies) < self.minimum_history:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * self.percentile / 100.0),
+                             len(latencies) - 1)]
+
+    def fetch(self, representation, report):
+        """
+        Download the segment of a representation, returning the
+        representation which was actually downloaded.
+
+        The latency recorded is that of the segment as a whole, from the
+        start of the original request until the winning attempt completed,
+        so that it is comparable with the threshold which triggers hedges.
+
+        Counts hedges, hedges which won and abandonments in the report. As
+        several downloaders share the report, the counts are kept under a
+        lock.
+
+        """
+        finished = threading.Event()
+        lowest = self.player.managed_objects['representations'].ladder[0]
+        primary = Attempt(self.player, representation, finished,
+                          self.abandon and representation['bandwidth'] >
+                          lowest).start()
+        threshold = self.threshold()
+        attempts = [primary]
+        if threshold is not None and not finished.wait(threshold):
+            self._count(report, 'hedges')
+            hedge = Attempt(self.player, self._alternative(representation),
+                            finished).start()
+            attempts.append(hedge)
+        winner = self._race(attempts, finished)
+        if winner is None:
+            if primary.control.reason != 'abandoned':
+                raise SystemExit()
+            self._count(report, 'abandonments')
+            winner = Attempt(self.player, self._lowest(representation),
+                             finished).start()
+            self._race([winner], finished)
+        elif winner is not primary:
+            self._count(report, 'hedge_wins')
+        self.latencies.append(winner.end - primary.control.start)
+        return winner.representation
+
+    def _count(self, report, counter):
+        """Increment a counter of the report."""
+        with self._lock:
+            report[counter] += 1
+
+    def _race(self, attempts, finished):
+        """
+        Wait for the first attempt to complete, cancelling the rest.
+
+        Returns `None` if none of the attempts completed.
+
+        """
+        while True:
+            finished.wait()
+            finished.clear()
+            winners = [attempt for attempt in attempts if attempt.won()]
+            if winners:
+                for attempt in attempts:
+                    if attempt is not winners[0]:
+                        attempt.control.cancel('lost')
+                return winners[0]
+            if all(attempt.done for attempt in attempts):
+                return None
+
+    def _alternative(self, representation):
+        """Return the representation requested by a hedge."""
+        if self.lower:
+            return self._lowest(representation)
+        return representation
+
+    def _lowest(self, representation):
+        """
+        Return the same segment at the lowest bitrate.
+
+        The duration of the original is kept, as the download and playback
+        queues have already accounted for it.
+
+        """
+        lowest = self.player.managed_objects['representations'].alternative(
+            representation['time'], 0)
+        if not lowest:
+            return representation
+        lowest['item'] = dict(lowest['item'],
+                              duration=representation['item']['duration'])
+        return lowest
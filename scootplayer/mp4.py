@@ -0,0 +1,151 @@
+#!/usr/bin/env python2.7
+
+"""Reads bitrate metadata from the headers of ISO base media (MP4) files."""
+
+import mmap
+import os
+import struct
+
+CONTAINERS = ['moov', 'trak', 'mdia', 'minf', 'stbl']
+VISUAL_ENTRIES = ['avc1', 'avc2', 'avc3', 'avc4', 'hev1', 'hvc1', 'mp4v',
+                  'encv']
+VISUAL_ENTRY_HEADER = 78
+SAMPLE_DESCRIPTION_HEADER = 8
+
+
+def box(type_, payload=''):
+    """Serialise a box of the given type around a payload."""
+    return struct.pack('>I4s', 8 + len(payload), type_) + payload
+
+
+def boxes(data, start=0, end=None):
+    """
+    Iterate over the boxes between two offsets of a buffer.
+
+    Yields the type of each box with the offsets of its payload. Stops at the
+    first truncated box.
+
+    """
+    if end is None:
+        end = len(data)
+    offset = start
+    while offset + 8 <= end:
+        size, type_ = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size, = struct.unpack_from('>Q', data, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield type_, offset + header, offset + size
+        offset += size
+
+
+def find(data, path, start=0, end=None):
+    """Return the payload offsets of the first box at the given path."""
+    for type_, payload_start, payload_end in boxes(data, start, end):
+        if type_ == path[0]:
+            if len(path) == 1:
+                return payload_start, payload_end
+            found = find(data, path[1:], payload_start, payload_end)
+            if found:
+                return found
+    return None
+
+
+def video_bitrate(data, end=None):
+    """
+    Return the maximum and average bitrate (in bits per second) of the video
+    track, or `None` if there is no video track.
+
+    The bitrate is read from the `btrt` box of the video sample entry. If
+    the sample entry has no `btrt` box, the bitrate is derived from a
+    segment index (`sidx`) box, if present. Unknown bitrates are zero.
+
+    """
+    for type_, start, stop in boxes(data, 0, end):
+        if type_ == 'moov':
+            for track, track_start, track_end in boxes(data, start, stop):
+                if track != 'trak':
+                    continue
+                handler = find(data, ['mdia', 'hdlr'], track_start, track_end)
+                if not handler or \
+                        data[handler[0] + 8:handler[0] + 12] != 'vide':
+                    continue
+                return _sample_entry_bitrate(data, track_start, track_end) \
+                    or _segment_index_bitrate(data, end) or (0, 0)
+    return None
+
+
+def _sample_entry_bitrate(data, start, end):
+    """Return the bitrate in the `btrt` box of a visual sample entry."""
+    description = find(data, ['mdia', 'minf', 'stbl', 'stsd'], start, end)
+    if not description:
+        return None
+    for type_, entry_start, entry_end in boxes(
+            data, description[0] + SAMPLE_DESCRIPTION_HEADER, description[1]):
+        if type_ not in VISUAL_ENTRIES:
+            continue
+        bitrate = find(data, ['btrt'], entry_start + VISUAL_ENTRY_HEADER,
+                       entry_end)
+        if bitrate and bitrate[1] - bitrate[0] >= 12:
+            _, maximum, average = struct.unpack_from('>III', data,
+                                                     bitrate[0])
+            return maximum, average
+    return None
+
+
+def _segment_index_bitrate(data, end=None):
+    """
+    Return the bitrate of the largest and average subsegment referenced by
+    a top level `sidx` box.
+
+    """
+    index = find(data, ['sidx'], 0, end)
+    if not index:
+        return None
+    offset = index[0]
+    version, = struct.unpack_from('>B', data, offset)
+    timescale, = struct.unpack_from('>I', data, offset + 8)
+    offset += 20 if version == 0 else 28
+    count, = struct.unpack_from('>H', data, offset + 2)
+    offset += 4
+    if not timescale or offset + count * 12 > index[1]:
+        return None
+    total_size = total_duration = maximum = 0
+    for _ in xrange(count):
+        size, duration = struct.unpack_from('>II', data, offset)
+        size &= 0x7fffffff
+        if duration:
+            maximum = max(maximum, size * 8 * timescale / duration)
+        total_size += size
+        total_duration += duration
+        offset += 12
+    if not total_duration:
+        return None
+    return maximum, total_size * 8 * timescale / total_duration
+
+
+def read_bitrate(path, length=0):
+    """
+    Return the maximum and average video bitrate of an MP4 file.
+
+    The file is memory mapped, so only the headers which are read are paged
+    in. If a length is given, only that many bytes from the start of the file
+    are considered (such as the initialisation range of a single file
+    representation). Returns `None` if there is no video track.
+
+    """
+    with open(path, 'rb') as file_:
+        size = os.fstat(file_.fileno()).st_size
+        if not size:
+            return None
+        data = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return video_bitrate(data, min(length, size) if length else size)
+        finally:
+            data.close()
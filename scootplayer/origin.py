@@ -0,0 +1,348 @@
+#!/usr/bin/env python2.7
+
+"""Local DASH origin, serving synthetic media for a directory of MPDs."""
+
+import BaseHTTPServer
+import os
+import re
+import socket
+import SocketServer
+import struct
+import time
+import urllib
+import urlparse
+
+import aniso8601
+from lxml import etree
+
+import scootplayer.mp4 as mp4
+import scootplayer.segments as segments
+
+CHUNK_SIZE = 64 * 1024
+PATTERN = ''.join(chr(index) for index in range(256)) * (CHUNK_SIZE / 256)
+_PATTERN_TWICE = PATTERN * 2
+
+# Throughput (kbit/s) and latency (ms) of each connection.
+PROFILES = {'unlimited': (0, 0),
+            'lan': (100000, 1),
+            'cable': (20000, 15),
+            'dsl': (6000, 30),
+            '4g': (12000, 60),
+            '3g': (1500, 150),
+            '2g': (200, 400)}
+
+
+class Resource(object):
+
+    """
+    A synthetic file served by the origin.
+
+    The file starts with a header (such as an MPD or an MP4 initialisation)
+    and is padded to its size with a repeating pattern, so that the same
+    byte is always served at the same offset.
+
+    """
+
+    def __init__(self, size=0, header='', content_type='video/mp4'):
+        """Initialise a file of at least the size of its header."""
+        self.size = max(size, len(header))
+        self.header = header
+        self.content_type = content_type
+
+    def read(self, offset, length, chunk_size=CHUNK_SIZE):
+        """Yield the bytes of a range of the file, in chunks."""
+        end = offset + length
+        chunk_size = min(chunk_size, CHUNK_SIZE)
+        while offset < end:
+            size = min(chunk_size, end - offset)
+            if offset < len(self.header):
+                chunk = self.header[offset:offset + size]
+            else:
+                chunk = buffer(_PATTERN_TWICE, offset % len(PATTERN), size)
+            yield chunk
+            offset += len(chunk)
+
+
+class Content(object):
+
+    """
+    The files of the origin, keyed by URL path.
+
+    Each MPD is served with its base URLs pointing at the origin. Segments
+    are sized from the bandwidth and duration of their representation,
+    while files addressed by byte range are large enough to hold every
+    range. Initialisations declare the bandwidth of their representation,
+    so that the player reads a sensible encoded bitrate.
+
+    """
+
+    def __init__(self, url):
+        """Initialise empty content served from the given URL."""
+        self.url = url
+        self.manifests = []
+        self.resources = dict()
+
+    def get(self, path):
+        """Return the file at a (quoted) URL path, or `None`."""
+        return self.resources.get(urllib.unquote(path))
+
+    def load(self, directory):
+        """Add each MPD found in a directory."""
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.mpd'):
+                continue
+            try:
+                self.add_manifest(os.path.join(directory, name))
+            except (etree.XMLSyntaxError, KeyError, ValueError) as exception:
+                print 'could not load ' + name + ': ' + str(exception)
+
+    def add_manifest(self, path, url=None):
+        """
+        Add an MPD and the files of each of its representations. Relative URLs
+        are resolved against the URL of the MPD on the origin, or against the
+        URL it was fetched from, if given.
+
+        """
+        name = os.path.basename(path)
+        url = url or self.url + urllib.quote(name)
+        document = etree.parse(path)
+        root = document.getroot()
+        for element in root.iter('{*}BaseURL'):
+            element.text = self._rewrite(element.text.strip())
+        duration = _duration(root.get('mediaPresentationDuration'))
+        for element in root.iter('{*}Representation'):
+            self._add_representation(element, url, duration)
+        self.resources['/' + name] = Resource(
+            header=etree.tostring(document, xml_declaration=True,
+                                  encoding='UTF-8'),
+            content_type='application/dash+xml')
+        self.manifests.append(url)
+
+    def _rewrite(self, url):
+        """Point an absolute URL at the origin, keeping its path."""
+        parts = urlparse.urlsplit(url)
+        if not parts.scheme:
+            return url
+        origin = urlparse.urlsplit(self.url)
+        return urlparse.urlunsplit((origin.scheme, origin.netloc, parts.path,
+                                    parts.query, ''))
+
+    def _add_representation(self, element, url, duration):
+        """Add the initialisations and segments of a representation."""
+        base_url = _base_url(element, url)
+        bandwidth = int(element.attrib['bandwidth'])
+        id_ = str(element.get('id', ''))
+        header = initialisation(bandwidth)
+        for initialisation_ in element.iter('{*}Initialization'):
+            self._add(urlparse.urljoin(base_url,
+                                       initialisation_.attrib['sourceURL']),
+                      _range_end(initialisation_.get('range')), header)
+        segment_list = element.find('{*}SegmentList')
+        if segment_list is not None:
+            size = int(bandwidth * float(segment_list.attrib['duration']) /
+                       int(segment_list.get('timescale', 1)) / 8)
+            for segment_url in segment_list.iter('{*}SegmentURL'):
+                self._add(urlparse.urljoin(base_url,
+                                           segment_url.attrib['media']),
+                          _range_end(segment_url.get('mediaRange')) or size)
+        template = _inherited(element, 'SegmentTemplate')
+        if template is not None:
+            template = segments.Template(template)
+            segment_duration = float(template.duration) / template.timescale
+            size = int(bandwidth * segment_duration / 8)
+            source = segments.TemplateSegments(
+                template, base_url, id_, bandwidth,
+                int(duration / segment_duration) + 1)
+            for index in xrange(len(source)):
+                self._add(source[index]['url'], size)
+            if template.initialisation:
+                self._add(urlparse.urljoin(base_url,
+                                           template.resolve_initialisation(
+                                               id_, bandwidth)), 0, header)
+
+    def _add(self, url, size, header=''):
+        """Add a file, growing it if it is already known."""
+        path = urllib.unquote(urlparse.urlsplit(url).path)
+        existing = self.resources.get(path)
+        if existing:
+            size = max(size, existing.size)
+            header = header or existing.header
+        self.resources[path] = Resource(size, header)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """
+    Serves the files of the origin over persistent connections.
+
+    Single byte ranges are supported. Each response is delayed by the
+    latency of the origin, and its body is paced to the throughput.
+
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        """Respond with the headers and body of a file."""
+        self._respond(body=True)
+
+    def do_HEAD(self):
+        """Respond with the headers of a file."""
+        self._respond(body=False)
+
+    def _respond(self, body):
+        """Send the whole of a file, or the range requested."""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        resource = self.server.content.get(
+            urlparse.urlsplit(self.path).path)
+        if resource is None:
+            self.send_error(404)
+            return
+        first, last, status = 0, resource.size - 1, 200
+        try:
+            requested = parse_range(self.headers.getheader('Range'),
+                                    resource.size)
+        except ValueError:
+            requested = (first, last)
+        if requested is None:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%s' % resource.size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if requested != (first, last):
+            first, last, status = requested[0], requested[1], 206
+        self.send_response(status)
+        self.send_header('Content-Type', resource.content_type)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes %s-%s/%s' %
+                             (first, last, resource.size))
+        self.end_headers()
+        if body:
+            self._send(resource, first, last - first + 1)
+
+    def _send(self, resource, offset, length):
+        """Write part of a file, paced to the throughput of the origin."""
+        rate = self.server.throughput / 8.0
+        chunk_size = max(1460, int(rate / 100)) if rate else CHUNK_SIZE
+        start = time.time()
+        sent = 0
+        try:
+            for chunk in resource.read(offset, length, chunk_size):
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if rate:
+                    delay = start + sent / rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+        except socket.error:
+            self.close_connection = 1
+
+    def log_message(self, format_, *args):
+        """Log requests only if the origin is verbose."""
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format_, *args)
+
+
+class Origin(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """
+    HTTP origin serving the MPDs of a directory, with a thread per
+    connection. Throughput is given in kilobits per second and latency in
+    milliseconds; zero means unlimited.
+
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, directory, throughput=0, latency=0,
+                 verbose=False):
+        """Bind to an address and load the content of a directory."""
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.throughput = throughput * 1000
+        self.latency = latency / 1000.0
+        self.verbose = verbose
+        self.url = 'http://%s:%s/' % self.server_address[:2]
+        self.content = Content(self.url)
+        self.content.load(directory)
+
+
+def initialisation(bandwidth):
+    """
+    Return a minimal MP4 initialisation, whose video sample entry declares
+    the given bitrate.
+
+    """
+    bitrate = mp4.box('btrt', struct.pack('>III', 0, bandwidth, bandwidth))
+    entry = mp4.box('avc1', '\0' * mp4.VISUAL_ENTRY_HEADER + bitrate)
+    description = mp4.box('stsd', struct.pack('>II', 0, 1) + entry)
+    handler = mp4.box('hdlr', struct.pack('>II4s', 0, 0, 'vide') +
+                      '\0' * 12 + 'VideoHandler\0')
+    media = handler + mp4.box('minf', mp4.box('stbl', description))
+    return mp4.box('ftyp', 'iso5' + struct.pack('>I', 0) + 'iso5dash') + \
+        mp4.box('moov', mp4.box('trak', mp4.box('mdia', media)))
+
+
+def parse_range(header, size):
+    """
+    Return the first and last byte of a (single) Range header, or `None` if
+    the range cannot be satisfied. Without a header, the whole file is
+    returned.
+
+    Raises `ValueError` if the header is malformed.
+
+    """
+    if not header:
+        return 0, size - 1
+    match = re.match(r'bytes=(\d*)-(\d*)$', header.strip())
+    if not match or not any(match.groups()):
+        raise ValueError('unsupported range: ' + header)
+    first, last = match.groups()
+    if not first:
+        if not int(last):
+            return None
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        return None
+    return first, last
+
+
+def _duration(duration):
+    """Return the duration of a presentation in seconds, or zero."""
+    try:
+        return aniso8601.parse_duration(duration).total_seconds()
+    except (TypeError, IndexError, ValueError):
+        return 0
+
+
+def _range_end(media_range):
+    """Return the size of file needed to hold a byte range, or zero."""
+    if not media_range:
+        return 0
+    return int(media_range.split('-')[1]) + 1
+
+
+def _base_url(element, url):
+    """Resolve the base URL of an element against the URL of its MPD."""
+    for ancestor in list(reversed(list(element.iterancestors()))) + \
+            [element]:
+        base_url = ancestor.find('{*}BaseURL')
+        if base_url is not None:
+            url = urlparse.urljoin(url, base_url.text)
+    return url
+
+
+def _inherited(element, tag):
+    """Return the child of an element or its nearest ancestor with a tag."""
+    for ancestor in [element] + list(element.iterancestors()):
+        child = ancestor.find('{*}' + tag)
+        if child is not None:
+            return child
+    return None
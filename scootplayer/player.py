@@ -2,6 +2,7 @@
 
 """Experimental MPEG-DASH player emulator."""
 
+from multiprocessing.pool import ThreadPool
 import os
 import requests
 import shutil
@@ -10,59 +11,122 @@ import threading
 import time
 
 import scootplayer.bandwidth as bandwidth
+import scootplayer.cache as cache
+import scootplayer.engine as engine
 import scootplayer.queue as queue
 import scootplayer.remote as remote
 import scootplayer.reporter as reporter
+import scootplayer.replay as replay
 import scootplayer.representations as representations
+import scootplayer.simulation as simulation
+import scootplayer.sink as sink
+import scootplayer.timing as timing
+import scootplayer.traffic as traffic
 import scootplayer.watchdog as watchdog
 import scootplayer.progressbar as progressbar
 
+CHUNK_SIZE = 64 * 1024
 
 class Player(object):
 
     """Main player which facilitates interaction between the other modules."""
     bandwidth = None
-    managed_objects = {'download': None,
-                       'playback': None,
-                       'playlist': None,
-                       'representations': None,
-                       'reporter': None,
-                       'watchdog': None,
-                       'remote_control': None}
+    shaper = None
+    managed_objects = None
+    fleet = None
+    name = ''
     session = None
-    threads = list()
+    engine = None
+    simulation = None
+    manifest_cache = None
+    remote_manifests = None
+    fetch_pool = None
+    threads = None
     progress_bar = None
     state = 'stop'
     directory = ''
     current_manifest = ''
 
-    def __init__(self, options):
-        """Initialise the player and start playback."""
+    def __init__(self, options, fleet=None, name=''):
+        """
+        Initialise the player and start playback.
+
+        A player in a fleet shares the resources of the fleet, writes to a
+        directory of its own name and runs alongside the other players
+        rather than taking over the current thread.
+
+        """
         self.options = options
-        self._setup_signal_handling()
-        self.managed_objects['remote_control'] = remote.RemoteControl(
-            self, options)
+        self.fleet = fleet
+        self.name = name
+        self.managed_objects = dict.fromkeys(['download', 'playback',
+                                              'playlist', 'representations',
+                                              'reporter', 'sink', 'watchdog',
+                                              'remote_control'])
+        self.threads = list()
+        self._threads_lock = threading.Lock()
+        if fleet:
+            fleet.share(self)
+        else:
+            self._setup_signal_handling()
+            self.create_resources()
+            self.managed_objects['remote_control'] = remote.RemoteControl(
+                self, options)
         self.managed_objects['playlist'] = queue.playlist.PlaylistQueue(
             player=self, options=options)
         self.next()
-        self._consumer()
+        if fleet and not self.simulation:
+            self.start_thread(self._consumer)
+        else:
+            self._consumer()
+
+    def create_resources(self):
+        """
+        Create the resources which last for the lifetime of the player: the
+        fetch pool, the HTTP session, the engine (or simulation) and the
+        manifest caches.
+
+        In a fleet, these are created once and shared by every player. The
+        connection pool then blocks when full, so that its size limits the
+        connections of the whole fleet, and parsed MPDs are kept in memory
+        if there is no manifest cache.
+
+        """
+        self.fetch_pool = ThreadPool(processes=int(self.options.proc_pool))
+        self.remote_manifests = {}
+        self.session = self._create_session()
+        if self.options.simulate:
+            self.simulation = self._create_simulation()
+            self.engine = self.simulation
+        elif self.options.engine == 'asyncore':
+            self.engine = engine.Engine(float(self.options.timeout))
+            self.start_thread(self.engine.run)
+        if self.options.manifest_cache:
+            self.manifest_cache = cache.ManifestCache(
+                self.options.manifest_cache,
+                int(self.options.manifest_cache_size) * 1024 * 1024)
+        elif self.fleet:
+            self.manifest_cache = cache.MemoryManifestCache()
 
     def next(self):
         """Move onto the next item in the playlist, resetting everything."""
         if self.managed_objects['playlist'].empty():
             self.event('empty', 'playlist')
             self.exit()
+            return
+        self._retire()
         self._directory_setup()
+        if self.managed_objects['sink']:
+            self.managed_objects['sink'].stop()
+        self.managed_objects['sink'] = self._create_sink()
         self.managed_objects['reporter'] = reporter.Reporter(self)
         self.event('next', 'playing item')
         self.pause()
-        self.session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(
-            pool_connections=int(self.options.conn_pool),
-            pool_maxsize=int(self.options.conn_pool),
-            max_retries=int(self.options.max_retries))
-        self.session.mount('http://', adapter)
-        self.bandwidth = bandwidth.Bandwidth()
+        self.bandwidth = bandwidth.Bandwidth(
+            self.options.bandwidth_estimator,
+            float(self.options.bandwidth_percentile))
+        self.shaper = self._create_shaper()
+        self._candidate = None
         self.current_manifest = self.managed_objects['playlist'].get()
         self.managed_objects['representations'] = \
             representations.Representations(self, self.current_manifest)
@@ -82,14 +146,96 @@ class Player(object):
         self._setup_scheduled_stop(self.options.playback_time)
         self.resume()
 
+    def _create_session(self):
+        """
+        Create the HTTP session used for all requests.
+
+        The session (and its pool of connections) lasts for the lifetime of
+        the player, so connections are reused across playlist items.
+
+        """
+        session = requests.Session()
+        adapter = timing.TimedHTTPAdapter(
+            pool_connections=int(self.options.conn_pool),
+            pool_maxsize=int(self.options.conn_pool),
+            max_retries=int(self.options.max_retries),
+            pool_block=bool(self.fleet))
+        session.mount('http://', adapter)
+        return session
+
+    def _create_sink(self):
+        """Create the sink to which the downloads of an item are written."""
+        if self.options.sink == 'memory':
+            return sink.MemorySink(
+                int(float(self.options.sink_size) * 1024 * 1024),
+                log=self.open_file('/checksums.csv'))
+        return sink.FileSink(
+            self.directory + '/downloads',
+            int(float(self.options.sync_interval) * 1024 * 1024))
+
+    def _create_shaper(self):
+        """
+        Create the shaper replaying the traffic file, if one is given. The
+        shaper waits on the thread of each download, so is not used by the
+        event loop engine.
+
+        In a fleet, every player shares the shaper created first, so that
+        they compete for the same link (as they do in a simulation).
+
+        """
+        if not self.options.traffic or self.engine:
+            return None
+        if self.fleet and self.fleet.shaper:
+            return self.fleet.shaper
+        shaper = traffic.Shaper(traffic.Trace.load(self.options.traffic),
+                                CHUNK_SIZE * 8)
+        if self.fleet:
+            self.fleet.shaper = shaper
+        return shaper
+
+    def _create_simulation(self):
+        """
+        Create the simulation on whose virtual clock the player runs, with a
+        link replaying the traffic file (if one is given).
+
+        """
+        trace = None
+        if self.options.traffic:
+            trace = traffic.Trace.load(self.options.traffic)
+        simulation_ = simulation.Simulation(trace)
+        timing.clock = simulation_.time
+        return simulation_
+
     def _directory_setup(self):
-        """Create directory for storing downloads"""
+        """
+        Create directory for storing downloads. If an item starts within the
+        same second as the previous one (as on a virtual clock), a suffix is
+        added to keep their directories apart. A player with a name (such as
+        one in a fleet) has a directory of that name for its items.
+        """
         time_now = str(int(time.time()))
-        self.directory = '/'.join(__file__.split('/')
-                                  [:-2]) + '/' + self.options.output + \
-            '/' + time_now
+        output = '/'.join(__file__.split('/')[:-2]) + '/' + \
+            self.options.output + '/'
+        if self.name:
+            output += self.name + '/'
+        self.directory = output + time_now
+        count = 0
+        while os.path.exists(self.directory):
+            count += 1
+            self.directory = output + time_now + '-' + str(count)
         self.create_directory()
 
+    def _retire(self):
+        """
+        Retire the objects of the previous item, so that their loops and
+        timers end rather than running (or polling, on a virtual clock) for
+        the rest of the playlist.
+
+        """
+        for name in ['download', 'playback', 'reporter', 'watchdog']:
+            if self.managed_objects[name]:
+                self.managed_objects[name].retired = True
+
     def _consumer(self):
         """
         Fetch a representation matching the current bandwidth. Add this to the
@@ -97,18 +243,43 @@ class Player(object):
 
         If the player is not playing, wait for a second before
         checking again if the playback is resumed.
+
+        If a replay file is given, its schedule is downloaded instead. On a
+        virtual clock, the simulation is run until the player exits.
         """
-        while True:
-            self.progress_bar.next(0)
-            if self.state == 'play':
-                representation = self.managed_objects['representations'] \
-                    .candidate(int(self.bandwidth))
-                if representation:
-                    self.managed_objects['download'].add(representation)
-                else:
-                    time.sleep(0.01)
-            else:
-                time.sleep(0.01)
+        if self.simulation:
+            self.start_loop(self._consume)
+            if not self.fleet:
+                self.simulation.run()
+            return
+        if self.options.replay:
+            schedule = replay.Schedule.load(self.options.replay)
+            replay.Replay(self, schedule).run()
+            return
+        _loop(self._consume)
+
+    def _consume(self):
+        """
+        Offer the download queue a representation matching the current
+        bandwidth, holding on to it until the queue has room.
+
+        Returns the time to wait before the next attempt, or `None` once the
+        player has exited.
+        """
+        if self.state == 'exit':
+            return None
+        self.progress_bar.next(0)
+        if self.state != 'play':
+            return 0.01
+        if not self._candidate:
+            self._candidate = self.managed_objects['representations'] \
+                .candidate(int(self.bandwidth), self.buffer_level())
+            if not self._candidate:
+                return 0.01
+        if not self.managed_objects['download'].offer(self._candidate):
+            return 0.01
+        self._candidate = None
+        return 0
 
     def _setup_scheduled_stop(self, time_):
         """
@@ -120,9 +291,16 @@ class Player(object):
             self.start_timed_thread(time_, self.exit)
 
     def exit(self):
-        """Stop playback and exit player."""
+        """
+        Stop playback and exit player. A player in a fleet leaves the fleet
+        instead, which exits once every player has.
+        """
         self.state = 'exit'
         self.stop()
+        self.state = 'exit'
+        if self.fleet:
+            self.fleet.exited(self)
+            return
         os._exit(0)  # TODO: No cleanup on exit
         # sys.exit(0)
 
@@ -163,21 +341,19 @@ class Player(object):
     def make_request(self, item):
         """Make a HTTP request for a single item within the playback queue."""
         url = item['url']
-        headers = {}
-        if item['bytes_to'] != 0:
-            byte_range = 'bytes=%s-%s' % (item['bytes_from'], item['bytes_to'])
-            headers['Range'] = byte_range
+        headers = _range_headers(item)
+        if self.shaper:
+            self.shaper.delay()
         try:
             response = self.session.get(url, headers=headers,
-                                        timeout=float(self.options.timeout))
+                                        timeout=float(self.options.timeout),
+                                        stream=True)
         except requests.exceptions.Timeout as exception:
             self.event('error', 'timeout: ' + str(exception))
             response = None  # Return a None value if timeout occurred
         except requests.exceptions.ConnectionError as exception:
             self.event('error', 'connection error: ' + str(exception))
             response = None  # Return a None value if connection has failed
-        if not self.options.keep_alive:
-            response.connection.close()
         return response
 
     def open_file(self, path):
@@ -185,13 +361,12 @@ class Player(object):
         file_name = self.directory + path
         return open(file_name, 'w')
 
-    def fetch_item(self, item, dummy=False):
+    def fetch_item(self, item, dummy=False, control=None):
         """
         Fetch an individual item from a remote location.
 
-        Writes the item to file. Also updates the bandwidth based upon the
-        duration of the transaction and the amount of bits received in that
-        time.
+        Streams the item to file, updating the bandwidth as the body
+        arrives. If a control is given, it may cancel the download part way.
 
         Returns:
             duration: time taken to fulfil the request
@@ -200,16 +375,27 @@ class Player(object):
 
         """
         if not dummy:
+            if self.engine:
+                return self._fetch_on_engine(item)
             self.event('start', 'downloading ' + str(item['url']))
-            response, duration = self._time_request(item)
+            record = timing.Timing(item)
+            response = self.make_request(item)
             if not response:
                 self.event('error', 'no response returned from '
                            + str(item['url']) + '; writing to dummy file')
                 return self.fetch_item(item, dummy=True)
+            record.response(timing.connected_at(response))
             self._check_code(response.status_code, item['url'])
-            length = get_length(response)
-            path = self._write_to_file(item, response.content)
-            self.update_bandwidth(duration, length)
+            length, path = self._stream_to_file(item, response, control,
+                                                record.start)
+            if control and control.cancelled.is_set():
+                self.event('cancel', 'downloading ' + str(item['url']) +
+                           ' (' + str(control.reason) + ')')
+            record.finish(length)
+            duration = record.end - record.start
+            if not self.options.keep_alive:
+                response.connection.close()
+            self.log_request(record)
             self.event('stop', 'downloading ' + str(item['url']) +
                        ' (' + str(length) + 'b)')
             return duration, length, path
@@ -217,10 +403,73 @@ class Player(object):
             path = self._write_to_file(item, '')
             return 0, 0, path
 
+    def fetch_item_async(self, item, callback):
+        """
+        Fetch an individual item on the engine, without waiting.
+
+        Must be called on the engine's loop. The callback is given the same
+        result as `fetch_item`, or `None` if the item could not be
+        downloaded.
+
+        """
+        self._start_fetch(_Fetch(self, item, callback))
+
+    def _start_fetch(self, handler):
+        """Start the request of a handler on the engine."""
+        item = handler.item
+        self.event('start', 'downloading ' + str(item['url']))
+        headers = _range_headers(item)
+        if not self.options.keep_alive:
+            headers['Connection'] = 'close'
+        try:
+            self.engine.fetch(item['url'], headers, handler)
+        except ValueError as exception:
+            self.event('error', str(exception))
+            handler.callback(None)
+
+    def _fetch_on_engine(self, item):
+        """
+        Fetch an item on the engine, waiting for the result.
+
+        The engine fails requests which are inactive for longer than the
+        timeout. Should no result arrive within twice that, a dummy file is
+        written instead, so that a lost result cannot block the player.
+
+        """
+        done = threading.Event()
+        result = []
+
+        def callback(value):
+            result.append(value)
+            done.set()
+
+        handler = _Fetch(self, item, callback)
+        self.engine.call_soon(self._start_fetch, (handler,))
+        if self.simulation:
+            self.simulation.run(until=done.is_set)
+        else:
+            timeout = float(self.options.timeout)
+            while not done.wait(timeout):
+                if timing.now() - handler.last_activity > 2 * timeout:
+                    self.event('error', 'no result for ' + str(item['url'])
+                               + '; writing to dummy file')
+                    return self.fetch_item(item, dummy=True)
+        if result[0] is None:
+            raise SystemExit()
+        return result[0]
+
     def item_ready(self, item):
         """Add a given item to the playback queue."""
         self.managed_objects['playback'].add(item)
 
+    def offer_item(self, item):
+        """
+        Add a given item to the playback queue if there is room, without
+        waiting. Returns whether the item was added.
+
+        """
+        return self.managed_objects['playback'].offer(item)
+
     def retrieve_metric(self, metric, func=None):
         """Retrieve given metric from each of the managed objects."""
         if func:
@@ -238,17 +487,17 @@ class Player(object):
         """Return maximum duration present in current set of representations."""
         return self.managed_objects['representations'].mpd_duration
 
+    def buffer_level(self):
+        """Return the amount of content in the playback queue in seconds."""
+        try:
+            return self.managed_objects['playback'].report['time_buffer']
+        except AttributeError:
+            return 0
+
     def report_tick(self):
         """Call report method on each of the managed objects."""
         self._modify_state('report_tick')
 
-    def _time_request(self, item):
-        """Make request and time response."""
-        start = time.time()
-        response = self.make_request(item)
-        duration = time.time() - start
-        return response, duration
-
     def _check_code(self, code, url):
         """Checks if the request was successful (using the HTTP error code)"""
         if code >= 400:
@@ -256,6 +505,31 @@ class Player(object):
                        + url + ' (code ' + str(code) + ')')
             raise SystemExit()
 
+    def _stream_to_file(self, item, response, control=None, start=None):
+        """
+        Write the body of a streamed response to file as it arrives.
+
+        Only a single chunk is held in memory at a time. The size and arrival
+        time of each chunk are sampled, from the time of the request, to
+        change the bandwidth estimation during the transfer rather than after
+        it.
+
+        Returns the length of the body (in bits) and the path written to.
+
+        """
+        transfer = _Transfer(self, item, start)
+        expected = int(response.headers.get('Content-Length') or 0)
+        try:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                transfer.write(chunk)
+                if control and not control.proceed(transfer.received,
+                                                   expected):
+                    response.close()
+                    return transfer.close(complete=False)
+        except requests.exceptions.RequestException as exception:
+            self.event('error', 'transfer interrupted: ' + str(exception))
+        return transfer.close()
+
     def _write_to_file(self, item, content):
         """
         Write response content to file.
@@ -263,58 +537,125 @@ class Player(object):
         This may be a complete file, or a byte range to an existing file.
 
         """
-        if self.options.write:
-            file_name = item['url'].split('/')[-1]
-            path = self.directory + '/downloads/' + file_name
-            file_start = int(item['bytes_from'])
-            file_end = int(item['bytes_to'])
-            try:
-                if os.path.isfile(path):
-                    _file = open(path, 'r+')
-                else:
-                    _file = open(path, 'w')
-            except IOError as exception:
-                self.event('error', 'could not append or write to file: '
-                           + str(exception))
-                return path
-            _file.seek(int(item['bytes_from']))
+        output, path = self._open_item(item)
+        if output:
             try:
-                _file.write(content)
-            except IOError as exception:
+                offset = output.write(int(item['bytes_from']), content)
+            except (IOError, OSError) as exception:
                 self.event('error', str(exception))
-            file_pointer = int(_file.tell() - 1)
-            if file_end != file_pointer and file_start != 0:
-                print 'ends do not match'
-            _file.close()
-        else:
-            path = ''
+            else:
+                self._item_written(item, output, offset)
         return path
 
-    def update_bandwidth(self, duration, length):
-        """Update the current bandwidth estimation."""
-        if duration == 0 or length == 0:
-            pass
-        else:
-            self.bandwidth.change(int(length / duration))
+    def _open_item(self, item):
+        """
+        Open the output file of an item from the sink.
+
+        Returns the output (or `None` if it could not be opened, or writing
+        is disabled) and its path.
+
+        """
+        if not self.options.write:
+            return None, ''
+        file_sink = self.managed_objects['sink']
+        path = file_sink.path(item['url'])
+        try:
+            return file_sink.open(item['url']), path
+        except (IOError, OSError) as exception:
+            self.event('error', 'could not append or write to file: '
+                       + str(exception))
+            return None, path
+
+    def _item_written(self, item, output, offset):
+        """Check the byte range of an item was filled, then notify sink."""
+        file_pointer = offset - 1
+        if int(item['bytes_to']) != file_pointer and \
+                int(item['bytes_from']) != 0:
+            print 'ends do not match'
+        self.managed_objects['sink'].written(output)
+
+    def submit(self, function, args=()):
+        """
+        Run a function on the fetch pool, which lasts for the lifetime of the
+        player and is shared by each playlist item.
+
+        Returns an `AsyncResult`. Calling its `get` method waits for the
+        function to complete, then returns its result or raises its
+        exception. On a virtual clock, the function is run straight away.
+
+        """
+        if self.simulation:
+            return _Completed(function, args)
+        return self.fetch_pool.apply_async(_run, (function, args))
 
     def start_thread(self, target, args=(), **kwargs):
         """Wrapper for the `threading.Thread` module. Track threads."""
         thread = threading.Thread(target=target, args=args, kwargs=kwargs)
         thread.daemon = True
         thread.start()
-        self.threads.append(thread)
+        self._track(thread)
         return thread
 
+    def start_loop(self, step):
+        """
+        Call a step function repeatedly, waiting for the time (in seconds) it
+        returns between calls, until it returns `None`. Runs on a new thread,
+        or on the simulation if there is one.
+
+        """
+        if self.simulation:
+            self.simulation.loop(step, self)
+        else:
+            self.start_thread(_loop, (step,))
+
     def start_timed_thread(self, interval, function, args=()):
-        """Wrapper for the `threading.Timer` module. Track threads."""
+        """
+        Wrapper for the `threading.Timer` module. Track threads.
+
+        If there is an engine, the function is run on its loop instead.
+
+        """
+        if self.engine:
+            self.engine.call_later(float(interval), function, args)
+            return None
         thread = threading.Timer(
             interval=float(interval),
             function=function, args=args)
         thread.daemon = True
         thread.start()
-        self.threads.append(thread)
+        self._track(thread)
         return thread
 
+    def _track(self, thread):
+        """
+        Track a started thread, forgetting those which have finished so that
+        short-lived threads (such as those of each download attempt or
+        timer) do not accumulate over a session.
+
+        """
+        with self._threads_lock:
+            self.threads = [thread_ for thread_ in self.threads
+                            if thread_.is_alive()]
+            self.threads.append(thread)
+
+    def call_soon(self, function, args=()):
+        """
+        Run a short function as soon as possible, on the engine if there is
+        one, otherwise on a new thread.
+
+        """
+        if self.engine:
+            self.engine.call_soon(function, args)
+        else:
+            self.start_thread(function, args)
+
+    def log_request(self, record):
+        """Register the timing of a request with the reporting module."""
+        try:
+            self.managed_objects['reporter'].request(record)
+        except AttributeError:
+            pass
+
     def create_directory(self, path=''):
         """Create a new directory at the given path."""
         path = self.directory + path
@@ -326,8 +667,8 @@ class Player(object):
         return path
 
     def _create_progress_bar(self):
-        """Create a progress bar if required."""
-        if not self.options.debug:
+        """Create a progress bar if required (but never in a fleet)."""
+        if not self.options.debug and not self.fleet:
             return progressbar.PlaybackBar(player=self,
                                            max=self
                                            .managed_objects['representations']
@@ -343,21 +684,166 @@ class Player(object):
             print action, event
 
 
-def get_length(response):
+def _run(function, args):
     """
-    Get length of response from HTTP response header.
+    Run a function on behalf of the fetch pool.
 
-    Falls back to checking the length of the response content if value not
-    present in header. Also ensures that we convert from octets to bits for
-    use in the bandwidth estimation algorithm
+    A `SystemExit` would silently end the worker thread, leaving the result
+    pending forever, so it is passed back to the caller as an error instead.
 
     """
     try:
-        length = int(response.headers.get('Content-Length'))
-    except TypeError:
-        length = len(response.content)
-    length = length * 8
-    return length
+        return function(*args)
+    except SystemExit as exception:
+        raise RuntimeError('exit requested: ' + str(exception))
+
+
+def _loop(step):
+    """Call a step function until it returns `None`, sleeping between."""
+    while True:
+        delay = step()
+        if delay is None:
+            return
+        if delay:
+            time.sleep(delay)
+
+
+class _Completed(object):
+
+    """The result of a function which has already run, as from `submit`."""
+
+    def __init__(self, function, args):
+        """Run the function, keeping its result or error."""
+        self.value = None
+        self.error = None
+        try:
+            self.value = _run(function, args)
+        except RuntimeError as exception:
+            self.error = exception
+
+    def get(self):
+        """Return the result of the function, or raise its error."""
+        if self.error:
+            raise self.error
+        return self.value
+
+
+class _Transfer(object):
+
+    """
+    Writes the body of a response to file as it arrives.
+
+    Only a single chunk is held in memory at a time. The size and arrival
+    time of each chunk are sampled for the bandwidth estimation, separately
+    from any other transfers in progress.
+
+    """
+
+    def __init__(self, player, item, start=None):
+        """
+        Open the output of an item, ready for the first chunk of a request
+        made at the given time (or now).
+
+        """
+        self.player = player
+        self.item = item
+        self.output, self.path = player._open_item(item)
+        self.offset = int(item['bytes_from'])
+        self.received = 0
+        self.progress = bandwidth.Progress(
+            player.bandwidth, timing.now() if start is None else start)
+
+    def write(self, chunk):
+        """Sample and write the next chunk of the body."""
+        if self.player.shaper:
+            self.player.shaper.consume(len(chunk) * 8)
+        self.progress.sample(len(chunk) * 8, timing.now())
+        self.received += len(chunk)
+        if self.output:
+            try:
+                self.offset = self.output.write(self.offset, chunk)
+            except (IOError, OSError) as exception:
+                self.player.event('error', str(exception))
+                self.output = None
+
+    def close(self, complete=True):
+        """
+        Finish writing the body, and change the bandwidth estimation by the
+        rest of its samples. An incomplete body (such as that of a cancelled
+        download) is not checked or reported to the sink, and its truncated
+        samples are not used.
+
+        Returns the length of the body (in bits) and the path written to.
+
+        """
+        if complete:
+            self.progress.flush()
+            if self.output:
+                self.player._item_written(self.item, self.output,
+                                          self.offset)
+        return self.received * 8, self.path
+
+
+class _Fetch(object):
+
+    """Handles the response to an item requested on the engine."""
+
+    def __init__(self, player, item, callback):
+        """Start timing the request of an item."""
+        self.player = player
+        self.item = item
+        self.callback = callback
+        self.record = timing.Timing(item)
+        self.transfer = None
+        self.failed = False
+        self.last_activity = timing.now()
+
+    def response(self, status_code, headers, connected_at):
+        """Check the status of the response, abandoning it if unsuccessful."""
+        self.last_activity = timing.now()
+        self.record.response(connected_at)
+        try:
+            self.player._check_code(status_code, self.item['url'])
+        except SystemExit:
+            self.failed = True
+            return False
+        self.transfer = _Transfer(self.player, self.item, self.record.start)
+        return True
+
+    def chunk(self, chunk):
+        """Write the next chunk of the body."""
+        self.last_activity = timing.now()
+        self.transfer.write(chunk)
+
+    def done(self, error):
+        """Finish the transfer and pass the result to the callback."""
+        if self.failed:
+            self.callback(None)
+            return
+        if not self.transfer:
+            self.player.event('error', 'no response returned from '
+                              + str(self.item['url']) + ' (' + str(error)
+                              + '); writing to dummy file')
+            self.callback(self.player.fetch_item(self.item, dummy=True))
+            return
+        if error:
+            self.player.event('error', 'transfer interrupted: ' + str(error))
+        length, path = self.transfer.close()
+        self.record.finish(length)
+        duration = self.record.end - self.record.start
+        self.player.log_request(self.record)
+        self.player.event('stop', 'downloading ' + str(self.item['url']) +
+                          ' (' + str(length) + 'b)')
+        self.callback((duration, length, path))
+
+
+def _range_headers(item):
+    """Return the request headers selecting the byte range of an item."""
+    headers = {}
+    if item['bytes_to'] != 0:
+        headers['Range'] = 'bytes=%s-%s' % (item['bytes_from'],
+                                            item['bytes_to'])
+    return headers
 
 
 def remove_directory(path):
@@ -12,6 +12,7 @@ class BaseQueue(object):
     """A set of common functions used on the queue classes of Scootplayer."""
 
     window_size = 5
+    retired = False
 
     def __init__(self, *args, **kwargs):
         """Initialise a queue object with default values."""
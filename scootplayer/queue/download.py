@@ -3,57 +3,267 @@
 """Queue used to regulate segment downloads."""
 
 from .base import BaseQueue
+import scootplayer.hedging as hedging
+import functools
+import Queue
+import threading
 import time
 
 
 class DownloadQueue(BaseQueue):
 
-    """Object which acts as a download queue for the player."""
+    """
+    Object which acts as a download queue for the player.
+
+    Several downloaders may fetch items concurrently, but items are always
+    handed to the playback queue in the order they were added.
+
+    Optionally, queued items which are contiguous byte ranges of the same
+    file are coalesced and fetched with a single request. As each range is
+    written in place, the items are then delivered individually.
+
+    If the player has an engine, downloads are started and delivered from
+    its loop rather than from downloader threads. On a virtual clock, this is
+    the loop of the simulation.
+
+    """
 
     def __init__(self, *args, **kwargs):
-        """Initialise download queue with max size and start thread."""
+        """Initialise download queue with max size and start threads."""
         super(DownloadQueue, self).__init__(*args, **kwargs)
+        self._added = 0
+        self._delivered = 0
+        self._ready = dict()
+        self._delivery = threading.Lock()
+        self._delivering = False
+        self._time_buffer = threading.Lock()
+        self._in_flight = 0
+        self._failed = False
+        self.report.update(hedges=0, hedge_wins=0, abandonments=0)
+        self.report.update(self.player.bandwidth.estimates())
+        self.hedger = None
+        if float(self.player.options.hedge_percentile) or \
+                self.player.options.abandon:
+            self.hedger = hedging.Hedger(
+                self.player, float(self.player.options.hedge_percentile),
+                self.player.options.hedge_lower, self.player.options.abandon)
         if self.player.options.write:
             self.player.create_directory('/downloads')
-        self.player.start_thread(self.downloader)
+        if self.player.simulation:
+            self.player.start_loop(self.dispatch)
+        elif self.player.engine:
+            self.player.call_soon(self.dispatcher)
+        else:
+            for _ in range(int(self.player.options.download_pipeline)):
+                self.player.start_thread(self.downloader)
 
     def stop(self):
         """Stop the download queue."""
         self.queue.queue.clear()
         self.player.event('stop', 'download')
 
+    def report_tick(self):
+        """Also report the estimation of each of the bandwidth estimators."""
+        self.report.update(self.player.bandwidth.estimates())
+        super(DownloadQueue, self).report_tick()
+
     def add(self, representation):
         """Add an item to the download queue."""
         while self.run:
-            if (int(self.report['time_buffer'])
-		    + int(representation['item']['duration'])) \
-                    <= int(self.time_buffer_max):
-                self.report['time_buffer'] += int(
-                    representation['item']['duration'])
-                self.queue.put((representation))
+            if self.offer(representation):
                 return
             else:
                 time.sleep(0.01)
 
+    def offer(self, representation):
+        """
+        Add an item to the download queue if there is room. Returns whether
+        the item was added.
+
+        """
+        if self.run and (int(self.report['time_buffer'])
+                         + int(representation['item']['duration'])) \
+                <= int(self.time_buffer_max):
+            self._change_time_buffer(representation['item']['duration'])
+            self.queue.put((self._added, representation))
+            self._added += 1
+            return True
+        return False
+
     def downloader(self):
         """Download the next item in the download queue."""
-        while True:
+        while self.player.state != 'exit' and not self.retired:
             if self.run:
-                representation = self.queue.get()
+                batch = self._coalesce([self.queue.get()])
+                sequence, representation = batch[0]
                 if self.player.options.url:
                     self._url_parser(representation['item']['url'])
                 self.report['bandwidth'] = representation['bandwidth']
                 self.report['max_encoded_bitrate'] = representation[
                     'max_encoded_bitrate']
                 self.report['id'] = str(representation['id'])
-                self.player.fetch_item((representation['item']))
-                self.player.item_ready(representation)
-                self.queue.task_done()
-                self.report['time_buffer'] = self.report['time_buffer'] - \
-                    int(representation['item']['duration'])
+                batch = self._fetch(batch)
+                for sequence, representation in batch:
+                    self._deliver(sequence, representation)
+                    self.queue.task_done()
             else:
                 time.sleep(0.01)
 
+    def _fetch(self, batch):
+        """
+        Download a batch, applying any tail latency controls to single
+        segments. Returns the batch of items actually downloaded.
+
+        """
+        if self.hedger and len(batch) == 1:
+            sequence, representation = batch[0]
+            return [(sequence, self.hedger.fetch(representation, self.report))]
+        self.player.fetch_item(_merge(batch))
+        return batch
+
+    def dispatcher(self):
+        """
+        Dispatch downloads periodically on the engine's loop, until the player
+        has exited or moved onto the next item.
+        """
+        if self.player.state == 'exit' or self.retired:
+            return
+        self.player.start_timed_thread(0.01, self.dispatcher)
+        self.dispatch()
+
+    def dispatch(self):
+        """
+        Start downloads on the engine, up to the depth of the pipeline, and
+        deliver those which are complete.
+
+        Runs on the engine's loop, so must never wait. Returns the time until
+        it should next be run: zero if anything was started or delivered, or
+        `None` once the player has exited or moved onto the next item.
+
+        """
+        if self.player.state == 'exit' or self.retired:
+            return None
+        progress = (self._delivered, self._in_flight)
+        self._release()
+        while self.run and not self._failed and self._in_flight < \
+                int(self.player.options.download_pipeline):
+            try:
+                batch = self._coalesce([self.queue.get_nowait()])
+            except Queue.Empty:
+                break
+            sequence, representation = batch[0]
+            if self.player.options.url:
+                self._url_parser(representation['item']['url'])
+            self.report['bandwidth'] = representation['bandwidth']
+            self.report['max_encoded_bitrate'] = representation[
+                'max_encoded_bitrate']
+            self.report['id'] = str(representation['id'])
+            self._in_flight += 1
+            self.player.fetch_item_async(
+                _merge(batch), functools.partial(self._fetched, batch))
+        if progress != (self._delivered, self._in_flight):
+            return 0
+        return 0.01
+
+    def _fetched(self, batch, result):
+        """
+        Mark the items of a batch downloaded on the engine as ready.
+
+        If the download was unsuccessful, no further downloads are started,
+        as when a downloader thread exits.
+
+        """
+        self._in_flight -= 1
+        if result is None:
+            self._failed = True
+            return
+        for sequence, representation in batch:
+            self._ready[sequence] = representation
+            self.queue.task_done()
+        self._release()
+
+    def _release(self):
+        """
+        Hand ready items to the playback queue in order, for as long as it
+        has room for them.
+
+        """
+        while self._delivered in self._ready and \
+                self.player.offer_item(self._ready[self._delivered]):
+            representation = self._ready.pop(self._delivered)
+            self._delivered += 1
+            self._change_time_buffer(
+                -int(representation['item']['duration']))
+
+    def _coalesce(self, batch):
+        """
+        Extend a batch with the queued items which continue its byte range,
+        within the configured duration and size.
+
+        """
+        max_duration = float(self.player.options.coalesce_duration)
+        max_size = int(self.player.options.coalesce_size) * 1024
+        if not max_duration:
+            return batch
+        first = batch[0][1]['item']
+        duration = first['duration']
+        with self.queue.mutex:
+            while self.queue.queue:
+                item = batch[-1][1]['item']
+                following = self.queue.queue[0][1]['item']
+                if not item['bytes_to'] or following['url'] != item['url'] \
+                        or following['bytes_from'] != item['bytes_to'] + 1 \
+                        or duration + following['duration'] > max_duration \
+                        or following['bytes_to'] - first['bytes_from'] + 1 \
+                        > max_size:
+                    break
+                duration += following['duration']
+                batch.append(self.queue.queue.popleft())
+        return batch
+
+    def _deliver(self, sequence, representation):
+        """
+        Hand a downloaded item to the playback queue, along with any later
+        items which were waiting for it to complete.
+
+        Only one downloader delivers at a time, and does so without holding
+        the lock, so that the others carry on downloading while it waits for
+        room in the playback queue. Items which become ready in the meantime
+        are delivered by it, in order.
+
+        """
+        with self._delivery:
+            self._ready[sequence] = representation
+            if self._delivering:
+                return
+            self._delivering = True
+        while True:
+            with self._delivery:
+                if self._delivered not in self._ready:
+                    self._delivering = False
+                    return
+                representation = self._ready.pop(self._delivered)
+                self._delivered += 1
+            self.player.item_ready(representation)
+            self._change_time_buffer(-int(representation['item']['duration']))
+
+    def _change_time_buffer(self, duration):
+        """Change the amount of content in the queue in seconds."""
+        with self._time_buffer:
+            self.report['time_buffer'] += int(duration)
+
     def __len__(self):
         """Return the current length of the download queue."""
         return self.queue.qsize()
+
+
+def _merge(batch):
+    """Return a single item covering the byte ranges of a batch."""
+    if len(batch) == 1:
+        return batch[0][1]['item']
+    first = batch[0][1]['item']
+    last = batch[-1][1]['item']
+    return {'url': first['url'], 'bytes_from': first['bytes_from'],
+            'bytes_to': last['bytes_to'],
+            'duration': sum(representation['item']['duration']
+                            for _, representation in batch)}
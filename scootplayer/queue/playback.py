@@ -19,6 +19,9 @@ class PlaybackQueue(BaseQueue):
         """
         super(PlaybackQueue, self).__init__(*args, **kwargs)
         self.start = False
+        self._playing = None
+        self._remaining = 0
+        self._seconds_played = 0
         self.mpd_duration = self.player.mpd_duration()
 
     def stop(self):
@@ -28,63 +31,71 @@ class PlaybackQueue(BaseQueue):
 
     def add(self, representation):
         """Add an item to the playback queue."""
-        while True:
-            if (int(self.report['time_buffer'])
-                    + int(representation['item']['duration'])) \
-                    <= int(self.time_buffer_max) and self.run:
-                self.report['time_buffer'] += int(
-                    representation['item']['duration'])
-                self.queue.put((representation))
-                if self.start != True and self.report['time_buffer'] \
-                        >= self.time_buffer_min:
-                    self.player.event('start', 'playback')
-                    self.start = True
-                    self.player.start_thread(self.playback)
-                return
-            else:
-                time.sleep(0.01)
+        while not self.offer(representation):
+            time.sleep(0.01)
 
-    def playback(self):
-        """Consume the next item in the playback queue."""
-        self.report['time_position'] = 0
-        seconds_played = 0
-        while True:
-            if self.run:
-                if self.report['time_buffer'] > 0:
-                    representation = self.queue.get()
-                    if self.player.options.url:
-                        self._url_parser(representation['item']['url'])
-                    self.report['time_position'] += int(
-                        representation['item']['duration'])
-                    self.report['bandwidth'] = int(representation['bandwidth'])
-                    self.report['max_encoded_bitrate'] = representation['max_encoded_bitrate']
-                    self.report['id'] = str(representation['id'])
-                    self._consume_chunk(representation['item']['duration'])
-                    self.queue.task_done()
-                    self.report['time_buffer'] = self.report[
-                        'time_buffer'] - int(representation['item']['duration'])
-                    seconds_played += int(representation['item']['duration'])
-                elif self.report['time_buffer'] == 0:
-                    if seconds_played >= self.mpd_duration:
-                        self.player.pause()
-                        self.player.next()
-                    else:
-                        self.player.event('empty', 'playback buffer ; stalled')
-                        time.sleep(0.01)
-            else:
-                time.sleep(0.01)
+    def offer(self, representation):
+        """
+        Add an item to the playback queue if there is room. Returns whether
+        the item was added.
 
-    def _consume_chunk(self, duration):
         """
-        Ensure that an appropriate amount of time has elapsed before
-        progressing onto next chunk.
+        if (int(self.report['time_buffer'])
+                + int(representation['item']['duration'])) \
+                <= int(self.time_buffer_max) and self.run:
+            self.report['time_buffer'] += int(
+                representation['item']['duration'])
+            self.queue.put((representation))
+            if self.start != True and self.report['time_buffer'] \
+                    >= self.time_buffer_min:
+                self.player.event('start', 'playback')
+                self.start = True
+                self.report['time_position'] = 0
+                self.player.start_loop(self.playback)
+            return True
+        return False
 
+    def playback(self):
         """
-        while duration > 0:
-            if self.run:
-                duration = duration - 1
-                self.player.progress_bar.next(1)
-            time.sleep(1)
+        Play back up to a second of the current item, moving onto the next
+        item in the playback queue once it is complete.
+
+        Returns the time until playback continues, or `None` once the end of
+        the MPD has been reached or the player has moved onto the next item.
+
+        """
+        if self.retired:
+            return None
+        if not self.run:
+            return 0.01
+        if self._playing is None:
+            if self.report['time_buffer'] > 0:
+                self._playing = self.queue.get()
+                self._remaining = self._playing['item']['duration']
+                if self.player.options.url:
+                    self._url_parser(self._playing['item']['url'])
+                self.report['time_position'] += int(
+                    self._playing['item']['duration'])
+                self.report['bandwidth'] = int(self._playing['bandwidth'])
+                self.report['max_encoded_bitrate'] = self._playing['max_encoded_bitrate']
+                self.report['id'] = str(self._playing['id'])
+            elif self._seconds_played >= self.mpd_duration:
+                self.player.pause()
+                self.player.next()
+                return None
+            else:
+                self.player.event('empty', 'playback buffer ; stalled')
+                return 0.01
+        if self._remaining > 0:
+            self._remaining -= 1
+            self.player.progress_bar.next(1)
+            return 1
+        duration = self._playing['item']['duration']
+        self.queue.task_done()
+        self.report['time_buffer'] = self.report['time_buffer'] - int(duration)
+        self._seconds_played += int(duration)
+        self._playing = None
+        return 0
 
     def __len__(self):
         """Return the current length of the playback queue."""
@@ -0,0 +1,142 @@
+#!/usr/bin/env python2.7
+
+"""Replays a fixed schedule of segment requests."""
+
+import csv
+import time
+
+
+class Schedule(object):
+
+    """
+    Segment requests to replay, each with the time (in seconds, relative to
+    the first) at which it is made.
+
+    A schedule file may be:
+
+    * the `requests.csv` of a previous run, in which case each request is
+      replayed at the time it started;
+    * the `event.csv` of a previous run, from which the start of each
+      download is taken;
+    * rows of time, URL and (optionally) the first and last byte of a range.
+
+    """
+
+    def __init__(self, rows):
+        """Initialise from (time, URL, first byte, last byte) rows."""
+        rows = sorted(rows)
+        start = rows[0][0] if rows else 0
+        self.rows = [(time_ - start, url, bytes_from, bytes_to)
+                     for time_, url, bytes_from, bytes_to in rows]
+
+    def __iter__(self):
+        """Iterate over the requests in order of time."""
+        return iter(self.rows)
+
+    def __len__(self):
+        """Return the number of requests."""
+        return len(self.rows)
+
+    @classmethod
+    def load(cls, path):
+        """Load a schedule from a file, in any of the supported formats."""
+        with open(path) as file_:
+            lines = [row for row in csv.reader(file_) if row]
+        if lines and 'url' in lines[0]:
+            return cls(_from_header(lines[0], lines[1:]))
+        return cls(row for row in (_from_row(line) for line in lines)
+                   if row)
+
+
+class Replay(object):
+
+    """
+    Downloads the segments of a schedule at their scheduled times, in place
+    of those chosen by the ABR algorithm.
+
+    Segments are looked up in the MPD so that their durations (and the
+    representations they belong to) are known to the queues; requests for
+    anything else (such as initialisations) are skipped. Times are relative
+    to the first segment. Once the schedule is complete and the queues have
+    drained, the player exits.
+
+    """
+
+    def __init__(self, player, schedule):
+        """Prepare to replay a schedule on a player."""
+        self.player = player
+        self.schedule = schedule
+
+    def run(self):
+        """Replay the schedule, then exit the player."""
+        self.player.event('start', 'replay of ' + str(len(self.schedule)) +
+                          ' requests')
+        start = None
+        for time_, url, bytes_from, _ in self.schedule:
+            candidate = self.player.managed_objects['representations'].find(
+                url, bytes_from)
+            if candidate is None:
+                self.player.event('replay', 'skipped ' + url)
+                continue
+            while self.player.state != 'play':
+                time.sleep(0.01)
+            if start is None:
+                start = time.time() - time_
+            delay = start + time_ - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.player.managed_objects['download'].add(candidate)
+        while self.player.managed_objects['download'].report['time_buffer'] \
+                or self.player.buffer_level():
+            time.sleep(0.01)
+        self.player.event('stop', 'replay')
+        self.player.exit()
+
+
+def _from_header(header, lines):
+    """
+    Yield the requests of a file with a header row, such as `requests.csv`.
+    Requests which record their total duration are moved back to the time
+    at which they started.
+
+    """
+    columns = dict((name, index) for index, name in enumerate(header))
+    time_column = columns.get('time', columns.get('elapsed_time', 0))
+    for line in lines:
+        try:
+            time_ = float(line[time_column])
+            if 'total' in columns:
+                time_ -= float(line[columns['total']])
+            yield (time_, line[columns['url']],
+                   _byte(line, columns.get('bytes_from')),
+                   _byte(line, columns.get('bytes_to')))
+        except (IndexError, ValueError):
+            continue
+
+
+def _from_row(line):
+    """
+    Return the request of a row of time, URL and byte range, or of the start
+    of a download in `event.csv`, or `None` for any other row.
+
+    """
+    try:
+        time_ = float(line[0])
+    except (IndexError, ValueError):
+        return None
+    if len(line) < 2:
+        return None
+    if line[1] == 'start' and len(line) > 2 and \
+            line[2].startswith('downloading '):
+        return time_, line[2][len('downloading '):], 0, 0
+    if '/' in line[1]:
+        return time_, line[1], _byte(line, 2), _byte(line, 3)
+    return None
+
+
+def _byte(line, index):
+    """Return the byte offset in a column of a row, or zero."""
+    try:
+        return int(line[index])
+    except (IndexError, TypeError, ValueError):
+        return 0
@@ -5,6 +5,9 @@
 import time
 import platform
 import sys
+import threading
+
+import scootplayer.timing as timing
 
 
 class Reporter(object):
@@ -23,6 +26,7 @@ class Reporter(object):
     run = False
     startup_delay = 0
     csv_new = True
+    retired = False
     managed_files = {}
     _object_focus = ['playback', 'download']
     _header_width = 0
@@ -30,8 +34,10 @@ class Reporter(object):
     def __init__(self, player):
         """Initialise files to save reports to."""
         self.player = player
+        self.managed_files = {}
+        self._request_lock = threading.Lock()
         self._setup_managed_files()
-        self.start_time = time.time()
+        self.start_time = timing.now()
         self.player.start_timed_thread(5, self.info)
         self.start()
 
@@ -66,6 +72,9 @@ class Reporter(object):
     def _setup_managed_files(self):
         """Setup the files required at playback start."""
         self.managed_files['event'] = self.player.open_file('/event.csv')
+        self.managed_files['request'] = self.player.open_file('/requests.csv')
+        self.managed_files['request'].write(self._make_csv_from_list(
+            ['elapsed_time'] + timing.Timing.fields, time_=False))
         self._create_dir_structure('report', self._object_focus)
 
     def _create_dir_structure(self, folder, files):
@@ -98,11 +107,11 @@ class Reporter(object):
     def start(self):
         """Start reporting thread."""
         self.csv_new = True
-        self.player.start_thread(self.reporter)
+        self.player.call_soon(self.reporter)
 
     def time_elapsed(self):
         """Calculate the time elapsed since the start of reporting."""
-        return round(time.time() - self.start_time, 4)
+        return round(timing.now() - self.start_time, 4)
 
     def reporter(self):
         """
@@ -110,8 +119,11 @@ class Reporter(object):
 
         If CSV file is new, append headers to first row.
 
+        Stops once the player has exited or moved onto the next item.
 
         """
+        if self.player.state == 'exit' or self.retired:
+            return
         self.player.start_timed_thread(self.player.options.reporting_period,
                                        self.reporter)
         if self.run:
@@ -190,9 +202,20 @@ class Reporter(object):
             except ValueError:
                 pass
 
+    def request(self, record):
+        """Log the timing of a completed request to file."""
+        if self.player.options.csv:
+            with self._request_lock:
+                try:
+                    self.managed_files['request'].write(
+                        self._make_csv_from_list(record.row()))
+                    self.managed_files['request'].flush()
+                except ValueError:
+                    pass
+
     def event(self, action, description):
-        """Create a thread to handle event."""
-        self.player.start_thread(self.event_thread, args=(action, description))
+        """Create a thread (or engine call) to handle event."""
+        self.player.call_soon(self.event_thread, args=(action, description))
 
     def event_thread(self, action, description):
         """Event reporting to file."""
@@ -5,21 +5,32 @@
 from lxml import etree
 import aniso8601
 import os
-import Queue
 import random
 import re
 import requests
+import struct
 import threading
-import time
-import multiprocessing
-from pymediainfo import MediaInfo
 
+import scootplayer.abr as abr
+import scootplayer.mp4 as mp4
+import scootplayer.segments as segments
 
-def call_it(instance, name, args=(), kwargs=None):
-    "Indirect caller for instance methods and multiprocessing."
-    if kwargs is None:
-        kwargs = {}
-    return getattr(instance, name)(*args, **kwargs)
+
+def _local_name(element):
+    """Return the tag of an element without its namespace."""
+    tag = element.tag
+    if not isinstance(tag, basestring):
+        return ''  # Comments and processing instructions
+    return tag.rpartition('}')[2]
+
+
+def _release(element):
+    """Clear a parsed element and any preceding siblings from memory."""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
 
 
 class Representations(object):
@@ -36,17 +47,23 @@ class Representations(object):
     max_seg_duration = 0
     max_bandwidth = 0
     first_chunk = True
+    ladder = None
+    abr = None
     player = None
     mpd_duration = 0
-    init_done = 0
+    position = 0
     total_duration = 0
     total_length = 0
 
     def __init__(self, player, manifest):
         """Load the representations from the MPD."""
         self.player = player
-        self.media['representations'] = list()
-        self.media['initialisations'] = list()
+        self.media = {'representations': list(), 'initialisations': list()}
+        self._pending = dict()
+        self._deferred = dict()
+        self._initialising = threading.Lock()
+        self._locks = dict()
+        self._index = None
         self.load_mpd(manifest)
         self.initialise()
 
@@ -57,43 +74,153 @@ class Representations(object):
         self.player.event('stop', 'representations')
 
     def _get_remote_mpd(self, url):
-        """Download a remote MPD if necessary."""
+        """
+        Download a remote MPD if necessary.
+
+        The MPD is fetched through the player's session and streamed to disk.
+        If the same URL has been fetched before, the request is made
+        conditional on the MPD having changed. Returns the path of the MPD,
+        along with the previously parsed model if it has not changed.
+
+        """
         self.player.event('start', 'fetching remote mpd')
+        previous = self.player.remote_manifests.get(url)
+        headers = {}
+        if previous and previous['etag']:
+            headers['If-None-Match'] = previous['etag']
+        if previous and previous['last_modified']:
+            headers['If-Modified-Since'] = previous['last_modified']
         try:
-            response = requests.get(url)
-        except requests.ConnectionError as exception:
+            response = self.player.session.get(url, headers=headers,
+                                               stream=True)
+        except requests.RequestException as exception:
             self.player.event('error', str(exception))
-            return ''
+            return '', None
+        if response.status_code == 304 and previous:
+            response.close()
+            self.player.event('stop', 'fetching remote mpd (not modified)')
+            return previous['path'], previous['model']
         filename = os.path.basename(url)
         path = self.player.create_directory('/downloads/mpd') + '/' + filename
-        _file = open(path, 'w')
-        _file.write(response.content)
+        with open(path, 'wb') as _file:
+            for chunk in response.iter_content(chunk_size=65536):
+                _file.write(chunk)
+        self.player.remote_manifests[url] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'path': path, 'model': None}
         self.player.event('stop', 'fetching remote mpd')
-        return path
+        return path, None
 
     def load_mpd(self, manifest):
-        """Load an MPD from file."""
+        """
+        Load an MPD from file.
+
+        Unless the document has to be validated (which requires the complete
+        tree), the MPD is streamed with `iterparse` so that only the element
+        currently being parsed is held in memory.
+
+        If a remote MPD has not changed since it was last fetched, or the
+        player has a manifest cache, a previously parsed model of the same
+        MPD is restored instead, skipping the XML entirely.
+
+        """
         self.player.event('start', 'parsing mpd: ' + str(manifest))
         pattern = r'''http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|
             (?:%[0-9a-fA-F][0-9a-fA-F]))+'''
         url = re.search(pattern, manifest)
         if url:
-            manifest = self._get_remote_mpd(url.group())
-            origin = '/'.join(url.group().split('/')[:-1]) + '/'
+            url = url.group()
+            manifest, model = self._get_remote_mpd(url)
+            origin = '/'.join(url.split('/')[:-1]) + '/'
+            if self.player.simulation:
+                self.player.simulation.add_manifest(manifest, url)
+            if self._reuse(model, 'not modified'):
+                return
         else:
             origin = ''
+            if self.player.simulation:
+                self.player.simulation.add_manifest(manifest)
+        cache = self.player.manifest_cache
+        if cache:
+            key = cache.key(manifest, origin)
+            model = cache.get(key)
+            if self._reuse(model, 'cached'):
+                self._remember(url, model)
+                return
         if self.player.options.xml_validation:
             document = self._validate_mpd(manifest)
+            events = etree.iterwalk(document, events=('start', 'end'))
+            streaming = False
         else:
-            document = etree.parse(manifest)
-        mpd = document.getroot()
+            events = etree.iterparse(manifest, events=('start', 'end'))
+            streaming = True
         base_url = self.BaseURL(origin)
-        self.min_buffer = int(float(mpd.attrib['minBufferTime'][2:-1]))
-        self.parse_mpd(base_url, mpd)
-        sorted(self.media['representations'], key=lambda representation:
-               representation['bandwidth'])
+        self.parse_mpd(base_url, events, streaming)
+        self.media['representations'].sort(key=lambda representation:
+                                           representation['bandwidth'])
+        if cache:
+            cache.put(key, self.model())
+        self._remember(url, self.model())
+        self._prepare()
         self.player.event('stop', 'parsing mpd')
 
+    def _reuse(self, model, reason):
+        """
+        Restore a previously parsed model, if there is one and it has been
+        validated (where validation is required).
+
+        Returns whether the model was restored.
+
+        """
+        if not model or (self.player.options.xml_validation and
+                         not model['validated']):
+            return False
+        self.restore(model)
+        self._prepare()
+        self.player.event('stop', 'parsing mpd (' + reason + ')')
+        return True
+
+    def _remember(self, url, model):
+        """Keep the model of a remote MPD for reuse if it is unchanged."""
+        if url in self.player.remote_manifests:
+            self.player.remote_manifests[url]['model'] = model
+
+    def model(self):
+        """Return the parsed content of the MPD, independent of playback."""
+        return {'representations': self.media['representations'],
+                'initialisations': self.media['initialisations'],
+                'min_buffer': self.min_buffer,
+                'max_seg_duration': self.max_seg_duration,
+                'max_bandwidth': self.max_bandwidth,
+                'mpd_duration': self.mpd_duration,
+                'validated': bool(self.player.options.xml_validation)}
+
+    def restore(self, model):
+        """
+        Restore the parsed content of an MPD from a model.
+
+        Representations are copied so that playback state (such as the
+        maximum encoded bitrate) is not shared, whereas their segments are.
+
+        """
+        self.media['representations'] = [dict(representation) for
+                                          representation in
+                                          model['representations']]
+        self.media['initialisations'] = list(model['initialisations'])
+        self.min_buffer = model['min_buffer']
+        self.max_seg_duration = model['max_seg_duration']
+        self.max_bandwidth = model['max_bandwidth']
+        self.mpd_duration = model['mpd_duration']
+
+    def _prepare(self):
+        """Build the bitrate ladder and ABR algorithm for the MPD."""
+        self.ladder = abr.Ladder([representation['bandwidth'] for
+                                  representation in
+                                  self.media['representations']])
+        self.abr = abr.ALGORITHMS[self.player.options.abr](
+            self.ladder, self.player.options)
+
     def _validate_mpd(self, manifest):
         """Validate the integrity of the schema and MPD."""
         schema = open('validation/DASH-MPD.xsd')
@@ -119,93 +246,110 @@ class Representations(object):
         self.player.event('stop', 'validating document')
         return document
 
-    def parse_mpd(self, base_url, parent_element):
-        """Parse 'mpd' level XML."""
+    def parse_mpd(self, base_url, events, streaming=True):
+        """
+        Parse MPD level XML from a stream of (event, element) pairs.
+
+        Attributes are read as each element opens, whereas segments,
+        initialisations and base URLs are handled as each element closes.
+        When streaming, closed elements are cleared once they are parsed.
+
+        """
+        template = None
+        representation = None
+        for event, element in events:
+            tag = _local_name(element)
+            if event == 'start':
+                if tag == 'MPD':
+                    self.parse_mpd_attributes(element)
+                elif tag == 'SegmentTemplate':
+                    template = segments.Template(element)
+                elif tag == 'Representation':
+                    representation = self.parse_representation(element)
+                elif tag == 'SegmentList' and representation:
+                    representation['duration'] = int(
+                        element.attrib['duration'])
+                    self._max_values(representation['duration'],
+                                     representation['bandwidth'])
+                continue
+            if tag == 'BaseURL':
+                base_url.set(_local_name(element.getparent()), element.text)
+            elif tag == 'Initialization' and representation:
+                self.parse_initialisation(base_url, representation, element)
+            elif tag == 'SegmentURL' and representation:
+                self.parse_segment_url(base_url, representation, element)
+            elif tag == 'Representation':
+                if template:
+                    self.parse_templated_representation(template, base_url,
+                                                        representation)
+                if representation['segments'] is not None:
+                    self.media['representations'].append(representation)
+                representation = None
+            elif tag == 'AdaptationSet':
+                template = None
+            base_url.set(tag, '')
+            if streaming:
+                _release(element)
+
+    def parse_mpd_attributes(self, element):
+        """Parse the attributes of the root 'mpd' element."""
+        self.min_buffer = int(float(element.attrib['minBufferTime'][2:-1]))
         try:
-            self._set_mpd_duration(
-                parent_element.get('mediaPresentationDuration'))
+            self._set_mpd_duration(element.get('mediaPresentationDuration'))
         except (TypeError, IndexError, ValueError):
             self.mpd_duration = 0
-        for child_element in parent_element:
-            if 'BaseURL' in child_element.tag:
-                base_url.mpd = child_element.text
-            if 'Period' in child_element.tag:
-                self.parse_period(base_url, child_element)
-        base_url.mpd = ''
 
     def _set_mpd_duration(self, duration):
         """Set the duration of playback defined in the MPD."""
         self.mpd_duration = aniso8601.parse_duration(duration).seconds
 
-    def parse_period(self, base_url, parent_element):
-        """Parse 'period' level XML."""
-        for child_element in parent_element:
-            if 'BaseURL' in child_element.tag:
-                base_url.period = child_element.text
-            if 'AdaptationSet' in child_element.tag:
-                self.parse_adaptation_set(base_url, child_element)
-        base_url.period = ''
-
-    def parse_adaptation_set(self, base_url, parent_element):
-        """Parse 'adaption set' level XML. Create a new template if present."""
-        template = None
-        for child_element in parent_element:
-            if 'BaseURL' in child_element.tag:
-                base_url.adaption_set = child_element.text
-            if 'SegmentTemplate' in child_element.tag:
-                template = self.Template(child_element)
-            elif 'Representation' in child_element.tag:
-                bandwidth = int(child_element.attrib['bandwidth'])
-                try:
-                    id_ = str(child_element.attrib['id'])
-                except KeyError:
-                    print 'id not found, generating random number'
-                    id_ = str(random.randint(0, 1000))
-                if template:
-                    self.parse_templated_representation(template, base_url, child_element)
-                else:
-                    self.parse_representation(base_url, bandwidth, id_,
-                                          child_element)
-        base_url.adaption_set = ''
-
-    def parse_templated_representation(self, template, base_url, parent_element):
-         """Parse 'representation' level XML given a template."""
-         bandwidth = int(parent_element.attrib['bandwidth'])
-         duration = template.duration / template.timescale
-         total_files = (self.mpd_duration / duration)  + 1
-         self._max_values(duration, bandwidth)
-         queue = Queue.Queue()
-         for number in range(template.start_number, total_files + 1):
-             media = template.resolve(representationID=str(parent_element.attrib['id']),
-                number=number, bandwidth=bandwidth, time=(number * duration))
-             queue.put({'duration': duration, 'url': base_url.resolve() + media,
-             'bytes_from': int(0),
-             'bytes_to': int(0)})
-         self.media['representations'].append({
-             'bandwidth': bandwidth,
-             'id': str(parent_element.attrib['id']), 'queue': queue,
-             'maximum_encoded_bitrate': 0})
-
-    def parse_representation(self, base_url, bandwidth, id_, parent_element):
-        """Parse 'representation' level XML without a template."""
-        for child_element in parent_element:
-            if 'SegmentBase' in child_element.tag:
-                self.parse_segment_base(
-                    base_url,
-                    bandwidth,
-                    id_,
-                    child_element)
-            if 'BaseURL' in child_element.tag:
-                base_url.representation = child_element.text
-            if 'SegmentList' in child_element.tag:
-                duration = int(child_element.attrib['duration'])
-                self._max_values(duration, bandwidth)
-                self.parse_segment_list(base_url=base_url,
-                                        duration=duration,
-                                        bandwidth=bandwidth,
-                                        id_=id_,
-                                        parent_element=child_element)
-        base_url.representation = ''
+    def parse_representation(self, element):
+        """
+        Parse the attributes of 'representation' level XML.
+
+        Returns an empty representation which is populated as its children
+        are parsed.
+
+        """
+        bandwidth = int(element.attrib['bandwidth'])
+        try:
+            id_ = str(element.attrib['id'])
+        except KeyError:
+            print 'id not found, generating random number'
+            id_ = str(random.randint(0, 1000))
+        return {'bandwidth': bandwidth, 'id': id_, 'segments': None,
+                'duration': 0, 'maximum_encoded_bitrate': 0,
+                'average_encoded_bitrate': 0}
+
+    def parse_templated_representation(self, template, base_url,
+                                       representation):
+        """
+        Populate a representation given a template.
+
+        Segments are resolved lazily as they are requested. If the template
+        names an initialisation, it is added unless the representation
+        already has one.
+
+        """
+        duration = template.duration / template.timescale
+        self._max_values(duration, representation['bandwidth'])
+        representation['duration'] = duration
+        representation['segments'] = segments.TemplateSegments(
+            template, base_url.resolve(), representation['id'],
+            representation['bandwidth'], (self.mpd_duration / duration) + 1)
+        if template.initialisation and not any(
+                initialisation['id'] == representation['id'] for
+                initialisation in self.media['initialisations']):
+            self.media['initialisations'].append({
+                'bandwidth': representation['bandwidth'],
+                'id': representation['id'],
+                'item': {'duration': 0,
+                         'url': base_url.resolve() +
+                         template.resolve_initialisation(
+                             representation['id'],
+                             representation['bandwidth']),
+                         'bytes_from': 0,
+                         'bytes_to': 0}})
 
     def _max_values(self, duration, bandwidth):
         """Find maximum values for duration and bandwidth in the MPD."""
@@ -214,227 +358,267 @@ class Representations(object):
         if bandwidth > self.max_bandwidth:
             self.max_bandwidth = bandwidth
 
-    def parse_segment_base(self, base_url, bandwidth, id_, parent_element):
+    def parse_initialisation(self, base_url, representation, element):
         """
-        Parse 'segment_base' level XML.
+        Parse 'initialization' level XML within a segment base.
 
         Should be initialisation URLs.
 
         """
-        for child_element in parent_element:
-            if 'Initialization' in child_element.tag:
-                try:
-                    media_range = child_element.attrib['range'].split('-')
-                except KeyError:
-                    media_range = (0, 0)
-                self.media['initialisations'].append({
-                           'bandwidth' : bandwidth,
-                           'id' : id_,
-                           'item': {'duration': 0,
-                                    'url': base_url.resolve() +
-                                    child_element.attrib['sourceURL'],
-                                    'bytes_from': int(media_range[0]),
-                                    'bytes_to': int(media_range[1])}
-                                    })
-
-    def parse_segment_list(self, **kwargs):
+        try:
+            media_range = element.attrib['range'].split('-')
+        except KeyError:
+            media_range = (0, 0)
+        self.media['initialisations'].append({
+            'bandwidth': representation['bandwidth'],
+            'id': representation['id'],
+            'item': {'duration': 0,
+                     'url': base_url.resolve() + element.attrib['sourceURL'],
+                     'bytes_from': int(media_range[0]),
+                     'bytes_to': int(media_range[1])}})
+
+    def parse_segment_url(self, base_url, representation, element):
         """
-        Parse 'segment_list' level XML.
+        Parse 'segment_url' level XML within a segment list.
 
         Should be source URLs, describing actual content.
 
         """
-        queue = Queue.Queue()
-        for child_element in kwargs['parent_element']:
-            if 'SegmentURL' in child_element.tag:
-                try:
-                    media_range = child_element.attrib['mediaRange'] \
-                        .split('-')
-                except KeyError:
-                    media_range = (0, 0)
-                queue.put({'duration': kwargs['duration'],
-                           'url': kwargs['base_url'].resolve() +
-                           child_element.attrib['media'],
-                           'bytes_from': int(media_range[0]),
-                           'bytes_to': int(media_range[1])})
-        self.media['representations'].append({
-            'bandwidth': kwargs['bandwidth'],
-            'id': kwargs['id_'], 'queue': queue,
-            'maximum_encoded_bitrate': 0})
+        try:
+            media_range = element.attrib['mediaRange'].split('-')
+        except KeyError:
+            media_range = (0, 0)
+        if representation['segments'] is None:
+            representation['segments'] = segments.ListSegments()
+        representation['segments'].append(
+            base_url.resolve() + element.attrib['media'],
+            int(media_range[0]), int(media_range[1]),
+            representation['duration'])
 
     def initialise(self):
         """
         Fetch the necessary initialisation files.
 
         If there are multiple initialisation files to download, this will be
-        done concurrently.
+        done concurrently on the player's fetch pool.
+
+        Unless all initialisations are required up front, only that of the
+        first representation is fetched before playback. The rest are either
+        fetched in the background ('prefetch') or deferred ('lazy'), and are
+        waited for just before the first segment of their representation.
 
         """
         self.player.event('start', 'downloading initializations')
         if self.player.options.write:
             self.player.create_directory('/downloads')
+            self._reserve()
         elif self.player.options.vlc:
             for init in self.media['initialisations']:
                 if init['bandwidth'] == self.max_bandwidth:
                     total_duration, total_length, _ = self.player.fetch_item(init['item'])
                 else:
                     self.player.fetch_item(init['item'], dummy=True)
-        if self.player.options.threading:
-            self._multithreaded_fetch()
-        else:
-            self._multiprocessing_fetch()
-        self.player.update_bandwidth(self.total_duration, self.total_length)
+        initialisations = self.media['initialisations']
+        if self.player.options.initialisation != 'all' and \
+                self.media['representations']:
+            first = self.media['representations'][
+                self._first_candidate()]['id']
+            for initialisation in initialisations:
+                if initialisation['id'] != first:
+                    self._deferred.setdefault(
+                        initialisation['id'], []).append(initialisation)
+            initialisations = [initialisation for initialisation in
+                               initialisations if initialisation['id'] == first]
+        self._collect([self.player.submit(self.fetch_initialisation, (item,))
+                       for item in initialisations])
+        if self.player.options.initialisation == 'prefetch':
+            for id_, deferred in self._deferred.items():
+                self._pending[id_] = [
+                    self.player.submit(self.fetch_initialisation,
+                                       (initialisation,))
+                    for initialisation in deferred]
+            self._deferred.clear()
         self.player.event('stop ', 'downloading initializations')
 
-    def _multithreaded_fetch(self):
-        self.done = 0
-        lock = threading.Lock()
-        for item in self.media['initialisations']:
-            self.player.start_thread(self.fetch_initialisation,
-                                     (item, lock))
-        while self.init_done < len(self.media['initialisations']):
-            time.sleep(0.01)
-
-    def _multiprocessing_fetch(self):
-        pool = multiprocessing.Pool(
-            processes=int(self.player.options.proc_pool))
-        results = [pool.apply_async(call_it,
-                   args=(self, 'fetch_initialisation', (item,)))
-                   for item in self.media['initialisations']]
-        pool.close()
-        map(multiprocessing.pool.ApplyResult.wait, results)
+    def _first_candidate(self):
+        """Return the index of the representation likely to be played first."""
+        if self.player.options.vlc:
+            return len(self.ladder) - 1
+        return self.bandwidth_match(int(self.player.bandwidth))
+
+    def _collect(self, results):
+        """Wait for initialisations to be fetched, adding up the totals."""
         for result in results:
-            duration, length, _ = result.get()
+            try:
+                duration, length, _ = result.get()
+            except RuntimeError:
+                raise SystemExit()
             self.total_duration += duration
             self.total_length += length
 
-    def fetch_initialisation(self, initialisation, lock=None):
+    def _ensure_initialised(self, id_):
         """
-        Fetch an initialisation and update the shared duration and length
-        totals.
+        Make sure the initialisations of a representation have been fetched,
+        fetching them now if they were deferred.
 
-        Delay the parsing of header metadata for a few seconds to allow
-        playback to start.
+        Each representation has a lock of its own, so that any other callers
+        wait for the first to collect the initialisations, rather than going
+        ahead before they exist.
 
         """
-        duration, length, path = self.player.fetch_item(initialisation['item'])
-        if lock:
-            lock.acquire()
-            try:
-                self.total_duration += duration
-                self.total_length += length
-                self.init_done += 1
-            finally:
-                lock.release()
-        self.player.start_timed_thread(10, self.parse_metadata, (path,
-                                       initialisation['id']))
+        with self._initialising:
+            lock = self._locks.setdefault(id_, threading.Lock())
+        with lock:
+            if id_ in self._pending or id_ in self._deferred:
+                self._collect(self._pending.pop(id_, []) +
+                              [self.player.submit(self.fetch_initialisation,
+                                                  (initialisation,))
+                               for initialisation in
+                               self._deferred.pop(id_, [])])
+
+    def _reserve(self):
+        """Record the final size of each file addressed by byte range."""
+        for representation in self.media['representations']:
+            for url, size in representation['segments'].extents():
+                self.player.managed_objects['sink'].reserve(url, size)
+
+    def fetch_initialisation(self, initialisation):
+        """
+        Fetch an initialisation, returning the duration and length of the
+        transaction and the path it was written to.
+
+        The header metadata is parsed as soon as the initialisation arrives.
+
+        """
+        item = initialisation['item']
+        duration, length, path = self.player.fetch_item(item)
+        if item['bytes_to']:
+            self.parse_metadata(path, initialisation['id'],
+                                int(item['bytes_to']) + 1)
+        else:
+            self.parse_metadata(path, initialisation['id'])
         return duration, length, path
 
-    def parse_metadata(self, path, id_):
+    def parse_metadata(self, path, id_, length=0):
         """
         Parse the MP4 header metadata for bitrate information.
 
-        Specifically, retrieve the maximum encoded bitrate for each quality
-        level.
+        Specifically, retrieve the maximum and average encoded bitrate for
+        each quality level. If the initialisation is part of a larger file,
+        only its length is parsed.
 
         """
+        if not path:
+            return  # Nothing written to disk
         self.player.event('start', 'parsing metadata ' + str(path))
-        found = False
         try:
-            media_info = MediaInfo.parse(path)
-        except OSError:
-            self._set_maximum_encoded_bitrate(0, id_)
-            self.player.event('error', 'MediaInfo not installed')
-            return
-        for track in media_info.tracks:
-            if track.track_type == 'Video':
-                maximum_bitrate = track.maximum_bit_rate
-                if maximum_bitrate:
-                    self._set_maximum_encoded_bitrate(maximum_bitrate, id_)
-                    found = True
-                else:
-                    self.player.event(
-                        'error',
-                        'maximum bitrate not found in metadata')
-                    self._set_maximum_encoded_bitrate(0, id_)
-                    return
-        if not found:
+            bitrate = mp4.read_bitrate(path, length)
+        except (EnvironmentError, ValueError, struct.error) as exception:
+            self.player.event('error', 'could not parse metadata: '
+                              + str(exception))
+            bitrate = (0, 0)
+        if bitrate is None:
             self.player.event('error', 'no video track in metadata')
-            self._set_maximum_encoded_bitrate(0, id_)
+            bitrate = (0, 0)
+        elif not bitrate[0]:
+            self.player.event('error',
+                              'maximum bitrate not found in metadata')
+        self._set_encoded_bitrate(bitrate, id_)
         self.player.event('stop', 'parsing metadata ' + str(path))
 
-    def _set_maximum_encoded_bitrate(self, bitrate, id_):
+    def _set_encoded_bitrate(self, bitrate, id_):
         """
-        Includes the maximum encoded bitrate in the data for each representaton.
+        Includes the maximum and average encoded bitrate in the data for
+        each representation.
 
         """
-        representation = (
-            i for i in self.media['representations'] if i['id'] == id_).next()
-        representation['maximum_encoded_bitrate'] = bitrate
+        for representation in self.media['representations']:
+            if representation['id'] == id_:
+                representation['maximum_encoded_bitrate'] = bitrate[0]
+                representation['average_encoded_bitrate'] = bitrate[1]
 
-    def candidate(self, bandwidth):
+    def candidate(self, bandwidth, buffer_level=0):
         """
         Select the playback candidate that best matches current bandwidth
-        availability.
+        availability and buffer level, using the configured ABR algorithm.
+
+        The next segment is looked up by presentation time within the chosen
+        representation only, so representations need not share segment
+        boundaries. Returns `None` once the end of the presentation has been
+        reached.
 
         """
-        # TODO: account for none aligned segments
         if self.player.options.vlc and self.first_chunk:
-            candidate_index = self.bandwidth_match(self.max_bandwidth)
+            candidate_index = len(self.ladder) - 1
             self.first_chunk = False
         else:
-            candidate_index = self.bandwidth_match(bandwidth)
-        candidate = None
-        for representation in self.media['representations']:
-            if representation is self.media[
-                    'representations'][candidate_index]:
-                try:
-                    candidate = {'item': representation['queue'].get_nowait(),
-                                 'id': representation['id'],
-                                 'bandwidth': representation['bandwidth'],
-                                 'max_encoded_bitrate':
-                                 representation['maximum_encoded_bitrate']}
-                except Queue.Empty:
-                    break
-            else:
-                try:
-                    representation['queue'].get_nowait()
-                except Queue.Empty:
-                    break
+            candidate_index = self.bandwidth_match(bandwidth, buffer_level)
+        representation = self.media['representations'][candidate_index]
+        segments = representation['segments']
+        try:
+            index = segments.index_at(self.position)
+        except IndexError:
+            return None
+        candidate = self._candidate(representation, index)
+        self.position = candidate['time'] + candidate['item']['duration']
         return candidate
 
-    def bandwidth_match(self, bandwidth):
-        """Matches the bandwidth with the nearest representation."""
-        candidate_index = min(range(len(self.media['representations'])),
-                              key=lambda
-                              i: abs(self.media['representations']
-                                     [i]['bandwidth'] - int(bandwidth)))
-        return candidate_index
+    def alternative(self, time, index):
+        """
+        Return the candidate for the segment containing a presentation time,
+        from the representation at the given index of the ladder, or `None`
+        if there is no such segment. The playback position is unaffected.
 
-    class Template(object):
+        """
+        representation = self.media['representations'][index]
+        try:
+            segment_index = representation['segments'].index_at(time)
+        except IndexError:
+            return None
+        return self._candidate(representation, segment_index)
 
+    def find(self, url, bytes_from=0):
         """
-        Represents a Segment Template and the details within.
+        Return the candidate for the segment at a URL (and byte offset), or
+        `None` if there is no such segment. The playback position is
+        unaffected.
 
-        Used to resolve a URL given the current parameters.
+        The segments of every representation are indexed by URL on the first
+        call.
 
         """
+        if self._index is None:
+            self._index = dict()
+            for representation in self.media['representations']:
+                segments = representation['segments']
+                for index in xrange(len(segments)):
+                    item = segments[index]
+                    self._index.setdefault(
+                        (item['url'], int(item['bytes_from'])),
+                        (representation, index))
+        try:
+            representation, index = self._index[(url, int(bytes_from))]
+        except KeyError:
+            return None
+        return self._candidate(representation, index)
 
-        def __init__(self, element):
-            """Initialise template object using XML element."""
-            self.timescale = int(element.attrib['timescale'])
-            self.media = str(element.attrib['media'])
-            self.start_number = int(element.attrib['startNumber'])
-            self.duration = int(element.attrib['duration'])
-            self.initialisation = str(element.attrib['initialization'])
+    def _candidate(self, representation, index):
+        """
+        Return the candidate for a segment of a representation, making sure
+        the representation is initialised first.
 
-        def resolve(self, **kwargs):
-            """Return the URL with arguments substituted."""
-            media = self.media
-            for key, value in kwargs.items():
-                key = "$" + key.title() +"$"
-                media = media.replace(key, str(value))
-            return media
+        """
+        self._ensure_initialised(representation['id'])
+        return {'item': representation['segments'][index],
+                'time': representation['segments'].start_time(index),
+                'id': representation['id'],
+                'bandwidth': representation['bandwidth'],
+                'max_encoded_bitrate':
+                representation['maximum_encoded_bitrate']}
+
+    def bandwidth_match(self, bandwidth, buffer_level=0):
+        """Matches the bandwidth with the representation chosen by ABR."""
+        return self.abr.select(int(bandwidth), buffer_level)
 
     class BaseURL(object):
 
@@ -450,6 +634,10 @@ class Representations(object):
         period = None
         mpd = None
         origin = None
+        _levels = {'Representation': 'representation',
+                   'AdaptationSet': 'adaption_set',
+                   'Period': 'period',
+                   'MPD': 'mpd'}
 
         def __init__(self, origin):
             """Initialise base URL object by clearing all values."""
@@ -464,6 +652,17 @@ class Representations(object):
             self.mpd = ''
             self.origin = ''
 
+        def set(self, level, value):
+            """
+            Set the base URL for the level named by an element tag.
+
+            Tags which do not carry a base URL are ignored.
+
+            """
+            attribute = self._levels.get(level)
+            if attribute:
+                setattr(self, attribute, value)
+
         def resolve(self):
             """Return the correct base URL."""
             if self.representation != str(''):
@@ -0,0 +1,293 @@
+#!/usr/bin/env python2.7
+
+"""Index-addressable sources of the segments within a representation."""
+
+import abc
+import array
+import bisect
+import itertools
+import re
+
+
+class Template(object):
+
+    """
+    Represents a Segment Template and the details within.
+
+    The media and initialisation templates are compiled once into tokens,
+    from which %-format strings are built. Identifiers may carry a width
+    tag (such as `$Number%05d$`) and `$$` is an escaped dollar sign.
+
+    """
+
+    identifiers = ['RepresentationID', 'Number', 'Bandwidth', 'Time']
+    _token = re.compile(r'\$(?:(%s)(%%0\d+[diouxX])?)?\$' %
+                        '|'.join(identifiers))
+
+    def __init__(self, element):
+        """Initialise template object using XML element."""
+        self.timescale = int(element.get('timescale', 1))
+        self.media = str(element.attrib['media'])
+        self.start_number = int(element.get('startNumber', 1))
+        self.duration = int(element.attrib['duration'])
+        self.initialisation = element.get('initialization')
+        if self.initialisation is not None:
+            self.initialisation = str(self.initialisation)
+        self._media = self.compile(self.media)
+        self._media_format = self.format(self._media)
+
+    @classmethod
+    def compile(cls, template):
+        """
+        Split a template into tokens.
+
+        Each token is either a literal string or an (identifier, format)
+        pair.
+
+        """
+        tokens = []
+        position = 0
+        for match in cls._token.finditer(template):
+            tokens.append(template[position:match.start()])
+            if match.group(1):
+                tokens.append((match.group(1), match.group(2) or '%s'))
+            else:
+                tokens.append('$')
+            position = match.end()
+        tokens.append(template[position:])
+        return tokens
+
+    @staticmethod
+    def format(tokens, **values):
+        """
+        Build a %-format string from tokens, substituting the values given.
+
+        Identifiers without a value are left as named fields, so that the
+        result can be completed for each segment in a single operation.
+
+        """
+        parts = []
+        for token in tokens:
+            if isinstance(token, tuple):
+                name, format_ = token
+                if name in values:
+                    parts.append((format_ % values[name]).replace('%', '%%'))
+                else:
+                    parts.append('%(' + name + ')' + format_[1:])
+            else:
+                parts.append(token.replace('%', '%%'))
+        return ''.join(parts)
+
+    def media_format(self, representation_id, bandwidth):
+        """Return the media format string for a single representation."""
+        return self.format(self._media, RepresentationID=representation_id,
+                           Bandwidth=bandwidth)
+
+    def resolve(self, **kwargs):
+        """Return the media URL with arguments substituted."""
+        return self._media_format % kwargs
+
+    def resolve_initialisation(self, representation_id, bandwidth):
+        """Return the initialisation URL of a representation."""
+        return self.format(self.compile(self.initialisation),
+                           RepresentationID=representation_id,
+                           Bandwidth=bandwidth) % {}
+
+
+class Segments(object):
+
+    """
+    Common behaviour of the segment sources.
+
+    Segments are addressed either by index or by presentation time. Sources
+    are not modified once parsed, so the position of playback is kept by the
+    consumer rather than by the source.
+
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def __len__(self):
+        """Return the number of segments in the representation."""
+
+    @abc.abstractmethod
+    def __getitem__(self, index):
+        """Return the segment at the given index."""
+
+    @abc.abstractmethod
+    def start_time(self, index):
+        """Return the presentation time at which a segment starts."""
+
+    @abc.abstractmethod
+    def index_at(self, time):
+        """
+        Return the index of the segment containing the given presentation
+        time.
+
+        Raises `IndexError` if the time is beyond the final segment.
+
+        """
+
+    def extents(self):
+        """
+        Return the URLs addressed by byte range, each with the size (in
+        bytes) of the file needed to hold every range.
+
+        """
+        return []
+
+    def _check_index(self, index):
+        """Normalise a (possibly negative) index and check it is in range."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('segment index out of range')
+        return index
+
+
+class TemplateSegments(Segments):
+
+    """
+    Segments of a representation described by a segment template.
+
+    Nothing is resolved in advance. The URL, number and time of a segment are
+    computed from its index when it is requested, so neither load time nor
+    memory use depend on the length of the presentation.
+
+    """
+
+    def __init__(self, template, base_url, id_, bandwidth, count):
+        """
+        Initialise the segment source from a template and its context.
+
+        The identifiers which are constant for the representation are
+        substituted once, leaving only the number and time to resolve.
+
+        """
+        self.template = template
+        self.id_ = id_
+        self.bandwidth = bandwidth
+        self.duration = template.duration / template.timescale
+        self._count = count
+        self._format = base_url.replace('%', '%%') + \
+            template.media_format(id_, bandwidth)
+
+    def __len__(self):
+        """Return the number of segments in the representation."""
+        return self._count
+
+    def __getitem__(self, index):
+        """Resolve the segment at the given index."""
+        index = self._check_index(index)
+        url = self._format % {'Number': self.template.start_number + index,
+                              'Time': index * self.template.duration}
+        return {'duration': self.duration, 'url': url,
+                'bytes_from': 0, 'bytes_to': 0}
+
+    def start_time(self, index):
+        """Return the presentation time at which a segment starts."""
+        return self._check_index(index) * self.duration
+
+    def index_at(self, time):
+        """Return the index of the segment containing the given time."""
+        return self._check_index(int(time // self.duration))
+
+
+class ListSegments(Segments):
+
+    """
+    Segments of a representation described by a segment list.
+
+    Segments are stored as columns rather than as a dictionary each. Every
+    distinct URL is held once in a table and referenced by index, while byte
+    ranges and durations are held in 64-bit integer arrays. Byte range
+    (single file) manifests, which repeat the same URL for every segment,
+    therefore cost a few bytes per segment.
+
+    """
+
+    _columns = ['_url', '_bytes_from', '_bytes_to', '_duration', '_start']
+
+    def __init__(self):
+        """Initialise an empty segment index."""
+        self.urls = []
+        self._url_index = {}
+        self._url = array.array('I')
+        self._bytes_from = array.array('l')
+        self._bytes_to = array.array('l')
+        self._duration = array.array('l')
+        self._start = array.array('l')
+
+    def append(self, url, bytes_from, bytes_to, duration):
+        """Add a segment to the end of the index."""
+        try:
+            url_index = self._url_index[url]
+        except KeyError:
+            url_index = self._url_index[url] = len(self.urls)
+            self.urls.append(url)
+        if self._start:
+            self._start.append(self._start[-1] + self._duration[-1])
+        else:
+            self._start.append(0)
+        self._url.append(url_index)
+        self._bytes_from.append(bytes_from)
+        self._bytes_to.append(bytes_to)
+        self._duration.append(duration)
+
+    def __getstate__(self):
+        """
+        Return the state used when pickling the index.
+
+        Columns are stored as raw machine bytes, which are both smaller and
+        far quicker to restore than lists of integers.
+
+        """
+        return {'urls': self.urls,
+                'columns': [(name, getattr(self, name).tostring())
+                            for name in self._columns]}
+
+    def __setstate__(self, state):
+        """Restore the index from a pickled state."""
+        self.urls = state['urls']
+        self._url_index = dict((url, index) for index, url in
+                               enumerate(self.urls))
+        for name, data in state['columns']:
+            column = array.array('I' if name == '_url' else 'l')
+            column.fromstring(data)
+            setattr(self, name, column)
+
+    def __len__(self):
+        """Return the number of segments in the representation."""
+        return len(self._url)
+
+    def __getitem__(self, index):
+        """Return the segment at the given index."""
+        index = self._check_index(index)
+        return {'duration': self._duration[index],
+                'url': self.urls[self._url[index]],
+                'bytes_from': self._bytes_from[index],
+                'bytes_to': self._bytes_to[index]}
+
+    def start_time(self, index):
+        """Return the presentation time at which a segment starts."""
+        return self._start[self._check_index(index)]
+
+    def index_at(self, time):
+        """Return the index of the segment containing the given time."""
+        if not self._start or \
+                time >= self._start[-1] + self._duration[-1]:
+            raise IndexError('time beyond final segment')
+        return bisect.bisect_right(self._start, time) - 1
+
+    def extents(self):
+        """
+        Return the URLs addressed by byte range, each with the size (in
+        bytes) of the file needed to hold every range.
+
+        """
+        sizes = [0] * len(self.urls)
+        for url_index, bytes_to in itertools.izip(self._url, self._bytes_to):
+            if bytes_to + 1 > sizes[url_index]:
+                sizes[url_index] = bytes_to + 1
+        return [(url, size) for url, size in zip(self.urls, sizes) if size > 1]
@@ -0,0 +1,212 @@
+#!/usr/bin/env python2.7
+
+"""Discrete-event simulation, used to play faster than real time."""
+
+import collections
+import heapq
+import time
+import traceback
+import urlparse
+
+import scootplayer.origin as origin
+
+# Loops which wait no longer than this are polling for a change of state.
+POLL = 0.01
+
+
+class Simulation(object):
+
+    """
+    Runs calls, timers and HTTP requests on a virtual clock, in place of the
+    engine.
+
+    Rather than waiting for a timer, the clock jumps straight to it. Loops
+    which poll for a change of state are run again only once another loop of
+    the same group (such as a player) has made progress, or one of the
+    downloads it started has completed, rather than every few milliseconds.
+    Calls, timers and downloads belong to the group of whatever scheduled
+    them.
+
+    Requests are answered with the synthetic content of the MPDs played, as
+    served by the local origin. Responses are delayed by the latency of the
+    link, and bodies are sent one after another at its throughput, following
+    a traffic trace if one is given (or instantly otherwise).
+
+    """
+
+    def __init__(self, trace=None, start=None):
+        """Start the clock at the given time, or at the current time."""
+        self.trace = trace
+        self.start = time.time() if start is None else start
+        self.now = self.start
+        self.content = origin.Content('http://simulation/')
+        self._manifests = set()
+        self._calls = collections.deque()
+        self._timers = []
+        self._timer_count = 0
+        self._group = None
+        self._waiting = dict()
+        self._changed = []
+        self._link = self.start
+
+    def time(self):
+        """Return the current time of the virtual clock."""
+        return self.now
+
+    def call_soon(self, function, args=()):
+        """Run a function as soon as possible, without advancing the clock."""
+        self._calls.append((function, args, self._group))
+
+    def call_later(self, delay, function, args=()):
+        """Run a function after a delay in (virtual) seconds."""
+        self._call_at(self.now + max(float(delay), 0), function, args)
+
+    def loop(self, step, group=None):
+        """
+        Call a step function repeatedly, waiting for the time it returns
+        between calls, until it returns `None`. A step which returns zero
+        (or `None`) has made progress.
+
+        """
+        self._calls.append((self._step, (step,), group))
+
+    def add_manifest(self, path, url=None):
+        """
+        Serve the content of an MPD, along with that of any others. The
+        relative URLs of a remote MPD are resolved against its URL.
+
+        """
+        if (path, url) not in self._manifests:
+            self._manifests.add((path, url))
+            self.content.add_manifest(path, url)
+
+    def fetch(self, url, headers, handler):
+        """
+        Start a GET request, with the same handler interface as the engine.
+
+        The response arrives after the latency of the link at the time of the
+        request.
+
+        """
+        latency = 0
+        if self.trace:
+            _, latency, _ = self.trace.at(self.now - self.start)
+        path = urlparse.urlsplit(url).path
+        if not path.startswith('/'):
+            path = '/' + path
+        self.call_later(latency, self._respond,
+                        (self.content.get(path), headers, handler))
+
+    def run(self, until=None):
+        """
+        Run the calls and timers in order, until a condition holds or there is
+        nothing left to run.
+
+        """
+        while not (until and until()):
+            if self._calls:
+                function, args, group = self._calls.popleft()
+                self._run(group, function, args)
+            elif self._changed:
+                group = self._changed.pop(0)
+                for step in self._waiting.pop(group, []):
+                    self._run(group, self._step, (step,))
+            elif self._timers:
+                when, _, function, args, group = heapq.heappop(self._timers)
+                self.now = max(self.now, when)
+                self._run(group, function, args)
+            else:
+                return
+
+    def _run(self, group, function, args):
+        """Call a function on behalf of a group."""
+        previous, self._group = self._group, group
+        try:
+            _call(function, args)
+        finally:
+            self._group = previous
+
+    def _call_at(self, when, function, args=()):
+        """Run a function at a time of the virtual clock."""
+        self._timer_count += 1
+        heapq.heappush(self._timers, (when, self._timer_count, function,
+                                      args, self._group))
+
+    def _step(self, step):
+        """Call a step function, then schedule its next call."""
+        delay = step()
+        if delay is not None and 0 < delay <= POLL:
+            self._waiting.setdefault(self._group, []).append(step)
+            return
+        if not delay:
+            self._progress()
+        if delay is not None:
+            self.call_later(delay, self._step, (step,))
+
+    def _progress(self):
+        """Wake the polling loops of the current group."""
+        if self._group not in self._changed:
+            self._changed.append(self._group)
+
+    def _respond(self, resource, headers, handler):
+        """
+        Respond with the whole of a file, or the range requested, then send
+        its body after any bodies already on the link.
+
+        """
+        if resource is None:
+            self._fail(handler, 404)
+            return
+        whole = (0, resource.size - 1)
+        try:
+            requested = origin.parse_range(headers.get('Range'),
+                                           resource.size)
+        except ValueError:
+            requested = whole
+        if requested is None:
+            self._fail(handler, 416)
+            return
+        length = requested[1] - requested[0] + 1
+        status = 200 if requested == whole else 206
+        if handler.response(status, {'content-length': str(length)},
+                            None) is False:
+            self._done(handler, 'abandoned')
+            return
+        sent = max(self.now, self._link)
+        for chunk in resource.read(requested[0], length):
+            sent = self._send(sent, len(chunk) * 8)
+            self._call_at(sent, handler.chunk, (chunk,))
+        self._link = sent
+        self._call_at(sent, self._done, (handler, None))
+
+    def _send(self, time_, bits):
+        """Return the time at which the link has sent bits from a time."""
+        if not self.trace:
+            return time_
+        return self.start + self.trace.finish(time_ - self.start, bits)
+
+    def _fail(self, handler, status):
+        """Respond with an error and no body."""
+        if handler.response(status, {'content-length': '0'}, None) is False:
+            self._done(handler, 'abandoned')
+        else:
+            self._done(handler, None)
+
+    def _done(self, handler, error):
+        """Complete a request, waking the polling loops of its group."""
+        self._progress()
+        handler.done(error)
+
+
+def _call(function, args):
+    """
+    Call a function on the simulation.
+
+    Errors are printed rather than raised, so that one failing call does not
+    stop the simulation for everything else.
+
+    """
+    try:
+        return function(*args)
+    except Exception:
+        traceback.print_exc()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python2.7
+
+"""Writes downloaded media to the files of a playlist item, or to memory."""
+
+import os
+import threading
+import urlparse
+import zlib
+
+
+class Output(object):
+
+    """
+    A single output file, held open for the lifetime of a playlist item.
+
+    Writes are positional. Python 2 has no `os.pwrite`, so the seek and
+    write of each chunk are serialised on a lock instead, allowing several
+    downloaders to write byte ranges of the same file.
+
+    """
+
+    def __init__(self, path, size=0):
+        """Open (creating if necessary) the file, extending it to a size."""
+        self.path = path
+        self.unsynced = 0
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0644)
+        if size and os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+
+    def write(self, offset, data):
+        """Write data at an offset in the file. Returns the end offset."""
+        with self._lock:
+            if self._fd is None:
+                raise IOError('write to closed file: ' + self.path)
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            view = buffer(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            self.unsynced += len(data)
+        return offset + len(data)
+
+    def sync(self):
+        """Flush the written data of the file to disk."""
+        with self._lock:
+            if self._fd is not None and self.unsynced:
+                os.fsync(self._fd)
+                self.unsynced = 0
+
+    def close(self):
+        """
+        Close the file. Any later writes (from downloads still in flight)
+        fail rather than reaching whichever file reuses the descriptor.
+
+        """
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class FileSink(object):
+
+    """
+    Set of output files for the downloads of a playlist item.
+
+    The path of each URL is kept beneath the directory of the sink, so that
+    files of the same name (such as the initialisations and segments of
+    different representations) never share an output. Each file is opened
+    once, on its first write, rather than once per
+    segment. Files whose final size is known in advance (such as the single
+    file of a byte range representation) are extended to that size when
+    opened. Data is synced to disk in batches of a given amount of bytes,
+    or not at all if the interval is zero.
+
+    """
+
+    def __init__(self, directory, sync_interval=0):
+        """Initialise an empty sink writing to the given directory."""
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self._sizes = dict()
+        self._outputs = dict()
+        self._lock = threading.Lock()
+
+    def path(self, url):
+        """Return the path to which the given URL is written."""
+        parts = [part for part in urlparse.urlsplit(url).path.split('/')
+                 if part not in ('', '.', '..')]
+        return '/'.join([self.directory] + parts)
+
+    def reserve(self, url, size):
+        """Record the final size (in bytes) of the file of a URL."""
+        path = self.path(url)
+        self._sizes[path] = max(size, self._sizes.get(path, 0))
+
+    def open(self, url):
+        """Return the output file of a URL, opening it if necessary."""
+        path = self.path(url)
+        with self._lock:
+            try:
+                return self._outputs[path]
+            except KeyError:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                output = Output(path, self._sizes.get(path, 0))
+                self._outputs[path] = output
+                return output
+
+    def written(self, output):
+        """Sync an output file if enough data has been written to it."""
+        if self.sync_interval and output.unsynced >= self.sync_interval:
+            output.sync()
+
+    def stop(self):
+        """Sync (if enabled) and close each of the output files."""
+        with self._lock:
+            outputs = self._outputs.values()
+            self._outputs = dict()
+        for output in outputs:
+            if self.sync_interval:
+                output.sync()
+            output.close()
+
+
+class Payload(object):
+
+    """
+    The payload of a single download held by a memory sink.
+
+    Only the size and a running (Adler-32) checksum are kept; the data
+    itself goes to the ring buffer of the sink.
+
+    """
+
+    def __init__(self, sink, url):
+        """Start an empty payload for a URL."""
+        self.sink = sink
+        self.url = url
+        self.start = None
+        self.size = 0
+        self.checksum = zlib.adler32('')
+
+    def write(self, offset, data):
+        """Append data to the payload. Returns the end offset."""
+        if self.start is None:
+            self.start = offset
+        self.sink.append(data)
+        self.size += len(data)
+        self.checksum = zlib.adler32(data, self.checksum)
+        return offset + len(data)
+
+
+class MemorySink(object):
+
+    """
+    Keeps the most recent downloads in a ring buffer in memory.
+
+    The buffer is allocated once and overwritten in place, so memory use is
+    bounded and no allocation is made per segment. The size and checksum of
+    each payload are logged (if a log file is given) so that the integrity
+    of downloads can be checked without writing them to disk.
+
+    """
+
+    fields = ['url', 'bytes_from', 'size', 'checksum']
+
+    def __init__(self, size, log=None):
+        """Allocate a ring buffer of the given size in bytes."""
+        self.size = size
+        self.log = log
+        self.written_bytes = 0
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._lock = threading.Lock()
+        if self.log:
+            self.log.write(','.join(self.fields) + '\n')
+
+    def path(self, url):
+        """Return an empty path, as nothing is written to disk."""
+        return ''
+
+    def reserve(self, url, size):
+        """Ignore the final size of a file, as no file is written."""
+
+    def open(self, url):
+        """Return a new payload for a URL."""
+        return Payload(self, url)
+
+    def append(self, data):
+        """Copy data into the ring buffer, overwriting the oldest data."""
+        if not self.size:
+            return
+        data = memoryview(data)[-self.size:]
+        with self._lock:
+            start = self.written_bytes % self.size
+            first = min(len(data), self.size - start)
+            self._view[start:start + first] = data[:first]
+            self._view[:len(data) - first] = data[first:]
+            self.written_bytes += len(data)
+
+    def contents(self):
+        """Return the data in the ring buffer, oldest first."""
+        with self._lock:
+            if self.written_bytes < self.size:
+                return str(self._buffer[:self.written_bytes])
+            start = self.written_bytes % self.size
+            return str(self._buffer[start:] + self._buffer[:start])
+
+    def written(self, payload):
+        """Log the size and checksum of a complete payload."""
+        with self._lock:
+            if self.log:
+                self.log.write('%s,%s,%s,%08x\n' % (
+                    payload.url, payload.start, payload.size,
+                    payload.checksum & 0xffffffff))
+
+    def stop(self):
+        """
+        Close the log of payloads. Payloads completed later (by downloads
+        still in flight) are not logged.
+
+        """
+        with self._lock:
+            if self.log:
+                self.log.close()
+                self.log = None
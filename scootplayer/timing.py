@@ -0,0 +1,115 @@
+#!/usr/bin/env python2.7
+
+"""Measures the phases of the requests made by the player."""
+
+import time
+
+import requests
+from requests.packages.urllib3 import connection, connectionpool
+
+# Replaced by the clock of the simulation when running on a virtual clock.
+clock = None
+
+
+def now():
+    """Return the current time of the player."""
+    if clock:
+        return clock()
+    return time.time()
+
+
+class Timing(object):
+
+    """
+    The timestamps of a single request.
+
+    The request is split into connecting (zero if a pooled connection was
+    reused), waiting for the response headers and transferring the body.
+
+    """
+
+    fields = ['url', 'bytes_from', 'bytes_to', 'reused', 'connect', 'wait',
+              'transfer', 'total', 'length']
+
+    def __init__(self, item):
+        """Start timing the request of an item."""
+        self.item = item
+        self.start = now()
+        self.connected = self.start
+        self.reused = False
+        self.responded = None
+        self.end = None
+        self.length = 0
+
+    def response(self, connected_at=None):
+        """
+        Record the arrival of the response headers, along with the time at
+        which the connection used was established (if known).
+
+        """
+        self.responded = now()
+        if connected_at is not None:
+            self.reused = connected_at < self.start
+            self.connected = max(connected_at, self.start)
+
+    def finish(self, length):
+        """Record the end of the body and its length in bits."""
+        self.end = now()
+        self.length = length
+
+    def phases(self):
+        """Return the duration of each phase of the request in seconds."""
+        responded = self.responded or self.end
+        return {'connect': self.connected - self.start,
+                'wait': responded - self.connected,
+                'transfer': self.end - responded,
+                'total': self.end - self.start}
+
+    def row(self):
+        """Return the values of each field, in order."""
+        values = dict(self.phases(), url=self.item['url'],
+                      bytes_from=self.item['bytes_from'],
+                      bytes_to=self.item['bytes_to'], reused=int(self.reused),
+                      length=self.length)
+        return [values[field] for field in self.fields]
+
+
+class TimedHTTPConnection(connection.HTTPConnection):
+
+    """HTTP connection which records when it was established."""
+
+    connected_at = None
+
+    def connect(self):
+        """Connect, recording the time once established."""
+        connection.HTTPConnection.connect(self)
+        self.connected_at = now()
+
+
+class TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+
+    """Connection pool of timed HTTP connections."""
+
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+
+    """Transport adapter whose HTTP connections are timed."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Create the pool manager, using timed HTTP connection pools."""
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            self.poolmanager.pool_classes_by_scheme,
+            http=TimedHTTPConnectionPool)
+
+
+def connected_at(response):
+    """
+    Return the time at which the connection of a streamed response was
+    established, or `None` if unknown.
+
+    """
+    return getattr(getattr(response.raw, '_connection', None),
+                   'connected_at', None)
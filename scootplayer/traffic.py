@@ -0,0 +1,149 @@
+#!/usr/bin/env python2.7
+
+"""Emulates traffic conditions by replaying a network trace."""
+
+import bisect
+import re
+import threading
+import time
+
+
+class Trace(object):
+
+    """
+    Throughput and latency over time, replayed in a loop.
+
+    Each row of the trace holds from its time until the time of the next. The
+    final row holds for the average interval between rows, after which the
+    trace starts again.
+
+    """
+
+    def __init__(self, rows):
+        """Initialise from (time, bits per second, latency) rows."""
+        if not rows:
+            raise ValueError('empty trace')
+        rows = sorted(rows)
+        start = rows[0][0]
+        self.times = [row[0] - start for row in rows]
+        self.throughputs = [row[1] for row in rows]
+        self.latencies = [row[2] for row in rows]
+        if len(rows) > 1:
+            self.period = self.times[-1] * len(rows) / (len(rows) - 1) \
+                or None
+        else:
+            self.period = None
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a trace from a file.
+
+        Each line gives the time (in seconds), the throughput (in kilobits per
+        second) and, optionally, the latency (in milliseconds), separated by
+        commas or whitespace. Lines which do not start with a number (such as
+        headers or comments) are skipped.
+
+        """
+        rows = []
+        with open(path) as file_:
+            for line in file_:
+                fields = [field for field in re.split(r'[\s,]+', line)
+                          if field]
+                try:
+                    values = [float(field) for field in fields[:3]]
+                except ValueError:
+                    continue
+                if len(values) < 2:
+                    continue
+                latency = values[2] / 1000.0 if len(values) > 2 else 0
+                rows.append((values[0], values[1] * 1000, latency))
+        return cls(rows)
+
+    def at(self, time_):
+        """
+        Return the throughput and latency at a time, and the time until they
+        next change (or `None` if they never do).
+
+        """
+        if self.period:
+            time_ %= self.period
+        index = bisect.bisect_right(self.times, time_) - 1
+        if index + 1 < len(self.times):
+            remaining = self.times[index + 1] - time_
+        elif self.period:
+            remaining = self.period - time_
+        else:
+            remaining = None
+        return self.throughputs[index], self.latencies[index], remaining
+
+    def finish(self, time_, bits):
+        """
+        Return the time at which a link following the trace, starting to send
+        an amount of bits at the given time, has sent them all.
+
+        """
+        if not any(self.throughputs):
+            raise ValueError('trace has no throughput')
+        while bits > 0:
+            throughput, _, remaining = self.at(time_)
+            if remaining is None:
+                if not throughput:
+                    raise ValueError('trace has no throughput')
+                return time_ + bits / float(throughput)
+            if throughput * remaining >= bits:
+                return time_ + bits / float(throughput)
+            bits -= throughput * remaining
+            time_ += remaining
+        return time_
+
+
+class Shaper(object):
+
+    """
+    Token bucket whose rate follows a trace.
+
+    Shared by every download of the player, so that concurrent downloads
+    compete for the throughput of a single emulated link. The bucket holds
+    at most a burst of bits, so idle time does not bank throughput for
+    later. The clock and sleep functions may be replaced.
+
+    """
+
+    def __init__(self, trace, burst, clock=time.time, sleep=time.sleep):
+        """Start replaying a trace from the current time."""
+        self.trace = trace
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.start = clock()
+        self._tokens = 0
+        self._updated = self.start
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Wait for the latency of the link at the current time."""
+        _, latency, _ = self.trace.at(self.clock() - self.start)
+        if latency:
+            self.sleep(latency)
+
+    def consume(self, bits):
+        """Wait until the link has carried an amount of bits."""
+        with self._lock:
+            while True:
+                now = self.clock()
+                rate, _, _ = self.trace.at(self._updated - self.start)
+                self._tokens = min(self._tokens + rate * (now - self._updated),
+                                   max(self.burst, bits))
+                self._updated = now
+                throughput, _, remaining = self.trace.at(now - self.start)
+                if self._tokens >= bits:
+                    self._tokens -= bits
+                    return
+                if throughput:
+                    wait = (bits - self._tokens) / float(throughput)
+                    if remaining is not None:
+                        wait = min(wait, remaining)
+                else:
+                    wait = remaining or 1.0
+                self.sleep(max(wait, 0.001))
@@ -11,11 +11,12 @@ class Watchdog(object):
     watch_count = False
     max_seg_duration = 0
     run = False
+    retired = False
 
     def __init__(self, player):
         """Start thread to wait for max duration to become available."""
         self.player = player
-        self.player.start_thread(self.wait_for_max_seg_duration)
+        self.player.call_soon(self.wait_for_max_seg_duration)
 
     def wait_for_max_seg_duration(self):
         """
@@ -27,7 +28,7 @@ class Watchdog(object):
         """
         try:
             self.max_seg_duration = self.player.max_seg_duration()
-            self.player.start_thread(self.watchdog)
+            self.player.call_soon(self.watchdog)
         except AttributeError:
             self.player.start_timed_thread(1, self.wait_for_max_seg_duration)
 
@@ -51,7 +52,11 @@ class Watchdog(object):
         If playback stops for any reason, dump the current set of objects to
         file for analysis and debug.
 
+        Stops once the player has exited or moved onto the next item.
+
         """
+        if self.player.state == 'exit' or self.retired:
+            return
         self.player.start_timed_thread(self.max_seg_duration, self.watchdog)
         if self.run:
             report = self.player.retrieve_metric('report')
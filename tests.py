@@ -3,14 +3,36 @@ import unittest
 import os
 import time
 import random
-from mock import Mock, MagicMock
+import shutil
+import struct
+import tempfile
+import zlib
+import collections
+import BaseHTTPServer
+import SocketServer
+import threading
+import urllib2
+from mock import Mock, MagicMock, patch
 
 import scootplayer.player as player
+import scootplayer.abr as abr
 import scootplayer.bandwidth as bandwidth
+import scootplayer.cache as cache
+import scootplayer.engine as engine
+import scootplayer.fleet as fleet
+import scootplayer.hedging as hedging
+import scootplayer.mp4 as mp4
+import scootplayer.origin as origin
 import scootplayer.queue as queue
 import scootplayer.remote as remote
 import scootplayer.reporter as reporter
+import scootplayer.replay as replay
 import scootplayer.representations as representations
+import scootplayer.segments as segments
+import scootplayer.simulation as simulation
+import scootplayer.sink as sink
+import scootplayer.timing as timing
+import scootplayer.traffic as traffic
 import scootplayer.watchdog as watchdog
 import scootplayer.progressbar as progressbar
 
@@ -33,6 +55,24 @@ class Options():
     url = False
     conn_pool = 100
     debug = False
+    abr = 'nearest'
+    download_pipeline = 1
+    coalesce_duration = 0
+    coalesce_size = 4096
+    write = False
+    engine = 'threads'
+    initialisation = 'all'
+    sink = 'file'
+    hedge_percentile = 0
+    hedge_lower = False
+    abandon = False
+    bandwidth_estimator = 'last'
+    bandwidth_percentile = 50
+    traffic = None
+    replay = None
+    simulate = False
+    fleet = 0
+    keep_alive = True
 
 # class TestPlaybackQueue(unittest.TestCase):
 #
@@ -155,6 +195,1048 @@ class TestBandwidth(unittest.TestCase):
         self._bw.change(bandwidth_value)
         self.assertEqual(self._bw._current, bandwidth_value)
 
+    def test_progress(self):
+        """Sample a transfer, check the estimation changes as it goes."""
+        progress = bandwidth.Progress(self._bw, 10.0)
+        self.assertEqual(progress.sampled(), 0)
+        progress.sample(4000, 10.5)
+        self.assertEqual(int(self._bw), 0)
+        progress.sample(4000, 11.0)
+        self.assertEqual(int(self._bw), 8000)
+        progress.sample(2000, 11.5)
+        self.assertEqual(len(progress.samples), 3)
+        self.assertEqual(progress.sampled(), 6666)
+        self.assertEqual(progress.sampled(2), 6000)
+        progress.flush()
+        self.assertEqual(int(self._bw), 4000)
+        progress.flush()
+        self.assertEqual(len(self._bw.historical_trend()), 2)
+
+    def test_estimators(self):
+        """Feed each estimator a burst, check it is smoothed as expected."""
+        ewma = bandwidth.Ewma(fast=2.0, slow=8.0)
+        harmonic = bandwidth.HarmonicMean(window=4)
+        percentile = bandwidth.Percentile(window=4, percentile=50)
+        for value in [1000, 1000, 1000, 1000, 8000, 1000, 1000]:
+            for estimator in [ewma, harmonic, percentile]:
+                estimator.update(value, 2)
+        self.assertAlmostEqual(harmonic.estimate(),
+                               4 / (3 / 1000.0 + 1 / 8000.0))
+        self.assertEqual(percentile.estimate(), 1000)
+        self.assertTrue(1000 < ewma.estimate() < 2000)
+        ewma.update(100, 2)
+        self.assertTrue(ewma.estimate() < 1000)
+
+    def test_percentile(self):
+        """Slide percentiles over random samples, check against a sort."""
+        for value in [0, 10, 50, 90, 100]:
+            percentile = bandwidth.Percentile(window=8, percentile=value)
+            window = collections.deque(maxlen=8)
+            for _ in xrange(200):
+                sample = random.randint(0, 20)
+                percentile.update(sample)
+                window.append(sample)
+                ordered = sorted(window)
+                self.assertEqual(percentile.estimate(), ordered[min(
+                    len(ordered) * value / 100, len(ordered) - 1)])
+            self.assertTrue(len(percentile._lower._heap) +
+                            len(percentile._upper._heap) <= 2 * 8 + 2)
+
+    def test_concurrent(self):
+        """Change the estimation from several threads, check the window."""
+        self._bw = bandwidth.Bandwidth('percentile')
+        threads = [threading.Thread(target=lambda: [
+            self._bw.change(random.randint(1, 1000)) for _ in xrange(2000)])
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        percentile = self._bw._estimators['percentile']
+        self.assertEqual(len(percentile._lower) + len(percentile._upper),
+                         len(percentile._window))
+        self.assertEqual(len(self._bw.historical_trend()), 100)
+
+    def test_selected(self):
+        """Change bandwidth, check the selected estimator is current."""
+        self._bw = bandwidth.Bandwidth('harmonic')
+        self._bw.change(1000, 2)
+        self._bw.change(4000, 2)
+        self.assertEqual(int(self._bw), 1600)
+        self.assertEqual(self._bw.estimates()['estimate_last'], 4000)
+
+class TestTiming(unittest.TestCase):
+
+    ITEM = {'url': 'http://localhost/segment.m4s', 'bytes_from': 0,
+            'bytes_to': 0}
+
+    def test_new_connection(self):
+        """Time a request on a new connection, check its phases."""
+        with patch('time.time', side_effect=[10.0, 10.5, 11.0]):
+            record = timing.Timing(self.ITEM)
+            record.response(connected_at=10.2)
+            record.finish(8000)
+        self.assertFalse(record.reused)
+        phases = record.phases()
+        self.assertAlmostEqual(phases['connect'], 0.2)
+        self.assertAlmostEqual(phases['wait'], 0.3)
+        self.assertAlmostEqual(phases['transfer'], 0.5)
+        self.assertAlmostEqual(phases['total'], 1.0)
+
+    def test_reused_connection(self):
+        """Time a request on a pooled connection, check it has no connect."""
+        with patch('time.time', side_effect=[10.0, 10.5, 11.0]):
+            record = timing.Timing(self.ITEM)
+            record.response(connected_at=2.0)
+            record.finish(8000)
+        self.assertTrue(record.reused)
+        self.assertEqual(record.phases()['connect'], 0)
+        self.assertEqual(len(record.row()), len(timing.Timing.fields))
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.player = player.Player.__new__(player.Player)
+        self.player.options = Options()
+        self.player.options.write = True
+        self.player.bandwidth = bandwidth.Bandwidth()
+        self.player.event = MagicMock()
+        self.player.directory = tempfile.mkdtemp()
+        os.makedirs(self.player.directory + '/downloads')
+        self.player.managed_objects = {'sink': sink.FileSink(
+            self.player.directory + '/downloads')}
+
+    def tearDown(self):
+        player.remove_directory(self.player.directory)
+
+    def test_stream_to_file(self):
+        """Stream a body in chunks, check file, length and samples."""
+        chunks = ['a' * 100, 'b' * 100, 'c' * 50]
+        response = MagicMock()
+        response.iter_content.return_value = iter(chunks)
+        item = {'url': 'http://localhost/segment.m4s', 'bytes_from': 0,
+                'bytes_to': 0}
+        with patch('scootplayer.timing.now', side_effect=[0.5, 1.5, 2.0]):
+            length, path = self.player._stream_to_file(item, response,
+                                                       start=0)
+        self.assertEqual(length, 250 * 8)
+        self.player.managed_objects['sink'].stop()
+        self.assertEqual(open(path).read(), ''.join(chunks))
+        self.assertEqual(self.player.bandwidth.estimates()['estimate_last'],
+                         800)
+        self.assertEqual(int(self.player.bandwidth), 800)
+        self.assertEqual(len(self.player.bandwidth.historical_trend()), 2)
+
+    def test_cancelled(self):
+        """Cancel a streamed body, check the estimation is unchanged."""
+        control = hedging.Control()
+        control.cancel('lost')
+        response = MagicMock()
+        response.iter_content.return_value = iter(['a' * 100, 'b' * 100])
+        item = {'url': 'http://localhost/segment.m4s', 'bytes_from': 0,
+                'bytes_to': 0}
+        with patch('scootplayer.timing.now', side_effect=[0.5]):
+            length, _ = self.player._stream_to_file(item, response, control,
+                                                    start=0)
+        self.assertEqual(length, 100 * 8)
+        self.assertEqual(self.player.bandwidth.historical_trend(), [])
+
+class TestAbr(unittest.TestCase):
+
+    BANDWIDTHS = [45652, 176031, 378355, 791182, 2087594, 4219897]
+
+    def setUp(self):
+        self.ladder = abr.Ladder(random.sample(self.BANDWIDTHS,
+                                               len(self.BANDWIDTHS)))
+
+    def test_ladder_sorted(self):
+        """Build a ladder from shuffled bandwidths, check it is sorted."""
+        self.assertEqual(self.ladder.bandwidths, self.BANDWIDTHS)
+
+    def test_nearest(self):
+        """Match random bandwidths, check against a linear search."""
+        for _ in xrange(100):
+            bandwidth = random.randint(0, 5000000)
+            expected = min(range(len(self.BANDWIDTHS)), key=lambda i:
+                           abs(self.BANDWIDTHS[i] - bandwidth))
+            self.assertEqual(self.ladder.nearest(bandwidth), expected)
+
+    def test_highest_below(self):
+        """Check the highest sustainable rung is selected."""
+        self.assertEqual(self.ladder.highest_below(0), 0)
+        self.assertEqual(self.ladder.highest_below(800000), 3)
+        self.assertEqual(self.ladder.highest_below(10 ** 9), 5)
+
+    def test_buffer_based(self):
+        """Check the buffer-based rungs at the reservoir and cushion."""
+        algorithm = abr.ALGORITHMS['bba'](self.ladder, Options)
+        self.assertEqual(algorithm.select(10 ** 9, 0), 0)
+        self.assertEqual(algorithm.select(0, 60), 5)
+        self.assertTrue(0 < algorithm.select(0, 35) < 5)
+
+    def test_buffer_monotonic(self):
+        """Check that buffer never lowers quality, bar hybrid's startup."""
+        # Hybrid fills its reservoir on throughput alone; see test_hybrid.
+        for name in sorted(set(abr.ALGORITHMS) - set(['hybrid'])):
+            algorithm = abr.ALGORITHMS[name](self.ladder, Options)
+            choices = [algorithm.select(10 ** 9, level)
+                       for level in range(0, 61)]
+            self.assertEqual(choices, sorted(choices))
+            self.assertEqual(choices[-1], 5)
+
+    def test_bola(self):
+        """Check BOLA against a score of every rung, with a repeated rung."""
+        for bandwidths in [self.BANDWIDTHS, self.BANDWIDTHS + [378355]]:
+            algorithm = abr.Bola(abr.Ladder(bandwidths), Options)
+            ladder = algorithm.ladder
+            for level in [x / 4.0 for x in range(0, 241)]:
+                scores = [(algorithm.vp * (utility + algorithm.gp) - level) /
+                          ladder[index] for index, utility in
+                          enumerate(algorithm.utilities)]
+                self.assertEqual(algorithm.select(0, level),
+                                 scores.index(max(scores)))
+
+    def test_abstract(self):
+        """Check an algorithm which does not select cannot be created."""
+        self.assertRaises(TypeError, abr.Algorithm, self.ladder, Options)
+        self.assertRaises(TypeError, segments.Segments)
+
+    def test_hybrid(self):
+        """Check the hybrid algorithm never exceeds the throughput rule."""
+        hybrid = abr.ALGORITHMS['hybrid'](self.ladder, Options)
+        throughput = abr.ALGORITHMS['throughput'](self.ladder, Options)
+        for level in range(0, 61):
+            self.assertTrue(hybrid.select(500000, level) <=
+                            throughput.select(500000, level))
+        self.assertEqual(hybrid.select(10 ** 9, 0), 5)
+        self.assertEqual(hybrid.select(10 ** 9, 15), 2)
+
+class TestRepresentations(unittest.TestCase):
+
+    NON_SEG = 'examples/mpd/BigBuckBunnyNonSeg_2s_isoffmain_DIS_23009_1_v_2_1c2_2011_08_30.mpd'
+    TEMPLATE = 'examples/mpd/BigBuckBunny_2s_template.mpd'
+
+    def setUp(self):
+        self.player = MagicMock()
+        self.player.options = Options
+        self.player.manifest_cache = None
+        self.player.remote_manifests = {}
+
+    def _load(self, manifest):
+        with patch.object(representations.Representations, 'initialise'):
+            return representations.Representations(self.player, manifest)
+
+    def test_segment_list(self):
+        """Stream a segmented MPD, check representations and segments."""
+        reps = self._load(Options.manifest)
+        self.assertEqual(len(reps.media['representations']), 20)
+        self.assertEqual(len(reps.media['initialisations']), 20)
+        self.assertEqual(reps.min_buffer, 2)
+        self.assertEqual(reps.max_seg_duration, 2)
+        self.assertEqual(reps.mpd_duration, 596)
+        first = reps.media['representations'][0]['segments'][0]
+        self.assertEqual(first['url'], 'http://www-itec.uni-klu.ac.at/ftp/'
+                         'datasets/mmsys12/BigBuckBunny/bunny_2s/'
+                         'bunny_2s_50kbit/bunny_2s1.m4s')
+
+    def test_byte_ranges(self):
+        """Stream a single file MPD, check the byte ranges are parsed."""
+        reps = self._load(self.NON_SEG)
+        init = reps.media['initialisations'][0]['item']
+        self.assertEqual((init['bytes_from'], init['bytes_to']), (0, 862))
+        segments = reps.media['representations'][0]['segments']
+        self.assertEqual(len(segments.urls), 1)
+        self.assertEqual((segments[0]['bytes_from'], segments[0]['bytes_to']),
+                         (863, 13826))
+        self.assertEqual(segments[1]['bytes_from'], 13827)
+        self.assertEqual(segments.extents(),
+                         [(segments.urls[0], segments[-1]['bytes_to'] + 1)])
+
+    def test_find(self):
+        """Find a byte range segment by URL and offset, check the position."""
+        reps = self._load(self.NON_SEG)
+        segments = reps.media['representations'][3]['segments']
+        candidate = reps.find(segments[5]['url'], segments[5]['bytes_from'])
+        self.assertEqual(candidate['item'], segments[5])
+        self.assertEqual(candidate['time'], 10)
+        self.assertEqual(reps.find(segments[5]['url'], 1), None)
+        self.assertEqual(reps.position, 0)
+
+    def test_template(self):
+        """Load a templated MPD, check segments are resolved on demand."""
+        reps = self._load(self.TEMPLATE)
+        segments = reps.media['representations'][1]['segments']
+        self.assertEqual(len(segments), 299)
+        self.assertEqual(segments[9]['url'], 'http://www-itec.uni-klu.ac.at/'
+                         'ftp/datasets/mmsys12/BigBuckBunny/bunny_2s/'
+                         'bunny_2s_200kbit/bunny_2s10.m4s')
+        self.assertEqual(reps.media['initialisations'][1]['item']['url'],
+                         'http://www-itec.uni-klu.ac.at/ftp/datasets/'
+                         'mmsys12/BigBuckBunny/bunny_2s/bunny_2s_200kbit/'
+                         'init.mp4')
+        file_sink = sink.FileSink('downloads')
+        paths = set(file_sink.path(initialisation['item']['url'])
+                    for initialisation in reps.media['initialisations'])
+        self.assertEqual(len(paths), len(reps.media['initialisations']))
+        self.assertEqual(segments[9]['duration'], 2)
+        self.assertRaises(IndexError, segments.__getitem__, 299)
+
+    def test_candidate(self):
+        """Select candidates at changing bandwidths, check they advance."""
+        reps = self._load(Options.manifest)
+        urls = []
+        for bandwidth in [0, 10000000, 0, 500000]:
+            urls.append(reps.candidate(bandwidth)['item']['url'])
+        self.assertEqual([url.split('/')[-1] for url in urls],
+                         ['bunny_2s1.m4s', 'bunny_2s2.m4s', 'bunny_2s3.m4s',
+                          'bunny_2s4.m4s'])
+        self.assertNotEqual(urls[0].split('/')[-2], urls[1].split('/')[-2])
+        reps.position = reps.mpd_duration + 10
+        self.assertEqual(reps.candidate(0), None)
+
+    def test_lazy_initialisation(self):
+        """Load with lazy initialisations, check each is fetched on demand."""
+        class LazyOptions(Options):
+            initialisation = 'lazy'
+        self.player.options = LazyOptions
+        self.player.bandwidth = 0
+        fetched = []
+        self.player.fetch_item = lambda item: (fetched.append(item['url'])
+                                               or (1, 8, ''))
+        self.player.submit = lambda function, args: Mock(
+            get=Mock(return_value=function(*args)))
+        reps = representations.Representations(self.player, Options.manifest)
+        self.assertEqual([url.split('/')[-1] for url in fetched],
+                         ['bunny_50kbit_dash.mp4'])
+        reps.candidate(0)
+        self.assertEqual(len(fetched), 1)
+        reps.candidate(10000000)
+        self.assertEqual([url.split('/')[-1] for url in fetched],
+                         ['bunny_50kbit_dash.mp4', 'bunny_8000kbit_dash.mp4'])
+        reps.candidate(10000000)
+        self.assertEqual(len(fetched), 2)
+
+    def test_concurrent_initialisation(self):
+        """Choose a deferred representation twice at once, check both wait."""
+        class LazyOptions(Options):
+            initialisation = 'lazy'
+        self.player.options = LazyOptions
+        self.player.bandwidth = 0
+        fetched = []
+
+        def fetch_item(item):
+            time.sleep(0.1)
+            fetched.append(item['url'])
+            return 1, 8, ''
+        self.player.fetch_item = fetch_item
+        self.player.submit = lambda function, args: Mock(
+            get=Mock(return_value=function(*args)))
+        reps = representations.Representations(self.player, Options.manifest)
+        waited = []
+        threads = [threading.Thread(target=lambda: (
+            reps.alternative(0, len(reps.ladder) - 1),
+            waited.append(len(fetched)))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(fetched), 2)
+        self.assertEqual(waited, [2, 2])
+
+    def test_unaligned_segments(self):
+        """Look up segments by time across different segment durations."""
+        short, long_ = segments.ListSegments(), segments.ListSegments()
+        for number in range(6):
+            short.append('short%d' % number, 0, 0, 2)
+        for number in range(3):
+            long_.append('long%d' % number, 0, 0, 4)
+        self.assertEqual(short.index_at(5), 2)
+        self.assertEqual(long_.index_at(5), 1)
+        self.assertEqual(long_.start_time(long_.index_at(5)), 4)
+        self.assertRaises(IndexError, long_.index_at, 12)
+
+    def test_remote_not_modified(self):
+        """Fetch a remote MPD twice, check the model is reused on a 304."""
+        url = 'http://localhost/' + os.path.basename(self.NON_SEG)
+        directory = tempfile.mkdtemp()
+        self.player.create_directory = lambda path: directory
+        content = open(self.NON_SEG).read()
+        modified = Mock(status_code=200, headers={'ETag': '"1"'})
+        modified.iter_content.return_value = [content[:1000], content[1000:]]
+        self.player.session.get.side_effect = [modified,
+                                               Mock(status_code=304)]
+        try:
+            first = self._load(url).media['representations']
+            with patch.object(representations.Representations,
+                              'parse_mpd') as parse_mpd:
+                second = self._load(url).media['representations']
+                self.assertFalse(parse_mpd.called)
+        finally:
+            player.remove_directory(directory)
+        self.assertEqual(self.player.session.get.call_args[1]['headers'],
+                         {'If-None-Match': '"1"'})
+        self.assertEqual(len(second), len(first))
+        self.assertTrue(second[0]['segments'] is first[0]['segments'])
+
+class TestTemplate(unittest.TestCase):
+
+    def _template(self, media, **attributes):
+        element = Mock()
+        element.attrib = dict(media=media, duration='180000', **attributes)
+        element.get = element.attrib.get
+        return segments.Template(element)
+
+    def test_identifiers(self):
+        """Resolve each identifier, check they are substituted."""
+        template = self._template('$RepresentationID$/$Bandwidth$/'
+                                  '$Number$-$Time$.m4s')
+        self.assertEqual(template.resolve(RepresentationID='video', Number=3,
+                                          Bandwidth=500000, Time=7200),
+                         'video/500000/3-7200.m4s')
+
+    def test_width_and_escape(self):
+        """Resolve width tags and escaped dollars, check the result."""
+        template = self._template('seg$Number%05d$_$$1_%d.m4s')
+        self.assertEqual(template.resolve(Number=42), 'seg00042_$1_%d.m4s')
+
+    def test_segment_time(self):
+        """Check number and time of a templated segment with timescale."""
+        template = self._template('$Number$_$Time$.m4s', timescale='90000',
+                                  startNumber='0')
+        source = segments.TemplateSegments(template, 'http://a/%20/', 'v',
+                                           1000, 10)
+        self.assertEqual(source.duration, 2)
+        self.assertEqual(source[3]['url'], 'http://a/%20/3_540000.m4s')
+        self.assertEqual(source.index_at(7), 3)
+
+class TestMp4(unittest.TestCase):
+
+    def _init(self, handler='vide', bitrate=None):
+        """Build an initialisation with a single track."""
+        entry = '\0' * 78
+        if bitrate:
+            entry += mp4.box('btrt', struct.pack('>III', 0, *bitrate))
+        description = struct.pack('>II', 0, 1) + mp4.box('avc1', entry)
+        media = mp4.box('hdlr', struct.pack('>II4s', 0, 0, handler)) + \
+            mp4.box('minf', mp4.box('stbl', mp4.box('stsd', description)))
+        return mp4.box('ftyp', 'isom') + \
+            mp4.box('moov', mp4.box('trak', mp4.box('mdia', media)))
+
+    def test_btrt(self):
+        """Read the bitrate from the sample entry of a video track."""
+        data = self._init(bitrate=(900000, 750000))
+        self.assertEqual(mp4.video_bitrate(data), (900000, 750000))
+
+    def test_no_video(self):
+        """Check that an audio only file has no video bitrate."""
+        self.assertEqual(mp4.video_bitrate(self._init('soun', (1, 1))), None)
+
+    def test_sidx(self):
+        """Derive the bitrate from a segment index in the absence of btrt."""
+        references = struct.pack('>III', 250000, 2000, 0) + \
+            struct.pack('>III', 125000, 2000, 0)
+        index = mp4.box('sidx', struct.pack('>IIIIIHH', 0, 1, 1000, 0, 0, 0,
+                                            2) + references)
+        self.assertEqual(mp4.video_bitrate(self._init() + index),
+                         (1000000, 750000))
+
+    def test_read_range(self):
+        """Read a file containing more than the initialisation."""
+        init = self._init(bitrate=(500000, 400000))
+        handle, path = tempfile.mkstemp()
+        os.write(handle, init + mp4.box('mdat', '\0' * 1000))
+        os.close(handle)
+        try:
+            self.assertEqual(mp4.read_bitrate(path, len(init)),
+                             (500000, 400000))
+            self.assertEqual(mp4.read_bitrate(path, len(init) - 1), None)
+        finally:
+            os.remove(path)
+
+class TestManifestCache(unittest.TestCase):
+
+    NON_SEG = TestRepresentations.NON_SEG
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.player = MagicMock()
+        self.player.options = Options
+        self.player.manifest_cache = cache.ManifestCache(self.directory,
+                                                         1024 * 1024)
+        self.player.remote_manifests = {}
+
+    def tearDown(self):
+        player.remove_directory(self.directory)
+
+    def _load(self, manifest):
+        with patch.object(representations.Representations, 'initialise'):
+            return representations.Representations(self.player, manifest)
+
+    def test_restore(self):
+        """Load an MPD twice, check the second is restored from cache."""
+        parsed = self._load(self.NON_SEG).media['representations']
+        parsed = [(rep['id'], rep['segments'][10]) for rep in parsed]
+        self.player.event.reset_mock()
+        with patch.object(representations.Representations, 'parse_mpd') \
+                as parse_mpd:
+            cached = self._load(self.NON_SEG).media['representations']
+            self.assertFalse(parse_mpd.called)
+        self.player.event.assert_called_with('stop', 'parsing mpd (cached)')
+        self.assertEqual([(rep['id'], rep['segments'][10]) for rep in cached],
+                         parsed)
+
+    def test_memory(self):
+        """Load an MPD twice from memory, check only segments are shared."""
+        self.player.manifest_cache = cache.MemoryManifestCache()
+        first = self._load(self.NON_SEG)
+        second = self._load(self.NON_SEG)
+        self.assertIsNot(first.media, second.media)
+        for parsed, restored in zip(first.media['representations'],
+                                    second.media['representations']):
+            self.assertIsNot(parsed, restored)
+            self.assertIs(parsed['segments'], restored['segments'])
+
+    def test_evict(self):
+        """Fill a small cache, check the least recently used entry goes."""
+        manifest_cache = cache.ManifestCache(self.directory, 3500)
+        for age, key in enumerate(['third', 'second', 'first']):
+            manifest_cache.put(key, 'x' * 1000)
+            past = time.time() - 10 * (age + 1)
+            os.utime(manifest_cache._path(key), (past, past))
+        manifest_cache.get('first')
+        manifest_cache.put('fourth', 'x' * 1000)
+        self.assertEqual(manifest_cache.get('second'), None)
+        self.assertEqual(manifest_cache.get('first'), 'x' * 1000)
+        self.assertEqual(manifest_cache.get('fourth'), 'x' * 1000)
+
+class TestDownloadQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.player = MagicMock()
+        self.player.options = Options()
+        self.player.options.download_pipeline = 4
+        self.player.engine = None
+        self.player.simulation = None
+        self.player.start_thread = self._start_thread
+        self.player.fetch_item = lambda item: time.sleep(
+            random.uniform(0, 0.02))
+        self.ready = []
+        self.player.item_ready = self.ready.append
+        self.download_queue = queue.download.DownloadQueue(
+            player=self.player, time_buffer_max=100)
+        self.download_queue.resume()
+
+    def _start_thread(self, target, args=()):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def test_in_order(self):
+        """Download items concurrently, check they are delivered in order."""
+        representations = [{'item': {'duration': 1, 'url': str(index)},
+                            'bandwidth': 0, 'max_encoded_bitrate': 0,
+                            'id': index} for index in range(20)]
+        for representation in representations:
+            self.download_queue.add(representation)
+        self.download_queue.queue.join()
+        self.assertEqual(self.ready, representations)
+        self.assertEqual(self.download_queue.report['time_buffer'], 0)
+
+    def test_blocked_delivery(self):
+        """Block the playback queue, check later items still download."""
+        release = threading.Event()
+        fetched = []
+        self.player.fetch_item = fetched.append
+        self.player.item_ready = lambda representation: (
+            release.wait(), self.ready.append(representation))
+        representations = [{'item': {'duration': 1, 'url': str(index)},
+                            'bandwidth': 0, 'max_encoded_bitrate': 0,
+                            'id': index} for index in range(8)]
+        for representation in representations:
+            self.download_queue.add(representation)
+        deadline = time.time() + 2
+        while len(fetched) < 8 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(fetched), 8)
+        self.assertEqual(self.ready, [])
+        release.set()
+        self.download_queue.queue.join()
+        self.assertEqual(self.ready, representations)
+
+    def test_coalesce(self):
+        """Queue contiguous byte ranges, check they are merged in budget."""
+        self.player.options.download_pipeline = 0
+        self.player.options.coalesce_duration = 3
+        download_queue = queue.download.DownloadQueue(
+            player=self.player, time_buffer_max=100)
+        ranges = [('a', 0, 99), ('a', 100, 199), ('a', 200, 299),
+                  ('a', 300, 399), ('b', 400, 499)]
+        for sequence, (url, bytes_from, bytes_to) in enumerate(ranges):
+            download_queue.queue.put((sequence, {'item': {
+                'url': url, 'bytes_from': bytes_from, 'bytes_to': bytes_to,
+                'duration': 1}}))
+        batch = download_queue._coalesce([download_queue.queue.get()])
+        self.assertEqual([sequence for sequence, _ in batch], [0, 1, 2])
+        self.assertEqual(queue.download._merge(batch),
+                         {'url': 'a', 'bytes_from': 0, 'bytes_to': 299,
+                          'duration': 3})
+        batch = download_queue._coalesce([download_queue.queue.get()])
+        self.assertEqual([sequence for sequence, _ in batch], [3])
+
+class TestSink(unittest.TestCase):
+
+    URL = 'http://localhost/bunny_1s_dash.mp4'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sink = sink.FileSink(self.directory, sync_interval=100)
+
+    def tearDown(self):
+        self.sink.stop()
+        player.remove_directory(self.directory)
+
+    def test_reserve(self):
+        """Reserve the size of a file, check it is extended when opened."""
+        self.sink.reserve(self.URL, 1000)
+        self.sink.reserve(self.URL, 500)
+        output = self.sink.open(self.URL)
+        self.assertEqual(output.path, self.directory + '/bunny_1s_dash.mp4')
+        self.assertEqual(os.path.getsize(output.path), 1000)
+        self.assertTrue(self.sink.open(self.URL) is output)
+
+    def test_same_name(self):
+        """Open segments of the same name, check they are kept apart."""
+        first = self.sink.open('http://localhost/video_1/segment1.m4s')
+        second = self.sink.open('http://localhost/video_2/segment1.m4s')
+        self.assertFalse(first is second)
+        self.assertEqual(second.path,
+                         self.directory + '/video_2/segment1.m4s')
+        first.write(0, 'first')
+        second.write(0, 'second')
+        self.sink.stop()
+        self.assertEqual(open(first.path).read(), 'first')
+        self.assertEqual(open(second.path).read(), 'second')
+        self.assertEqual(self.sink.path('http://localhost/a/../../b'),
+                         self.directory + '/a/b')
+
+    def test_ranges(self):
+        """Write byte ranges concurrently, check they land in place."""
+        output = self.sink.open(self.URL)
+        threads = [threading.Thread(target=output.write,
+                                    args=(index * 10, str(index) * 10))
+                   for index in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.sink.written(output)
+        self.assertEqual(output.unsynced, 0)
+        self.sink.stop()
+        self.assertEqual(open(output.path).read(),
+                         ''.join(str(index) * 10 for index in range(10)))
+        self.assertRaises(IOError, output.write, 0, 'late')
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    BODY = ''.join(chr(index % 256) for index in range(200000))
+    connections = 0
+
+    def setup(self):
+        _Handler.connections += 1
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        body = self.BODY
+        if self.headers.get('Range'):
+            start, end = self.headers['Range'].split('=')[1].split('-')
+            body = body[int(start):int(end) + 1]
+        if self.path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(body), 70000):
+                chunk = body[start:start + 70000]
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write('0\r\n\r\n')
+        else:
+            self.send_response(206 if self.headers.get('Range') else 200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+class _Collector(object):
+
+    def __init__(self):
+        self.status = None
+        self.chunks = []
+        self.error = None
+        self.finished = threading.Event()
+
+    def response(self, status_code, headers, connected_at):
+        self.status = status_code
+        self.connected_at = connected_at
+        return status_code < 400
+
+    def chunk(self, chunk):
+        self.chunks.append(chunk)
+
+    def done(self, error):
+        self.error = error
+        self.finished.set()
+
+class TestEngine(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = _Server(('127.0.0.1', 0), _Handler)
+        cls.url = 'http://127.0.0.1:%s' % cls.server.server_address[1]
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cls.engine = engine.Engine(timeout=5)
+        thread = threading.Thread(target=cls.engine.run)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def _fetch(self, path, headers={}):
+        collector = _Collector()
+        self.engine.call_soon(self.engine.fetch,
+                              (self.url + path, headers, collector))
+        self.assertTrue(collector.finished.wait(5))
+        return collector
+
+    def test_keep_alive(self):
+        """Fetch ranged and chunked bodies, check connection is reused."""
+        connections = _Handler.connections
+        collector = self._fetch('/', {'Range': 'bytes=100-99999'})
+        self.assertEqual((collector.status, collector.error), (206, None))
+        self.assertEqual(''.join(collector.chunks), _Handler.BODY[100:100000])
+        collector = self._fetch('/chunked')
+        self.assertEqual((collector.status, collector.error), (200, None))
+        self.assertEqual(''.join(collector.chunks), _Handler.BODY)
+        self.assertEqual(_Handler.connections, connections + 1)
+        self.assertTrue(collector.connected_at <= time.time())
+
+    def test_abandon(self):
+        """Fetch a missing item, check the response is abandoned."""
+        collector = self._fetch('/missing')
+        self.assertEqual((collector.status, collector.error),
+                         (404, 'abandoned'))
+        self.assertEqual(collector.chunks, [])
+
+    def test_unresolvable(self):
+        """Fetch from a host which cannot be resolved, check it fails."""
+        collector = _Collector()
+        self.engine.call_soon(self.engine.fetch,
+                              ('http://host.invalid/', {}, collector))
+        self.assertTrue(collector.finished.wait(5))
+        self.assertEqual(collector.status, None)
+        self.assertTrue(collector.error)
+
+class TestMemorySink(unittest.TestCase):
+
+    def test_checksums(self):
+        """Write payloads to a small ring, check the log and contents."""
+        log = MagicMock()
+        memory_sink = sink.MemorySink(64, log=log)
+        data = ''.join(chr(index) for index in range(100))
+        for url, payload in [('a', data[:30]), ('b', data[30:])]:
+            output = memory_sink.open(url)
+            offset = 1000
+            for start in range(0, len(payload), 16):
+                offset = output.write(offset, payload[start:start + 16])
+            self.assertEqual(offset, 1000 + len(payload))
+            memory_sink.written(output)
+        self.assertEqual(memory_sink.path('a'), '')
+        self.assertEqual(memory_sink.contents(), data[-64:])
+        self.assertEqual(log.write.call_args[0][0], 'b,1000,70,%08x\n' %
+                         (zlib.adler32(data[30:]) & 0xffffffff))
+        memory_sink.stop()
+        log.close.assert_called_once_with()
+        writes = log.write.call_count
+        memory_sink.written(output)
+        self.assertEqual(log.write.call_count, writes)
+
+class TestHedging(unittest.TestCase):
+
+    def setUp(self):
+        self.player = MagicMock()
+        self.player.start_thread = self._start_thread
+        self.player.managed_objects['representations'].ladder = [100, 200]
+        self.report = {'hedges': 0, 'hedge_wins': 0, 'abandonments': 0}
+
+    def _start_thread(self, target, args=()):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _representation(self, url, bandwidth):
+        return {'item': {'url': url, 'duration': 2}, 'time': 4,
+                'bandwidth': bandwidth}
+
+    def test_threshold(self):
+        """Record download times, check the percentile used to hedge."""
+        hedger = hedging.Hedger(self.player, percentile=90)
+        for latency in range(1, hedger.minimum_history):
+            hedger.latencies.append(latency)
+        self.assertEqual(hedger.threshold(), None)
+        hedger.latencies.append(hedger.minimum_history)
+        self.assertEqual(hedger.threshold(), 10)
+
+    def test_abandon(self):
+        """Download slowly, check abandonment depends on the buffer."""
+        control = hedging.Control(self.player, abandon=True)
+        control.start -= 1
+        self.player.buffer_level.return_value = 20
+        self.assertTrue(control.proceed(100, 1000))
+        self.player.buffer_level.return_value = 2
+        self.assertFalse(control.proceed(100, 1000))
+        self.assertEqual(control.reason, 'abandoned')
+
+    def test_hedge(self):
+        """Stall a download, check a hedge at the lowest bitrate wins."""
+        lowest = self._representation('fast', 100)
+        self.player.managed_objects['representations'].alternative.\
+            return_value = lowest
+        controls = []
+
+        def fetch_item(item, control):
+            controls.append(control)
+            if item['url'] == 'slow':
+                control.cancelled.wait(5)
+        self.player.fetch_item = fetch_item
+        hedger = hedging.Hedger(self.player, percentile=50, lower=True)
+        hedger.latencies.extend([0.01] * hedger.minimum_history)
+        result = hedger.fetch(self._representation('slow', 200), self.report)
+        self.assertEqual(result['item']['url'], 'fast')
+        self.assertEqual(self.report, {'hedges': 1, 'hedge_wins': 1,
+                                       'abandonments': 0})
+        self.assertEqual(controls[0].reason, 'lost')
+        self.assertTrue(hedger.latencies[-1] >= 0.01)
+
+    def test_threads(self):
+        """Start many short threads, check finished ones are forgotten."""
+        player_ = player.Player.__new__(player.Player)
+        player_.threads = []
+        player_._threads_lock = threading.Lock()
+        for _ in range(50):
+            player_.start_thread(time.sleep, (0,)).join()
+        self.assertEqual(len(player_.threads), 1)
+
+class TestOrigin(unittest.TestCase):
+
+    MPD = 'BigBuckBunny_2s_template.mpd'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        shutil.copy('examples/mpd/' + cls.MPD, cls.directory)
+        cls.server = origin.Origin(('127.0.0.1', 0), cls.directory)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.directory)
+
+    def _get(self, url, headers={}):
+        request = urllib2.Request(url, headers=headers)
+        response = urllib2.urlopen(request)
+        return response.getcode(), response.info(), response.read()
+
+    def test_range(self):
+        """Parse Range headers, including suffixes and unsatisfiable ones."""
+        self.assertEqual(origin.parse_range(None, 100), (0, 99))
+        self.assertEqual(origin.parse_range('bytes=10-', 100), (10, 99))
+        self.assertEqual(origin.parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(origin.parse_range('bytes=50-500', 100), (50, 99))
+        self.assertEqual(origin.parse_range('bytes=100-', 100), None)
+        self.assertRaises(ValueError, origin.parse_range, 'bytes=1-2,4-5',
+                          100)
+
+    def test_serve(self):
+        """Fetch an MPD, its initialisation and part of a segment."""
+        _, _, manifest = self._get(self.server.url + self.MPD)
+        base_url = self.server.url + 'ftp/datasets/mmsys12/BigBuckBunny/' \
+            'bunny_2s/bunny_2s_200kbit/'
+        self.assertIn(self.server.url, manifest)
+        _, _, data = self._get(base_url + 'init.mp4')
+        self.assertEqual(mp4.video_bitrate(data), (176031, 176031))
+        status, info, data = self._get(base_url + 'bunny_2s7.m4s',
+                                       {'Range': 'bytes=1000-1999'})
+        self.assertEqual(status, 206)
+        self.assertEqual(info['Content-Range'], 'bytes 1000-1999/%s' %
+                         (176031 * 2 / 8))
+        self.assertEqual(data, origin.PATTERN[1000:2000])
+
+class TestTraffic(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+
+    def _sleep(self, seconds):
+        self.now += seconds
+
+    def test_load(self):
+        """Load a trace with a header, check it is replayed in a loop."""
+        path = tempfile.mktemp()
+        with open(path, 'w') as file_:
+            file_.write('time,throughput,latency\n5,1000,20\n10 500 40\n')
+        trace = traffic.Trace.load(path)
+        os.remove(path)
+        self.assertEqual(trace.at(2), (1000000, 0.02, 3))
+        self.assertEqual(trace.at(7), (500000, 0.04, 3))
+        self.assertEqual(trace.at(11), (1000000, 0.02, 4))
+
+    def test_shaper(self):
+        """Consume bits across a change in throughput, check the time."""
+        trace = traffic.Trace([(0, 1000, 0.1), (1, 500, 0.2), (2, 500, 0.2)])
+        shaper = traffic.Shaper(trace, 100, clock=lambda: self.now,
+                                sleep=self._sleep)
+        shaper.delay()
+        self.assertAlmostEqual(self.now, 0.1)
+        shaper.consume(900)
+        self.assertAlmostEqual(self.now, 0.9)
+        shaper.consume(1000)
+        self.assertAlmostEqual(self.now, 2.8, places=2)
+
+class TestReplay(unittest.TestCase):
+
+    def _load(self, contents):
+        path = tempfile.mktemp()
+        with open(path, 'w') as file_:
+            file_.write(contents)
+        schedule = replay.Schedule.load(path)
+        os.remove(path)
+        return list(schedule)
+
+    def test_requests(self):
+        """Load the requests of a previous run, check their start times."""
+        self.assertEqual(self._load(
+            'elapsed_time,url,bytes_from,bytes_to,total\n'
+            '3.5,http://localhost/b.mp4,100,199,1.0\n'
+            '2.0,http://localhost/a.mp4,0,99,0.5\n'),
+            [(0, 'http://localhost/a.mp4', 0, 99),
+             (1.0, 'http://localhost/b.mp4', 100, 199)])
+
+    def test_events(self):
+        """Load the events of a previous run, check downloads are found."""
+        self.assertEqual(self._load(
+            '1.0,start,downloading http://localhost/1.m4s\n'
+            '1.5,stop,downloading http://localhost/1.m4s (800b)\n'
+            '1.5,empty,playback buffer ; stalled\n'
+            '3.0,start,downloading http://localhost/2.m4s\n'),
+            [(0, 'http://localhost/1.m4s', 0, 0),
+             (2.0, 'http://localhost/2.m4s', 0, 0)])
+
+class TestSimulation(unittest.TestCase):
+
+    MPD = TestOrigin.MPD
+
+    def test_clock(self):
+        """Poll until a download fails, check the clock jumps to each event."""
+        trace = traffic.Trace([(0, 1000, 0.5)])
+        simulation_ = simulation.Simulation(trace, start=0)
+        collector = _Collector()
+        times = []
+
+        def step():
+            times.append(simulation_.time())
+            if not collector.finished.is_set():
+                return 0.01
+            return None
+
+        simulation_.call_later(5, times.append, ('timer',))
+        simulation_.fetch('http://localhost/missing', {}, collector)
+        simulation_.loop(step)
+        simulation_.run()
+        self.assertEqual(times, [0, 0.5, 'timer'])
+        self.assertEqual(simulation_.time(), 5)
+
+    def test_retired(self):
+        """Retire a polling download queue, check it is no longer polled."""
+        simulation_ = simulation.Simulation(start=0)
+        player_ = MagicMock()
+        player_.options = Options()
+        player_.simulation = simulation_
+        player_.start_loop = lambda step: simulation_.loop(step, player_)
+        download_queue = queue.download.DownloadQueue(player=player_,
+                                                      time_buffer_max=100)
+        download_queue.resume()
+        simulation_.run()
+        self.assertEqual(len(simulation_._waiting[player_]), 1)
+        download_queue.retired = True
+        steps = iter([0, None])
+        simulation_.loop(lambda: next(steps), player_)
+        simulation_.run()
+        self.assertEqual(simulation_._waiting, {})
+
+    def test_fetch(self):
+        """Fetch segments over a shaped link, check they are sent in turn."""
+        directory = tempfile.mkdtemp()
+        shutil.copy('examples/mpd/' + self.MPD, directory)
+        trace = traffic.Trace([(0, 1000000, 0.1)])
+        simulation_ = simulation.Simulation(trace, start=0)
+        simulation_.add_manifest(os.path.join(directory, self.MPD))
+        shutil.rmtree(directory)
+        url = 'http://localhost/ftp/datasets/mmsys12/BigBuckBunny/' \
+            'bunny_2s/bunny_2s_200kbit/bunny_2s7.m4s'
+        times = []
+        collectors = [_Collector(), _Collector(), _Collector()]
+        for collector in collectors:
+            collector.done = lambda error: times.append(simulation_.time())
+        simulation_.fetch(url, {}, collectors[0])
+        simulation_.fetch(url, {'Range': 'bytes=0-12499'}, collectors[1])
+        simulation_.fetch(url + '.missing', {}, collectors[2])
+        simulation_.run()
+        self.assertEqual([collector.status for collector in collectors],
+                         [200, 206, 404])
+        self.assertEqual(sum(len(chunk) for chunk in collectors[0].chunks),
+                         176031 * 2 / 8)
+        self.assertAlmostEqual(times[0], 0.1)
+        self.assertAlmostEqual(times[1], 0.1 + 0.352056)
+        self.assertAlmostEqual(times[2], 0.1 + 0.352056 + 0.1)
+
+class TestFleet(unittest.TestCase):
+
+    def test_share(self):
+        """Add players to a fleet, check they share the first's resources."""
+        fleet_ = fleet.Fleet(Options(), 2)
+        players = [MagicMock(), MagicMock()]
+        for index, player_ in enumerate(players):
+            player_.name = 'client%s' % index
+            fleet_.share(player_)
+        players[0].create_resources.assert_called_once_with()
+        self.assertFalse(players[1].create_resources.called)
+        for name in fleet.SHARED:
+            self.assertIs(getattr(players[1], name),
+                          getattr(players[0], name))
+        with patch('os._exit') as exit_:
+            fleet_.exited(players[0])
+            self.assertFalse(exit_.called)
+            fleet_.exited(players[1])
+            exit_.assert_called_once_with(0)
+
 # class TestDirectoryFunctions(unittest.TestCase):
 #
 #     def test_create(self):